@@ -21,6 +21,11 @@ def get_barnett_daily(wildcards):
         return "data/interim/{pid}/phone_locations_barnett_daily.csv"
     return []
 
+def get_barnett_trace(wildcards):
+    if wildcards.provider_key.upper() == "BARNETT":
+        return "data/interim/{pid}/phone_locations_barnett_mobility_trace.parquet"
+    return []
+
 def get_locations_python_input(wildcards):
     if wildcards.provider_key.upper() == "DORYAB":
         return "data/interim/{pid}/phone_locations_processed_with_datetime_with_doryab_columns_episodes_resampled_with_datetime.csv"
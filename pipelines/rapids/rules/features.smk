@@ -387,7 +387,8 @@ rule phone_locations_add_doryab_extra_columns:
 rule phone_locations_python_features:
     input:
         sensor_data = get_locations_python_input,
-        time_segments_labels = "data/interim/time_segments/{pid}_time_segments_labels.csv"
+        time_segments_labels = "data/interim/time_segments/{pid}_time_segments_labels.csv",
+        barnett_trace = get_barnett_trace
     params:
         provider = lambda wildcards: config["PHONE_LOCATIONS"]["PROVIDERS"][wildcards.provider_key.upper()],
         provider_key = "{provider_key}",
@@ -408,6 +409,16 @@ rule phone_locations_barnett_daily_features:
     script:
         "../src/features/phone_locations/barnett/daily_features.R"
 
+rule phone_locations_barnett_mobility_trace:
+    input:
+        sensor_data = "data/interim/{pid}/phone_locations_processed_with_datetime.csv",
+    params:
+        provider = lambda wildcards: config["PHONE_LOCATIONS"]["PROVIDERS"]["BARNETT"],
+    output:
+        "data/interim/{pid}/phone_locations_barnett_mobility_trace.parquet"
+    script:
+        "../src/features/phone_locations/barnett/mobility_trace.py"
+
 rule phone_locations_r_features:
     input:
         sensor_data = "data/interim/{pid}/phone_locations_processed_with_datetime.csv",
@@ -624,6 +635,7 @@ rule fitbit_heartrate_summary_r_features:
 rule fitbit_heartrate_intraday_python_features:
     input:
         sensor_data = "data/raw/{pid}/fitbit_heartrate_intraday_with_datetime.csv",
+        minute_grid = "data/interim/{pid}/fitbit_heartrate_intraday_minute_grid",
         time_segments_labels = "data/interim/time_segments/{pid}_time_segments_labels.csv"
     params:
         provider = lambda wildcards: config["FITBIT_HEARTRATE_INTRADAY"]["PROVIDERS"][wildcards.provider_key.upper()],
@@ -209,6 +209,18 @@ rule fitbit_steps_intraday_exclude_sleep:
     script:
         "../src/data/fitbit_steps_intraday_exclude_sleep.py"
 
+rule fitbit_intraday_minute_grid:
+    input:
+        sensor_data = "data/raw/{pid}/fitbit_{sensor}_intraday_with_datetime.csv"
+    params:
+        sensor = "{sensor}"
+    wildcard_constraints:
+        sensor = "(heartrate|steps)"
+    output:
+        directory("data/interim/{pid}/fitbit_{sensor}_intraday_minute_grid")
+    script:
+        "../src/data/fitbit_intraday_minute_grid.py"
+
 rule empatica_readable_datetime:
     input:
         sensor_input = "data/raw/{pid}/empatica_{sensor}_raw.csv",
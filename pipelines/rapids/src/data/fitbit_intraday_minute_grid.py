@@ -0,0 +1,21 @@
+import pandas as pd
+from utils.minute_grid import write_minute_grid
+
+# Columns read from the intraday data of each sensor
+SENSOR_COLUMNS = {"heartrate": ["heartrate", "heartrate_zone"], "steps": ["steps"]}
+HEARTRATE_ZONES = ["outofrange", "fatburn", "cardio", "peak"]
+
+# Signals of each intraday sensor: {grid signal: (sample values, reducer of the samples of a minute)}
+# Heartrate can be sampled every few seconds, so the number of samples per minute (overall and on each heart rate zone,
+# fitbit_heartrate_intraday computes minutesonXzone from them) is kept next to their mean
+def grid_signals(sensor, sensor_data):
+    if sensor == "heartrate":
+        signals = {"heartrate": (sensor_data["heartrate"], "mean"), "heartrate_samples": (sensor_data["heartrate"], "size")}
+        signals.update({zone + "_samples": (sensor_data["heartrate_zone"] == zone, "sum") for zone in HEARTRATE_ZONES})
+        return signals
+    return {"steps": (sensor_data["steps"], "sum")}
+
+sensor = snakemake.params["sensor"]
+sensor_data = pd.read_csv(snakemake.input["sensor_data"], usecols=["local_date_time"] + SENSOR_COLUMNS[sensor])
+
+write_minute_grid(snakemake.output[0], sensor_data["local_date_time"], grid_signals(sensor, sensor_data))
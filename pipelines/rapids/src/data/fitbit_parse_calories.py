@@ -1,7 +1,6 @@
-import json
 import numpy as np
 import pandas as pd
-from datetime import datetime
+from intraday_json import parse_intraday_records
 
 
 CALORIES_INTRADAY_COLUMNS = ("device_id",
@@ -12,24 +11,13 @@ def parseCaloriesData(calories_data):
     if calories_data.empty:
         return pd.DataFrame(), pd.DataFrame(columns=CALORIES_INTRADAY_COLUMNS)
     device_id = calories_data["device_id"].iloc[0]
-    records_intraday = []
-    # Parse JSON into individual records
-    for record in calories_data.fitbit_data:
-        record = json.loads(record)  # Parse text into JSON
-        curr_date = datetime.strptime(
-            record["activities-calories"][0]["dateTime"], "%Y-%m-%d")
-        dataset = record["activities-calories-intraday"]["dataset"]
-        for data in dataset:
-            d_time = datetime.strptime(data["time"], '%H:%M:%S').time()
-            d_datetime = datetime.combine(curr_date, d_time)
-
-            row_intraday = (device_id,
-                            data["level"], data["mets"], data["value"],
-                            d_datetime, 0)
-
-            records_intraday.append(row_intraday)
-
-    return pd.DataFrame(data=[], columns=["local_date_time", "timestamp"]), pd.DataFrame(data=records_intraday, columns=CALORIES_INTRADAY_COLUMNS)
+    # Parse JSON into columns of intraday samples
+    _, _, columns, local_date_time = parse_intraday_records(calories_data.fitbit_data, "activities-calories", "activities-calories-intraday", ["level", "mets", "value"])
+    records_intraday = pd.DataFrame({"device_id": device_id,
+                                     "level": columns["level"], "mets": columns["mets"], "value": columns["value"],
+                                     "local_date_time": pd.to_datetime(local_date_time, format="%Y-%m-%d %H:%M:%S"), "timestamp": 0}, columns=CALORIES_INTRADAY_COLUMNS)
+
+    return pd.DataFrame(data=[], columns=["local_date_time", "timestamp"]), records_intraday
 
 table_format = snakemake.params["table_format"]
 timezone = snakemake.params["timezone"]
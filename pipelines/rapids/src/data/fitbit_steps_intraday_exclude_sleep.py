@@ -1,7 +1,36 @@
+import numpy as np
 import pandas as pd
 from datetime import timedelta
 
 
+# Nanoseconds since the epoch of "%Y-%m-%d %H:%M:%S" local date times, so intervals are compared as integers
+def to_nanoseconds(local_date_times):
+    return pd.to_datetime(local_date_times).values.astype(np.int64)
+
+# Union of closed [start, end] intervals as sorted, disjoint intervals. Intervals that end before they start are empty
+def merge_intervals(starts, ends):
+    valid = starts <= ends
+    order = np.argsort(starts[valid], kind="stable")
+    starts, ends = starts[valid][order], np.maximum.accumulate(ends[valid][order])
+    # a new interval begins wherever a start comes after every previous end
+    is_first = np.r_[True, starts[1:] > ends[:-1]] if len(starts) else np.zeros(0, dtype=bool)
+    last = np.r_[np.flatnonzero(is_first)[1:] - 1, len(starts) - 1] if len(starts) else np.zeros(0, dtype=np.int64)
+    return starts[is_first], ends[last]
+
+# Whether each time falls within any of the sorted, disjoint closed intervals
+def in_intervals(times, starts, ends):
+    interval_index = np.searchsorted(starts, times, side="right") - 1
+    return (interval_index >= 0) & (times <= ends[np.maximum(interval_index, 0)]) if len(starts) else np.zeros(len(times), dtype=bool)
+
+# Whether each [start, end] interval overlaps (with a positive length) any of the other intervals
+def overlaps_any(starts, ends, other_starts, other_ends):
+    order = np.argsort(other_starts, kind="stable")
+    other_starts, latest_ends = other_starts[order], np.maximum.accumulate(other_ends[order])
+    # among the other intervals starting before each end, the latest end has to come after its start
+    preceding = np.searchsorted(other_starts, ends, side="left") - 1
+    return (preceding >= 0) & (latest_ends[np.maximum(preceding, 0)] > starts) if len(other_starts) else np.zeros(len(starts), dtype=bool)
+
+
 exclude_sleep = snakemake.params["exclude_sleep"]
 exclude_time_based = exclude_sleep["TIME_BASED"]["EXCLUDE"]
 exclude_fitbit_based = exclude_sleep["FITBIT_BASED"]["EXCLUDE"]
@@ -20,7 +49,8 @@ if not steps_intraday_data.empty:
 
     elif exclude_fitbit_based and (not sleep_data.empty):
 
-        queries = []
+        sleep_starts, sleep_ends = to_nanoseconds(sleep_data["local_start_date_time"]), to_nanoseconds(sleep_data["local_end_date_time"])
+        interval_starts, interval_ends = sleep_starts, sleep_ends
 
         if exclude_time_based:
 
@@ -28,20 +58,15 @@ if not steps_intraday_data.empty:
             fixed_start_dates = pd.date_range(steps_intraday_data["local_date"].min() - timedelta(days=1), steps_intraday_data["local_date"].max())
             fixed_end_dates = fixed_start_dates + timedelta(days=1) if exclude_sleep_fixed_start >= exclude_sleep_fixed_end else fixed_start_dates
 
-            fixed_time = pd.DataFrame({"fixed_start_date_time": fixed_start_dates.strftime("%Y-%m-%d") + " " + exclude_sleep_fixed_start,
-                            "fixed_end_date_time": fixed_end_dates.strftime("%Y-%m-%d") + " " + exclude_sleep_fixed_end})
-            
-            # Remove fixed intervals that intersect with sleep intervals from the fixed sleep periods
-            sleep_data["query_intersect"] = "(fixed_start_date_time < '" + sleep_data["local_end_date_time"] + "' & fixed_end_date_time > '" + sleep_data["local_start_date_time"] + "')"
-            query_string_subtract = "~(" + " | ".join(sleep_data["query_intersect"].tolist()) + ")"
-            fixed_time.query(query_string_subtract, inplace=True)
-            
-            # Add TIME_BASED query to queries
-            queries = ("(local_date_time < '" + fixed_time["fixed_start_date_time"] + "' | local_date_time > '" + fixed_time["fixed_end_date_time"] + "')").tolist()
+            fixed_starts = to_nanoseconds(fixed_start_dates.strftime("%Y-%m-%d") + " " + exclude_sleep_fixed_start)
+            fixed_ends = to_nanoseconds(fixed_end_dates.strftime("%Y-%m-%d") + " " + exclude_sleep_fixed_end)
 
-        # Add FITBIT_BASED query to queries
-        queries = queries + ("(local_date_time < '" + sleep_data["local_start_date_time"] + "' | local_date_time > '" + sleep_data["local_end_date_time"] + "')").tolist()
+            # Remove fixed intervals that intersect with sleep intervals from the fixed sleep periods
+            keep_fixed = ~overlaps_any(fixed_starts, fixed_ends, sleep_starts, sleep_ends)
+            interval_starts, interval_ends = np.r_[fixed_starts[keep_fixed], sleep_starts], np.r_[fixed_ends[keep_fixed], sleep_ends]
 
-        steps_intraday_data.query(" & ".join(queries), inplace=True)
+        # Drop the steps within any TIME_BASED or FITBIT_BASED interval
+        interval_starts, interval_ends = merge_intervals(interval_starts, interval_ends)
+        steps_intraday_data = steps_intraday_data[~in_intervals(to_nanoseconds(steps_intraday_data["local_date_time"]), interval_starts, interval_ends)]
 
 steps_intraday_data.to_csv(snakemake.output[0], index=False)
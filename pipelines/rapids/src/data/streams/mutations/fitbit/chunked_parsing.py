@@ -0,0 +1,45 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Shared by the Fitbit JSON mutation scripts, it is not a mutation script itself.
+
+# JSON records (rows of json_fitbit_column) parsed by a worker at a time
+CHUNK_RECORDS = 500
+
+
+def split_into_chunks(json_raw, chunk_records=CHUNK_RECORDS):
+    return [json_raw.iloc[start:start + chunk_records] for start in range(0, len(json_raw), chunk_records)]
+
+# Concatenate the frames parsed from consecutive chunks once. Categorical columns (e.g. heartrate_zone) are combined
+# with union_categoricals because pd.concat turns categoricals with different categories into objects
+def concat_parsed_chunks(parsed_chunks):
+    non_empty_chunks = [parsed_chunk for parsed_chunk in parsed_chunks if not parsed_chunk.empty]
+    if len(non_empty_chunks) == 0:
+        return parsed_chunks[0]
+    if len(non_empty_chunks) == 1:
+        return non_empty_chunks[0].reset_index(drop=True)
+
+    categorical_columns = [column for column, dtype in non_empty_chunks[0].dtypes.items() if isinstance(dtype, pd.CategoricalDtype)]
+    parsed_data = pd.concat([parsed_chunk.drop(columns=categorical_columns) for parsed_chunk in non_empty_chunks], ignore_index=True)
+    for column in categorical_columns:
+        parsed_data[column] = union_categoricals([parsed_chunk[column] for parsed_chunk in non_empty_chunks])
+    return parsed_data[non_empty_chunks[0].columns]
+
+# Map parse_function (e.g. parseHeartrateData) over chunks of chunk_records JSON records of json_raw.
+# parse_function has to handle each record independently so its output does not depend on how records are chunked.
+# Chunks are dispatched to a process pool when workers > 1 (the PARSER_WORKERS key of the Fitbit stream parameters),
+# otherwise json_raw is parsed at once.
+# The R pullers run these scripts in the Python embedded by reticulate, which is not safe to fork, so workers are started
+# with spawn. Spawned workers import parse_function's module by name, so this folder has to be on their PYTHONPATH
+# (the Snakefile sets it for every job)
+def parse_in_chunks(parse_function, json_raw, workers=1, chunk_records=CHUNK_RECORDS):
+    if workers <= 1 or len(json_raw) <= chunk_records:
+        return parse_function(json_raw)
+
+    chunks = split_into_chunks(json_raw, chunk_records)
+    with ProcessPoolExecutor(max_workers=min(workers, len(chunks)), mp_context=multiprocessing.get_context("spawn")) as executor:
+        parsed_chunks = list(executor.map(parse_function, chunks))
+    return concat_parsed_chunks(parsed_chunks)
+
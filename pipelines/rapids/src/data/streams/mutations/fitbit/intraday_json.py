@@ -0,0 +1,50 @@
+import itertools
+import numpy as np
+import pandas as pd
+from datetime import datetime
+try:
+    # orjson decodes each JSON record several times faster than the standard library
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Shared by the intraday mutation scripts (heartrate, steps, calories), it is not a mutation script itself
+
+
+# Whether all times are zero padded "%H:%M:%S" strings, checked on their characters instead of parsing each one
+def is_padded_time_of_day(times):
+    if len(times) == 0 or times.dtype.itemsize != 8 * np.dtype("U1").itemsize:
+        return len(times) == 0
+    characters = times.view(np.uint32).reshape(len(times), 8)
+    digits = characters[:, [0, 1, 3, 4, 6, 7]]
+    return bool(np.all(characters[:, [2, 5]] == ord(":")) and np.all((digits >= ord("0")) & (digits <= ord("9"))))
+
+# "%Y-%m-%d %H:%M:%S" strings of each date (one per record) plus the times of day of its samples
+def format_local_date_times(dates, times, lengths):
+    dates = [datetime.strptime(date, "%Y-%m-%d").strftime("%Y-%m-%d") for date in dates]
+    if is_padded_time_of_day(times):
+        # already in the output format, concatenating the strings is enough
+        return np.repeat(np.array([date + " " for date in dates], dtype=object), lengths) + times.astype(object)
+    local_date_times = pd.to_datetime(np.repeat(dates, lengths)) + pd.to_timedelta(times)
+    return local_date_times.strftime("%Y-%m-%d %H:%M:%S").to_numpy(dtype=object)
+
+# Decode the JSON records of a Fitbit intraday resource and extract the samples of their datasets as columns.
+# summary_key (e.g. activities-heart) has the date of a record and intraday_key (e.g. activities-heart-intraday) its
+# samples, records without both keys have no samples. Returns the decoded records, the index of the record of each
+# sample, a numpy array with the values of each field of the samples and their local_date_time strings
+def parse_intraday_records(json_column, summary_key, intraday_key, fields):
+    records = [json_loads(record) for record in json_column]
+
+    record_ids, dates, datasets = [], [], []
+    for record_id, record in enumerate(records):
+        if summary_key in record and intraday_key in record:
+            record_ids.append(record_id)
+            dates.append(record[summary_key][0]["dateTime"])
+            datasets.append(record[intraday_key]["dataset"])
+    lengths = np.array([len(dataset) for dataset in datasets], dtype=np.int64)
+    samples = list(itertools.chain.from_iterable(datasets))
+
+    columns = {field: np.array([sample[field] for sample in samples]) for field in fields}
+    times = np.array([sample["time"] for sample in samples], dtype=str)
+    local_date_time = format_local_date_times(dates, times, lengths)
+    return records, np.repeat(np.array(record_ids, dtype=np.int64), lengths), columns, local_date_time
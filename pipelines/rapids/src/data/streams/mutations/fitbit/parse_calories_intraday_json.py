@@ -1,6 +1,6 @@
-import json
 import pandas as pd
-from datetime import datetime
+from intraday_json import parse_intraday_records
+from chunked_parsing import parse_in_chunks
 
 CALORIES_INTRADAY_COLUMNS = ("device_id", "level", "mets", "value", "local_date_time", "timestamp")
 
@@ -8,23 +8,19 @@ def parseCaloriesData(calories_data):
     if calories_data.empty:
         return pd.DataFrame(columns=CALORIES_INTRADAY_COLUMNS)
     device_id = calories_data["device_id"].iloc[0]
-    records_intraday = []
 
-    # Parse JSON into individual records
-    for record in calories_data.json_fitbit_column:
-        record = json.loads(record)  # Parse text into JSON
-        if "activities-calories" in record and "activities-calories-intraday" in record:
-            curr_date = datetime.strptime(record["activities-calories"][0]["dateTime"], "%Y-%m-%d")
-            dataset = record["activities-calories-intraday"]["dataset"]
-            for data in dataset:
-                d_time = datetime.strptime(data["time"], '%H:%M:%S').time()
-                d_datetime = datetime.combine(curr_date, d_time).strftime("%Y-%m-%d %H:%M:%S")
-                row_intraday = (device_id, data["level"], data["mets"], data["value"], d_datetime, 0)
-                records_intraday.append(row_intraday)
-
-    return pd.DataFrame(data=records_intraday, columns=CALORIES_INTRADAY_COLUMNS)
+    # Parse JSON into columns of intraday samples
+    _, _, columns, local_date_time = parse_intraday_records(calories_data.json_fitbit_column, "activities-calories", "activities-calories-intraday", ["level", "mets", "value"])
+    if len(local_date_time) == 0:
+        return pd.DataFrame(columns=CALORIES_INTRADAY_COLUMNS)
+    return pd.DataFrame({"device_id": device_id,
+                         "level": columns["level"],
+                         "mets": columns["mets"],
+                         "value": columns["value"],
+                         "local_date_time": local_date_time,
+                         "timestamp": 0}, columns=CALORIES_INTRADAY_COLUMNS)
 
 def main(json_raw, stream_parameters):
-    parsed_data = parseCaloriesData(json_raw)
+    parsed_data = parse_in_chunks(parseCaloriesData, json_raw, workers=stream_parameters.get("PARSER_WORKERS", 1))
     parsed_data["mets"] = parsed_data["mets"] / 10
     return parsed_data
@@ -1,6 +1,7 @@
-import json
+import numpy as np
 import pandas as pd
-from datetime import datetime
+from intraday_json import parse_intraday_records
+from chunked_parsing import parse_in_chunks
 
 
 HR_INTRADAY_COLUMNS = ("device_id",
@@ -29,26 +30,27 @@ def parseHeartrateZones(heartrate_data):
     return heartrate_zones_range
 
 
-def parseHeartrateIntradayData(records_intraday, dataset, device_id, curr_date, heartrate_zones_range):
-    for data in dataset:
-        d_time = datetime.strptime(data["time"], '%H:%M:%S').time()
-        d_datetime = datetime.combine(curr_date, d_time).strftime("%Y-%m-%d %H:%M:%S")
-        d_hr =  data["value"]
+def parseHeartrateIntradayZones(heartrate, heartrate_zones_range):
+    # Get heartrate zone by range: min <= heartrate <= max, the first zone that matches wins.
+    # Returns the index of the zone of each heartrate in heartrate_zones_range (-1 when no zone matches).
+    # The zone bounds split heartrates into pieces: below the first bound, each bound, between two bounds and above the
+    # last bound. The zone of each piece is found once and heartrates are mapped to their piece with searchsorted
+    zones = list(heartrate_zones_range.values())
+    bounds = np.unique(np.array(zones, dtype=np.float64).reshape(-1))
+    representatives = np.empty(2 * len(bounds) + 1)
+    representatives[0], representatives[-1] = bounds[0] - 1, bounds[-1] + 1
+    representatives[1::2] = bounds
+    representatives[2:-1:2] = (bounds[:-1] + bounds[1:]) / 2
+    piece_zones = np.full(len(representatives), -1, dtype=np.int64)
+    for zone_index in reversed(range(len(zones))):
+        piece_zones[(representatives >= zones[zone_index][0]) & (representatives <= zones[zone_index][1])] = zone_index
 
-        # Get heartrate zone by range: min <= heartrate < max
-        d_hrzone = None
-        for hrzone, hrrange in heartrate_zones_range.items():
-            if d_hr >= hrrange[0] and d_hr <= hrrange[1]:
-                d_hrzone = hrzone
-                break
-
-        row_intraday = (device_id,
-                        d_hr, d_hrzone,
-                        d_datetime,
-                        0)
-
-        records_intraday.append(row_intraday)
-    return records_intraday
+    heartrate = np.asarray(heartrate, dtype=np.float64)
+    bound_index = np.searchsorted(bounds, heartrate, side="left")
+    on_bound = bounds[np.minimum(bound_index, len(bounds) - 1)] == heartrate
+    heartrate_zone = piece_zones[2 * bound_index + on_bound]
+    heartrate_zone[np.isnan(heartrate)] = -1
+    return heartrate_zone
 
 
 
@@ -57,25 +59,35 @@ def parseHeartrateData(heartrate_data):
         return pd.DataFrame(columns=HR_INTRADAY_COLUMNS)
 
     device_id = heartrate_data["device_id"].iloc[0]
-    records_intraday = []
 
+    # Parse JSON into columns of intraday samples
+    records, sample_records, columns, local_date_time = parse_intraday_records(heartrate_data.json_fitbit_column, "activities-heart", "activities-heart-intraday", ["value"])
+    if len(local_date_time) == 0:
+        return pd.DataFrame(columns=HR_INTRADAY_COLUMNS)
+    heartrate = columns["value"]
 
-    # Parse JSON into individual records
-    for record in heartrate_data.json_fitbit_column:
-        record = json.loads(record)  # Parse text into JSON
+    # heartrate zones are stored as a categorical of the zone names of all records
+    zone_names = []
+    zone_codes = np.full(len(heartrate), -1, dtype=np.int64)
+    for record_id, record in enumerate(records):
         if "activities-heart" in record:
             heartrate_zones_range = parseHeartrateZones(record)
-            curr_date = datetime.strptime(record["activities-heart"][0]["dateTime"], "%Y-%m-%d")
-
-            if "activities-heart-intraday" in record:
-                dataset = record["activities-heart-intraday"]["dataset"]
-                records_intraday = parseHeartrateIntradayData(records_intraday, dataset, device_id, curr_date, heartrate_zones_range)
-    
-    parsed_data = pd.DataFrame(data=records_intraday, columns=HR_INTRADAY_COLUMNS)
+            # samples of a record are contiguous
+            first, last = np.searchsorted(sample_records, [record_id, record_id + 1])
+            if last > first and len(heartrate_zones_range) > 0:
+                zone_names += [hrzone for hrzone in heartrate_zones_range if hrzone not in zone_names]
+                record_codes = np.array([zone_names.index(hrzone) for hrzone in heartrate_zones_range] + [-1])
+                zone_codes[first:last] = record_codes[parseHeartrateIntradayZones(heartrate[first:last], heartrate_zones_range)]
+
+    parsed_data = pd.DataFrame({"device_id": device_id,
+                                "heartrate": heartrate,
+                                "heartrate_zone": pd.Categorical.from_codes(zone_codes, categories=zone_names),
+                                "local_date_time": local_date_time,
+                                "timestamp": 0}, columns=HR_INTRADAY_COLUMNS)
     return parsed_data
     
 
 
 def main(json_raw, stream_parameters):
-    parsed_data = parseHeartrateData(json_raw)
+    parsed_data = parse_in_chunks(parseHeartrateData, json_raw, workers=stream_parameters.get("PARSER_WORKERS", 1))
     return parsed_data
@@ -1,6 +1,7 @@
 import json
 import pandas as pd
 import numpy as np
+from chunked_parsing import parse_in_chunks
 
 HR_SUMMARY_COLUMNS = ("device_id",
                         "local_date_time",
@@ -65,5 +66,5 @@ def parseHeartrateData(heartrate_data):
     
 
 def main(json_raw, stream_parameters):
-    parsed_data = parseHeartrateData(json_raw)
+    parsed_data = parse_in_chunks(parseHeartrateData, json_raw, workers=stream_parameters.get("PARSER_WORKERS", 1))
     return parsed_data
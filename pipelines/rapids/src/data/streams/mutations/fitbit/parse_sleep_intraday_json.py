@@ -1,8 +1,7 @@
 import json
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-import dateutil.parser
+from datetime import datetime
 
 SLEEP_CODE2LEVEL = ["asleep", "restless", "awake"]
 
@@ -19,32 +18,29 @@ SLEEP_INTRADAY_COLUMNS = ("device_id",
                             "local_date_time",
                             "timestamp")
 
+SLEEP_WINDOW_LENGTH = 30
+
+# Split each entry of levels data into windows of SLEEP_WINDOW_LENGTH seconds, the start time and level of each window
+def splitIntoWindows(levels_data):
+    start_times = pd.to_datetime([data["dateTime"] for data in levels_data]).values
+    windows_per_entry = np.array([data["seconds"] // SLEEP_WINDOW_LENGTH for data in levels_data], dtype=np.int64)
+    levels = np.array([data["level"] for data in levels_data], dtype=object)
+
+    window_index = np.arange(windows_per_entry.sum()) - np.repeat(np.cumsum(windows_per_entry) - windows_per_entry, windows_per_entry)
+    window_start_times = np.repeat(start_times, windows_per_entry) + (window_index * SLEEP_WINDOW_LENGTH).astype("timedelta64[s]")
+    return window_start_times, np.repeat(levels, windows_per_entry)
+
+# Windows of the long data (dateTime, level), the level of the windows that start at the same time as a short data window is "wake"
 def mergeLongAndShortData(data_intraday):
-    long_data = pd.DataFrame(columns=["dateTime", "level"])
-    short_data = pd.DataFrame(columns=["dateTime", "level"])
-
-    window_length = 30
-
-    for data in data_intraday["data"]:
-        counter = 0
-        for times in range(data["seconds"] // window_length):
-            row = {"dateTime": dateutil.parser.parse(data["dateTime"])+timedelta(seconds=counter*window_length), "level": data["level"]}
-            long_data = long_data.append(row, ignore_index = True)
-            counter = counter + 1
-
-    for data in data_intraday["shortData"]:
-        counter = 0
-        for times in range(data["seconds"] // window_length):
-            row = {"dateTime": dateutil.parser.parse(data["dateTime"])+timedelta(seconds=counter*window_length), "level": data["level"]}
-            short_data = short_data.append(row, ignore_index = True)
-            counter = counter + 1
-    long_data.set_index("dateTime",inplace=True)
-    short_data.set_index("dateTime",inplace=True)
-    long_data["level"] = np.where(long_data.index.isin(short_data.index) == True, "wake", long_data["level"])
-    
-    long_data.reset_index(inplace=True)
-    
-    return long_data.values.tolist()
+    long_start_times, long_levels = splitIntoWindows(data_intraday["data"])
+    short_start_times, _ = splitIntoWindows(data_intraday["shortData"])
+
+    short_start_times = np.sort(short_start_times)
+    short_index = np.minimum(np.searchsorted(short_start_times, long_start_times), len(short_start_times) - 1)
+    in_short_data = (short_start_times[short_index] == long_start_times) if len(short_start_times) > 0 else np.zeros(len(long_start_times), dtype=bool)
+    long_levels[in_short_data] = "wake"
+
+    return pd.DataFrame({"dateTime": long_start_times, "level": long_levels})
 
 # Parse one record for sleep API version 1
 def parseOneRecordForV1(record, device_id, d_is_main_sleep, records_intraday, type_episode_id):
@@ -94,13 +90,11 @@ def parseOneRecordForV12(record, device_id, d_is_main_sleep, records_intraday, t
             records_intraday.append(row_intraday)
     else:
         # For sleep type "stages"
-        for data in mergeLongAndShortData(record["levels"]):
-            d_datetime = data[0].strftime("%Y-%m-%d %H:%M:%S")
-            row_intraday = (device_id, type_episode_id, 30,
-                data[1], d_is_main_sleep, sleep_record_type,
-                d_datetime, 0)
-
-            records_intraday.append(row_intraday)
+        long_data = mergeLongAndShortData(record["levels"])
+        d_datetimes = long_data["dateTime"].dt.strftime("%Y-%m-%d %H:%M:%S")
+        records_intraday.extend((device_id, type_episode_id, SLEEP_WINDOW_LENGTH,
+            d_level, d_is_main_sleep, sleep_record_type,
+            d_datetime, 0) for d_level, d_datetime in zip(long_data["level"], d_datetimes))
     
     return records_intraday
     
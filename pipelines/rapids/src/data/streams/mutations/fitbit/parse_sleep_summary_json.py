@@ -1,5 +1,6 @@
 import json
 import pandas as pd
+from chunked_parsing import parse_in_chunks
 
 SLEEP_SUMMARY_COLUMNS = ("device_id", "efficiency",
                                 "minutes_after_wakeup", "minutes_asleep", "minutes_awake", "minutes_to_fall_asleep", "minutes_in_bed",
@@ -55,5 +56,5 @@ def parseSleepData(sleep_data):
 
 
 def main(json_raw, stream_parameters):
-    parsed_data = parseSleepData(json_raw)
+    parsed_data = parse_in_chunks(parseSleepData, json_raw, workers=stream_parameters.get("PARSER_WORKERS", 1))
     return parsed_data
@@ -1,6 +1,6 @@
-import json
 import pandas as pd
-from datetime import datetime
+from intraday_json import parse_intraday_records
+from chunked_parsing import parse_in_chunks
 
 STEPS_COLUMNS = ("device_id", "steps", "local_date_time", "timestamp")
 
@@ -10,33 +10,19 @@ def parseStepsData(steps_data):
         return pd.DataFrame(columns=STEPS_COLUMNS)
 
     device_id = steps_data["device_id"].iloc[0]
-    records = []
-    
-    # Parse JSON into individual records
-    for record in steps_data.json_fitbit_column:
-        record = json.loads(record)  # Parse text into JSON
-        if "activities-steps" in record.keys():
-            curr_date = datetime.strptime(record["activities-steps"][0]["dateTime"], "%Y-%m-%d")
-
-            # Parse intraday data
-            if "activities-steps-intraday" in record.keys():
-                dataset = record["activities-steps-intraday"]["dataset"]
-                for data in dataset:
-                    d_time = datetime.strptime(data["time"], '%H:%M:%S').time()
-                    d_datetime = datetime.combine(curr_date, d_time).strftime("%Y-%m-%d %H:%M:%S")
-
-                    row_intraday = (device_id,
-                        data["value"],
-                        d_datetime,
-                        0)
-
-                    records.append(row_intraday)
-    
-    parsed_data = pd.DataFrame(data=records, columns=STEPS_COLUMNS)
+
+    # Parse JSON into columns of intraday samples
+    _, _, columns, local_date_time = parse_intraday_records(steps_data.json_fitbit_column, "activities-steps", "activities-steps-intraday", ["value"])
+    if len(local_date_time) == 0:
+        return pd.DataFrame(columns=STEPS_COLUMNS)
+    parsed_data = pd.DataFrame({"device_id": device_id,
+                                "steps": columns["value"],
+                                "local_date_time": local_date_time,
+                                "timestamp": 0}, columns=STEPS_COLUMNS)
 
     return parsed_data
 
 
 def main(json_raw, stream_parameters):
-    parsed_data = parseStepsData(json_raw)
+    parsed_data = parse_in_chunks(parseStepsData, json_raw, workers=stream_parameters.get("PARSER_WORKERS", 1))
     return parsed_data
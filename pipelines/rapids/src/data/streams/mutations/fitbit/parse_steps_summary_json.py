@@ -1,5 +1,6 @@
 import json
 import pandas as pd
+from chunked_parsing import parse_in_chunks
 
 STEPS_COLUMNS = ("device_id", "steps", "local_date_time", "timestamp")
 
@@ -30,5 +31,5 @@ def parseStepsData(steps_data):
 
 
 def main(json_raw, stream_parameters):
-    parsed_data = parseStepsData(json_raw)
+    parsed_data = parse_in_chunks(parseStepsData, json_raw, workers=stream_parameters.get("PARSER_WORKERS", 1))
     return parsed_data
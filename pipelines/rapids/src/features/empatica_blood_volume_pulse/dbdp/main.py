@@ -1,43 +1,13 @@
 import pandas as pd
-from scipy.stats import entropy
+from utils.grouped_statistics import STATISTICS, grouped_statistics
 
 
 def statsFeatures(bvp_data, features, bvp_features):
     col_name = "blood_volume_pulse"
-    if "sumbvp" in features:
-        bvp_features["sumbvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].sum()
-    if "maxbvp" in features:
-        bvp_features["maxbvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].max()
-    if "minbvp" in features:
-        bvp_features["minbvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].min()
-    if "avgbvp" in features:
-        bvp_features["avgbvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].mean()
-    if "medianbvp" in features:
-        bvp_features["medianbvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].median()
-    if "modebvp" in features:
-        bvp_features["modebvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "stdbvp" in features:
-        bvp_features["stdbvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].std()
-    if "diffmaxmodebvp" in features:
-        bvp_features["diffmaxmodebvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].max() - \
-                                              bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "diffminmodebvp" in features:
-        bvp_features["diffminmodebvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0]) - \
-                                              bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].min()
-    if "entropybvp" in features:
-        bvp_features["entropybvp"] = bvp_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(entropy)
+    statistics = grouped_statistics(bvp_data, "local_segment", col_name,
+                                    [statistic for statistic in STATISTICS if statistic + "bvp" in features])
+    for statistic in statistics.columns:
+        bvp_features[statistic + "bvp"] = statistics[statistic]
 
     return bvp_features
 
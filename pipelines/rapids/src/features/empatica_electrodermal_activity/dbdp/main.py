@@ -1,43 +1,13 @@
 import pandas as pd
-from scipy.stats import entropy
+from utils.grouped_statistics import STATISTICS, grouped_statistics
 
 
 def statsFeatures(eda_data, features, eda_features):
     col_name = "electrodermal_activity"
-    if "sumeda" in features:
-        eda_features["sumeda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].sum()
-    if "maxeda" in features:
-        eda_features["maxeda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].max()
-    if "mineda" in features:
-        eda_features["mineda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].min()
-    if "avgeda" in features:
-        eda_features["avgeda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].mean()
-    if "medianeda" in features:
-        eda_features["medianeda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].median()
-    if "modeeda" in features:
-        eda_features["modeeda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "stdeda" in features:
-        eda_features["stdeda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].std()
-    if "diffmaxmodeeda" in features:
-        eda_features["diffmaxmodeeda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].max() - \
-                                              eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "diffminmodeeda" in features:
-        eda_features["diffminmodeeda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0]) - \
-                                              eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].min()
-    if "entropyeda" in features:
-        eda_features["entropyeda"] = eda_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(entropy)
+    statistics = grouped_statistics(eda_data, "local_segment", col_name,
+                                    [statistic for statistic in STATISTICS if statistic + "eda" in features])
+    for statistic in statistics.columns:
+        eda_features[statistic + "eda"] = statistics[statistic]
 
     return eda_features
 
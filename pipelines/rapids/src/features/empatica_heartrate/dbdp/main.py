@@ -1,43 +1,13 @@
 import pandas as pd
-from scipy.stats import entropy
+from utils.grouped_statistics import STATISTICS, grouped_statistics
 
 
 def statsFeatures(heartrate_data, features, heartrate_features):
     col_name = "heartrate"
-    if "sumhr" in features:
-        heartrate_features["sumhr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].sum()
-    if "maxhr" in features:
-        heartrate_features["maxhr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].max()
-    if "minhr" in features:
-        heartrate_features["minhr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].min()
-    if "avghr" in features:
-        heartrate_features["avghr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].mean()
-    if "medianhr" in features:
-        heartrate_features["medianhr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].median()
-    if "modehr" in features:
-        heartrate_features["modehr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "stdhr" in features:
-        heartrate_features["stdhr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].std()
-    if "diffmaxmodehr" in features:
-        heartrate_features["diffmaxmodehr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].max() - \
-                                              heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "diffminmodehr" in features:
-        heartrate_features["diffminmodehr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0]) - \
-                                              heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].min()
-    if "entropyhr" in features:
-        heartrate_features["entropyhr"] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(entropy)
+    statistics = grouped_statistics(heartrate_data, "local_segment", col_name,
+                                    [statistic for statistic in STATISTICS if statistic + "hr" in features])
+    for statistic in statistics.columns:
+        heartrate_features[statistic + "hr"] = statistics[statistic]
 
     return heartrate_features
 
@@ -1,43 +1,13 @@
 import pandas as pd
-from scipy.stats import entropy
+from utils.grouped_statistics import STATISTICS, grouped_statistics
 
 
 def statsFeatures(ibi_data, features, ibi_features):
     col_name = "inter_beat_interval"
-    if "sumibi" in features:
-        ibi_features["sumibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].sum()
-    if "maxibi" in features:
-        ibi_features["maxibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].max()
-    if "minibi" in features:
-        ibi_features["minibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].min()
-    if "avgibi" in features:
-        ibi_features["avgibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].mean()
-    if "medianibi" in features:
-        ibi_features["medianibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].median()
-    if "modeibi" in features:
-        ibi_features["modeibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "stdibi" in features:
-        ibi_features["stdibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].std()
-    if "diffmaxmodeibi" in features:
-        ibi_features["diffmaxmodeibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].max() - \
-                                              ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "diffminmodeibi" in features:
-        ibi_features["diffminmodeibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0]) - \
-                                              ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].min()
-    if "entropyibi" in features:
-        ibi_features["entropyibi"] = ibi_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(entropy)
+    statistics = grouped_statistics(ibi_data, "local_segment", col_name,
+                                    [statistic for statistic in STATISTICS if statistic + "ibi" in features])
+    for statistic in statistics.columns:
+        ibi_features[statistic + "ibi"] = statistics[statistic]
 
     return ibi_features
 
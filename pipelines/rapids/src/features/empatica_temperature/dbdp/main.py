@@ -1,43 +1,13 @@
 import pandas as pd
-from scipy.stats import entropy
+from utils.grouped_statistics import STATISTICS, grouped_statistics
 
 
 def statsFeatures(temperature_data, features, temperature_features):
     col_name = "temperature"
-    if "sumtemp" in features:
-        temperature_features["sumtemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].sum()
-    if "maxtemp" in features:
-        temperature_features["maxtemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].max()
-    if "mintemp" in features:
-        temperature_features["mintemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].min()
-    if "avgtemp" in features:
-        temperature_features["avgtemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].mean()
-    if "mediantemp" in features:
-        temperature_features["mediantemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].median()
-    if "modetemp" in features:
-        temperature_features["modetemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "stdtemp" in features:
-        temperature_features["stdtemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].std()
-    if "diffmaxmodetemp" in features:
-        temperature_features["diffmaxmodetemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].max() - \
-                                              temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "diffminmodetemp" in features:
-        temperature_features["diffminmodetemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].agg(lambda x: pd.Series.mode(x)[0]) - \
-                                              temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-                                                  col_name].min()
-    if "entropytemp" in features:
-        temperature_features["entropytemp"] = temperature_data[["local_segment", col_name]].groupby(["local_segment"])[
-            col_name].agg(entropy)
+    statistics = grouped_statistics(temperature_data, "local_segment", col_name,
+                                    [statistic for statistic in STATISTICS if statistic + "temp" in features])
+    for statistic in statistics.columns:
+        temperature_features[statistic + "temp"] = statistics[statistic]
 
     return temperature_features
 
@@ -1,5 +1,7 @@
+import numpy as np
 import pandas as pd
-from scipy.stats import entropy
+from utils.grouped_statistics import STATISTICS, grouped_statistics
+from utils.minute_grid import MinuteGrid
 
 def statsFeatures(heartrate_data, features, features_type, heartrate_features):
 
@@ -18,33 +20,29 @@ def statsFeatures(heartrate_data, features, features_type, heartrate_features):
     else:
         raise ValueError("features_type can only be one of ['hr', 'restinghr', 'caloriesoutofrange', 'caloriesfatburn', 'caloriescardio', 'caloriespeak'].")
 
-    if "sum" + features_type in features:
-        heartrate_features["sum" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].sum()
-    if "max" + features_type in features:
-        heartrate_features["max" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].max()
-    if "min" + features_type in features:
-        heartrate_features["min" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].min()
-    if "avg" + features_type in features:
-        heartrate_features["avg" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].mean()
-    if "median" + features_type in features:
-        heartrate_features["median" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].median()
-    if "mode" + features_type in features:
-        heartrate_features["mode" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "std" + features_type in features:
-        heartrate_features["std" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].std()
-    if "diffmaxmode" + features_type in features:
-        heartrate_features["diffmaxmode" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].max() - heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].agg(lambda x: pd.Series.mode(x)[0])
-    if "diffminmode" + features_type in features:
-        heartrate_features["diffminmode" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].agg(lambda x: pd.Series.mode(x)[0]) - heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].min()
-    if "entropy" + features_type in features:
-        heartrate_features["entropy" + features_type] = heartrate_data[["local_segment", col_name]].groupby(["local_segment"])[col_name].agg(entropy)
+    statistics = grouped_statistics(heartrate_data, "local_segment", col_name, [statistic for statistic in STATISTICS if statistic + features_type in features])
+    for statistic in statistics.columns:
+        heartrate_features[statistic + features_type] = statistics[statistic]
     
     return heartrate_features
 
-def extractHRFeaturesFromIntradayData(heartrate_intraday_data, features, time_segment, filter_data_by_segment):
+# Number of samples on a heart rate zone in every segment instance of heartrate_intraday_data. Segments that start and end
+# on whole minutes are summed from the zone's samples per minute in the minute grid, the others are counted from their rows
+def zoneSamplesPerSegment(heartrate_intraday_data, minute_grid, zone):
+    segments = heartrate_intraday_data["local_segment"].unique()
+    zone_samples = pd.Series([np.nansum(minute_grid.segment(zone + "_samples", segment)) if minute_grid.whole_minutes(segment) else np.nan for segment in segments], index=pd.Index(segments, name="local_segment"))
+
+    partial_segments = zone_samples.index[zone_samples.isna()]
+    if len(partial_segments) > 0:
+        zone_rows = heartrate_intraday_data[heartrate_intraday_data["local_segment"].isin(partial_segments) & (heartrate_intraday_data["heartrate_zone"] == zone)]
+        zone_samples[partial_segments] = zone_rows.groupby("local_segment")["device_id"].count().reindex(partial_segments, fill_value=0)
+    return zone_samples
+
+def extractHRFeaturesFromIntradayData(heartrate_intraday_data, minute_grid, features, time_segment, filter_data_by_segment):
     heartrate_intraday_features = pd.DataFrame(columns=["local_segment"] + features)
     if not heartrate_intraday_data.empty:
-        num_rows_per_minute = heartrate_intraday_data.groupby(["local_date", "local_hour", "local_minute"]).count().mean()["device_id"]
+        # the mean number of samples per minute with samples
+        num_rows_per_minute = np.nanmean(minute_grid.signals["heartrate_samples"])
         heartrate_intraday_data = filter_data_by_segment(heartrate_intraday_data, time_segment)
 
         if not heartrate_intraday_data.empty:
@@ -55,8 +53,7 @@ def extractHRFeaturesFromIntradayData(heartrate_intraday_data, features, time_se
 
             # get number of minutes in each heart rate zone
             for feature_name in list(set(["minutesonoutofrangezone", "minutesonfatburnzone", "minutesoncardiozone", "minutesonpeakzone"]) & set(features)):
-                heartrate_zone = heartrate_intraday_data[heartrate_intraday_data["heartrate_zone"] == feature_name[9:-4]]
-                heartrate_intraday_features[feature_name] = heartrate_zone.groupby(["local_segment"])["device_id"].count() / num_rows_per_minute
+                heartrate_intraday_features[feature_name] = zoneSamplesPerSegment(heartrate_intraday_data, minute_grid, feature_name[9:-4]) / num_rows_per_minute
                 heartrate_intraday_features.fillna(value={feature_name: 0}, inplace=True)
             
             heartrate_intraday_features.reset_index(inplace=True)
@@ -67,6 +64,7 @@ def extractHRFeaturesFromIntradayData(heartrate_intraday_data, features, time_se
 def rapids_features(sensor_data_files, time_segment, provider, filter_data_by_segment, *args, **kwargs):
 
     heartrate_intraday_data = pd.read_csv(sensor_data_files["sensor_data"])
+    minute_grid = MinuteGrid(sensor_data_files["minute_grid"])
 
     requested_intraday_features = provider["FEATURES"]
     # name of the features this function can compute
@@ -75,6 +73,6 @@ def rapids_features(sensor_data_files, time_segment, provider, filter_data_by_se
     intraday_features_to_compute = list(set(requested_intraday_features) & set(base_intraday_features_names))
     
     # extract features from intraday data
-    heartrate_intraday_features = extractHRFeaturesFromIntradayData(heartrate_intraday_data, intraday_features_to_compute, time_segment, filter_data_by_segment)
+    heartrate_intraday_features = extractHRFeaturesFromIntradayData(heartrate_intraday_data, minute_grid, intraday_features_to_compute, time_segment, filter_data_by_segment)
     
     return heartrate_intraday_features
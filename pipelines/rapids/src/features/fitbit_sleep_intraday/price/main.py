@@ -34,6 +34,8 @@ def mergeSleepEpisodes(sleep_data, cols_for_groupby, base_sleep_levels):
     sleep_episodes = pd.DataFrame(columns=["local_segment", "durationinbed", "start_timestamp", "end_timestamp", "local_start_date_time", "local_end_date_time"] + ["duration" + x for x in sleep_level_with_group])
 
     if cols_for_groupby and (not sleep_data.empty):
+        # duration of every level of every episode in one pass; levels are matched by name regardless of their group
+        level_durations = sleep_data.groupby(by=cols_for_groupby + ["level"], sort=False)["duration"].sum().unstack("level", fill_value=0)
         sleep_data = sleep_data.groupby(by=cols_for_groupby, sort=False)
         sleep_episodes = sleep_data[["duration"]].sum().rename(columns={"duration": "durationinbed"})
 
@@ -44,7 +46,11 @@ def mergeSleepEpisodes(sleep_data, cols_for_groupby, base_sleep_levels):
         sleep_episodes["local_end_date_time"] = sleep_data["local_end_date_time"].last()
 
         for sleep_level in sleep_level_with_group:
-            sleep_episodes["duration" + sleep_level] = sleep_data.apply(lambda group: group[group["level"] == sleep_level.replace("classic", "").replace("stages", "").replace("unified", "")]["duration"].sum())
+            level = sleep_level.replace("classic", "").replace("stages", "").replace("unified", "")
+            if level in level_durations.columns:
+                sleep_episodes["duration" + sleep_level] = level_durations[level].reindex(sleep_episodes.index, fill_value=0)
+            else:
+                sleep_episodes["duration" + sleep_level] = 0
 
         sleep_episodes.reset_index(inplace=True, drop=False)
         del sleep_episodes["type_episode_id"]
@@ -88,33 +94,27 @@ def statsOfDailyFeatures(daily_features, day_type, sleep_levels, intraday_featur
     if sleep_intraday_features.empty:
         sleep_intraday_features = pd.DataFrame()
     
-    # Average of time related features
-    if "avgstarttimeofepisodemain" in intraday_features_to_compute:
-        sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features[["local_segment","starttimeofepisodemain"]].groupby("local_segment")["starttimeofepisodemain"].mean().to_frame().rename(columns={"starttimeofepisodemain": "avgstarttimeofepisodemain" + day_type.lower()})], axis=1)
-    if "avgendtimeofepisodemain" in intraday_features_to_compute:
-        sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features[["local_segment","endtimeofepisodemain"]].groupby("local_segment")["endtimeofepisodemain"].mean().to_frame().rename(columns={"endtimeofepisodemain": "avgendtimeofepisodemain" + day_type.lower()})], axis=1)
-    if "avgmidpointofepisodemain" in intraday_features_to_compute:
-        sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features[["local_segment","midpointofepisodemain"]].groupby("local_segment")["midpointofepisodemain"].mean().to_frame().rename(columns={"midpointofepisodemain": "avgmidpointofepisodemain" + day_type.lower()})], axis=1)
-    
-    # Std of time related features
-    if "stdstarttimeofepisodemain" in intraday_features_to_compute:
-        sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features[["local_segment","starttimeofepisodemain"]].groupby("local_segment")["starttimeofepisodemain"].std().to_frame().rename(columns={"starttimeofepisodemain": "stdstarttimeofepisodemain" + day_type.lower()})], axis=1)
-    if "stdendtimeofepisodemain" in intraday_features_to_compute:
-        sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features[["local_segment","endtimeofepisodemain"]].groupby("local_segment")["endtimeofepisodemain"].std().to_frame().rename(columns={"endtimeofepisodemain": "stdendtimeofepisodemain" + day_type.lower()})], axis=1)
-    if "stdmidpointofepisodemain" in intraday_features_to_compute:
-        sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features[["local_segment","midpointofepisodemain"]].groupby("local_segment")["midpointofepisodemain"].std().to_frame().rename(columns={"midpointofepisodemain": "stdmidpointofepisodemain" + day_type.lower()})], axis=1)
+    # All statistics of this day type are computed in a single aggregation: {feature name: (daily feature, statistic)}
+    aggregations = {}
+    for statistic in ["avg", "std"]:
+        for col in ["starttimeofepisodemain", "endtimeofepisodemain", "midpointofepisodemain"]:
+            if statistic + col in intraday_features_to_compute:
+                aggregations[statistic + col + day_type.lower()] = (col, "mean" if statistic == "avg" else "std")
 
     # Duration & Ratio features
     for sleep_level_group in sleep_levels:
         for sleep_level in sleep_levels[sleep_level_group]:
             if "avgduration" in intraday_features_to_compute:
                 col = "duration" + sleep_level + sleep_level_group.lower() + "main"
-                sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features[["local_segment", col]].groupby("local_segment")[col].mean().to_frame().rename(columns={col: "avg" + col + day_type.lower()})], axis=1)
+                aggregations["avg" + col + day_type.lower()] = (col, "mean")
             if "avgratioduration" in intraday_features_to_compute:
                 col = "ratioduration" + sleep_level + sleep_level_group.lower() + "withinmain"
-                sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features[["local_segment", col]].groupby("local_segment")[col].mean().to_frame().rename(columns={col: "avg" + col + day_type.lower()})], axis=1)
+                aggregations["avg" + col + day_type.lower()] = (col, "mean")
     if levels_include_all_groups and ("avgduration" in intraday_features_to_compute):
-        sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features[["local_segment", "durationinbedmain"]].groupby("local_segment")["durationinbedmain"].mean().to_frame().rename(columns={"durationinbedmain": "avgdurationallmain" + day_type.lower()})], axis=1)
+        aggregations["avgdurationallmain" + day_type.lower()] = ("durationinbedmain", "mean")
+
+    if aggregations:
+        sleep_intraday_features = pd.concat([sleep_intraday_features, daily_features.groupby("local_segment").agg(**aggregations)], axis=1)
 
     return sleep_intraday_features
 
@@ -1,6 +1,8 @@
 import pandas as pd
 from datetime import datetime
+from functools import partial
 import itertools
+from utils.grouped_statistics import planned_aggregation
 
 def featuresFullNames(intraday_features_to_compute, sleep_levels_to_compute, sleep_types_to_compute, levels_include_all_groups):
     
@@ -42,58 +44,37 @@ def mergeSleepEpisodes(sleep_data, cols_for_groupby):
 
     return sleep_episodes
 
-def statsFeatures(sleep_episodes, features, episode_type):
-    
-    episode_features = pd.DataFrame(columns=[feature + episode_type for feature in features])
-    if sleep_episodes.empty:
-        return episode_features
-
-    if "countepisode" in features:
-        episode_features["countepisode" + episode_type] = sleep_episodes[["local_segment", "duration"]].groupby(["local_segment"])["duration"].count()
-    if "sumduration" in features:
-        episode_features["sumduration" + episode_type] = sleep_episodes[["local_segment", "duration"]].groupby(["local_segment"])["duration"].sum()
-    if "maxduration" in features:
-        episode_features["maxduration" + episode_type] = sleep_episodes[["local_segment", "duration"]].groupby(["local_segment"])["duration"].max()
-    if "minduration" in features:
-        episode_features["minduration" + episode_type] = sleep_episodes[["local_segment", "duration"]].groupby(["local_segment"])["duration"].min()
-    if "avgduration" in features:
-        episode_features["avgduration" + episode_type] = sleep_episodes[["local_segment", "duration"]].groupby(["local_segment"])["duration"].mean()
-    if "medianduration" in features:
-        episode_features["medianduration" + episode_type] = sleep_episodes[["local_segment", "duration"]].groupby(["local_segment"])["duration"].median()
-    if "stdduration" in features:
-        episode_features["stdduration" + episode_type] = sleep_episodes[["local_segment", "duration"]].groupby(["local_segment"])["duration"].std()
-    
-    return episode_features
-
-def allStatsFeatures(sleep_data, base_sleep_levels, base_sleep_types, features, sleep_intraday_features):
-
-    # For CLASSIC
-    for sleep_level, sleep_type in itertools.product(base_sleep_levels["CLASSIC"] + ["all"], base_sleep_types):
-        sleep_episodes_classic = sleep_data[sleep_data["type"] == "classic"]
-        sleep_episodes_classic = sleep_episodes_classic[sleep_episodes_classic["is_main_sleep"] == (1 if sleep_type == "main" else 0)] if sleep_type != "all" else sleep_episodes_classic
-        sleep_episodes_classic = sleep_episodes_classic[sleep_episodes_classic["level"] == sleep_level] if sleep_level != "all" else sleep_episodes_classic
-        sleep_intraday_features = pd.concat([sleep_intraday_features, statsFeatures(sleep_episodes_classic, features, sleep_level + "classic" + sleep_type)], axis=1)
-    
-    # For STAGES
-    for sleep_level, sleep_type in itertools.product(base_sleep_levels["STAGES"] + ["all"], base_sleep_types):
-        sleep_episodes_stages = sleep_data[sleep_data["type"] == "stages"]
-        sleep_episodes_stages = sleep_episodes_stages[sleep_episodes_stages["is_main_sleep"] == (1 if sleep_type == "main" else 0)] if sleep_type != "all" else sleep_episodes_stages
-        sleep_episodes_stages = sleep_episodes_stages[sleep_episodes_stages["level"] == sleep_level] if sleep_level != "all" else sleep_episodes_stages
-        sleep_intraday_features = pd.concat([sleep_intraday_features, statsFeatures(sleep_episodes_stages, features, sleep_level + "stages" + sleep_type)], axis=1)
-    
-    # For UNIFIED
-    for sleep_level, sleep_type in itertools.product(base_sleep_levels["UNIFIED"] + ["all"], base_sleep_types):
-        sleep_episodes_unified = sleep_data[sleep_data["is_main_sleep"] == (1 if sleep_type == "main" else 0)] if sleep_type != "all" else sleep_data
-        sleep_episodes_unified = sleep_episodes_unified[sleep_episodes_unified["unified_level"] == (0 if sleep_level == "awake" else 1)] if sleep_level != "all" else sleep_episodes_unified
-        sleep_episodes_unified = mergeSleepEpisodes(sleep_episodes_unified, ["local_segment", "unified_level_episode_id"]) 
-        sleep_intraday_features = pd.concat([sleep_intraday_features, statsFeatures(sleep_episodes_unified, features, sleep_level + "unified" + sleep_type)], axis=1)
-    
-    # Ignore the levels (e.g. countepisode[all][main])
-    for sleep_type in base_sleep_types:
-        sleep_episodes_none = sleep_data[sleep_data["is_main_sleep"] == (1 if sleep_type == "main" else 0)] if sleep_type != "all" else sleep_data
-        sleep_episodes_none = mergeSleepEpisodes(sleep_episodes_none, ["local_segment", "type_episode_id"])
-        sleep_intraday_features = pd.concat([sleep_intraday_features, statsFeatures(sleep_episodes_none, features, "all" + sleep_type)], axis=1)
-    
+# Reducer of the sleep episodes' duration behind each stats feature
+STATS_REDUCERS = {"countepisode": "count", "sumduration": "sum", "maxduration": "max", "minduration": "min", "avgduration": "mean", "medianduration": "median", "stdduration": "std"}
+
+# The sleep episodes of a level of a group (classic, stages, unified or "" to ignore the levels) and a type (main, nap or all)
+def selectSleepEpisodes(sleep_data, sleep_level_group, sleep_level, sleep_type):
+    if sleep_level_group in ["classic", "stages"]:
+        sleep_data = sleep_data[sleep_data["type"] == sleep_level_group]
+    if sleep_type != "all":
+        sleep_data = sleep_data[sleep_data["is_main_sleep"] == (1 if sleep_type == "main" else 0)]
+
+    if sleep_level_group == "unified":
+        sleep_data = sleep_data[sleep_data["unified_level"] == (0 if sleep_level == "awake" else 1)] if sleep_level != "all" else sleep_data
+        return mergeSleepEpisodes(sleep_data, ["local_segment", "unified_level_episode_id"])
+    if sleep_level_group == "":
+        return mergeSleepEpisodes(sleep_data, ["local_segment", "type_episode_id"])
+    return sleep_data[sleep_data["level"] == sleep_level] if sleep_level != "all" else sleep_data
+
+# Every stats feature of every level, group and type is planned first and then computed with one groupby per
+# combination (e.g. countepisode[remstages][main] and sumduration[remstages][main] share the same groupby)
+def allStatsFeatures(sleep_data, base_sleep_levels, base_sleep_types, features):
+
+    plan, filters = [], {}
+    for sleep_level_group in ["CLASSIC", "STAGES", "UNIFIED", ""]:
+        # the empty group ignores the levels (e.g. countepisode[all][main])
+        sleep_levels = base_sleep_levels[sleep_level_group] + ["all"] if sleep_level_group else ["all"]
+        for sleep_level, sleep_type in itertools.product(sleep_levels, base_sleep_types):
+            episode_type = sleep_level + sleep_level_group.lower() + sleep_type
+            filters[episode_type] = partial(selectSleepEpisodes, sleep_level_group=sleep_level_group.lower(), sleep_level=sleep_level, sleep_type=sleep_type)
+            plan.extend((feature + episode_type, "duration", STATS_REDUCERS[feature], episode_type) for feature in features)
+
+    sleep_intraday_features = planned_aggregation(sleep_data, "local_segment", plan, filters)
     sleep_intraday_features.fillna(0, inplace=True)
 
     return sleep_intraday_features
@@ -114,6 +95,8 @@ def ratiosFeatures(sleep_intraday_features, ratios_types, ratios_scopes, sleep_l
         for sleep_level in sleep_levels[sleep_level_group]:
             sleep_level_with_group.append((sleep_level_group.lower(), sleep_level))
 
+    ratios = {}
+
     # ACROSS LEVELS
     if "ACROSS_LEVELS" in ratios_scopes:
         # Get the cross product of ratios_types and sleep_level_with_group.
@@ -129,16 +112,14 @@ def ratiosFeatures(sleep_intraday_features, ratios_types, ratios_scopes, sleep_l
         for ratios_type, sleep_levels_combined in itertools.product(ratios_types, sleep_level_with_group):
             sleep_level_group, sleep_level = sleep_levels_combined[0], sleep_levels_combined[1]
             agg_func = "countepisode" if ratios_type == "count" else "sumduration"
-            across_levels = (sleep_intraday_features[agg_func + sleep_level + sleep_level_group + "all"] / sleep_intraday_features[agg_func + "all" + sleep_level_group + "all"]).to_frame().rename(columns={0: "ratio" + ratios_type + sleep_level + sleep_level_group})
-            sleep_intraday_features = pd.concat([sleep_intraday_features, across_levels], axis=1)
+            ratios["ratio" + ratios_type + sleep_level + sleep_level_group] = sleep_intraday_features[agg_func + sleep_level + sleep_level_group + "all"] / sleep_intraday_features[agg_func + "all" + sleep_level_group + "all"]
     
     # ACROSS TYPES
     if "ACROSS_TYPES" in ratios_scopes:
         for ratios_type in ratios_types:
             agg_func = "countepisode" if ratios_type == "count" else "sumduration"
             # We do not provide the ratio for nap because is complementary.
-            across_types = (sleep_intraday_features[agg_func + "allmain"] / sleep_intraday_features[agg_func + "allall"]).to_frame().rename(columns={0: "ratio" + ratios_type + "main"})
-            sleep_intraday_features = pd.concat([sleep_intraday_features, across_types], axis=1)
+            ratios["ratio" + ratios_type + "main"] = sleep_intraday_features[agg_func + "allmain"] / sleep_intraday_features[agg_func + "allall"]
     
     # Get the cross product of ratios_types, sleep_level_with_group, and sleep_types.
     # For example:
@@ -166,13 +147,15 @@ def ratiosFeatures(sleep_intraday_features, ratios_types, ratios_scopes, sleep_l
 
         # WITHIN LEVELS
         if ("WITHIN_LEVELS" in ratios_scopes) and (sleep_type == "main"): # We do not provide the ratio for nap because is complementary.
-            within_levels = (sleep_intraday_features[agg_func + sleep_level + sleep_level_group + sleep_type] / sleep_intraday_features[agg_func + sleep_level + sleep_level_group + "all"]).to_frame().rename(columns={0: "ratio" + ratios_type + sleep_type + "within" + sleep_level + sleep_level_group})
-            sleep_intraday_features = pd.concat([sleep_intraday_features, within_levels], axis=1)
+            ratios["ratio" + ratios_type + sleep_type + "within" + sleep_level + sleep_level_group] = sleep_intraday_features[agg_func + sleep_level + sleep_level_group + sleep_type] / sleep_intraday_features[agg_func + sleep_level + sleep_level_group + "all"]
 
         # WITHIN TYPES
         if "WITHIN_TYPES" in ratios_scopes:
-            within_types = (sleep_intraday_features[agg_func + sleep_level + sleep_level_group + sleep_type] / sleep_intraday_features[agg_func + "all" + sleep_level_group + sleep_type]).to_frame().rename(columns={0: "ratio" + ratios_type + sleep_level + sleep_level_group + "within" + sleep_type})
-            sleep_intraday_features = pd.concat([sleep_intraday_features, within_types], axis=1)
+            ratios["ratio" + ratios_type + sleep_level + sleep_level_group + "within" + sleep_type] = sleep_intraday_features[agg_func + sleep_level + sleep_level_group + sleep_type] / sleep_intraday_features[agg_func + "all" + sleep_level_group + sleep_type]
+
+    # all the ratios are added to the stats features at once
+    if ratios:
+        sleep_intraday_features = pd.concat([sleep_intraday_features, pd.DataFrame(ratios)], axis=1)
 
     return sleep_intraday_features
 
@@ -212,10 +195,8 @@ def rapids_features(sensor_data_files, time_segment, provider, filter_data_by_se
 
     if not sleep_intraday_data.empty:
 
-        sleep_intraday_features = pd.DataFrame()
-
         # ALL LEVELS AND TYPES: compute all stats features no matter they are requested or not
-        sleep_intraday_features = allStatsFeatures(sleep_intraday_data, base_sleep_levels, base_sleep_types, base_intraday_features["LEVELS_AND_TYPES"], sleep_intraday_features)
+        sleep_intraday_features = allStatsFeatures(sleep_intraday_data, base_sleep_levels, base_sleep_types, base_intraday_features["LEVELS_AND_TYPES"])
 
         # RATIOS: only compute requested features
         sleep_intraday_features = ratiosFeatures(sleep_intraday_features, intraday_features_to_compute["RATIOS_TYPE"], intraday_features_to_compute["RATIOS_SCOPE"], sleep_levels_to_compute, sleep_types_to_compute)
@@ -1,14 +1,64 @@
 import pandas as pd
 import numpy as np
 
-# calculate Gini coefficient, a measure of normalized variability. Adapted from: https://www.statsdirect.com/help/default.htm#nonparametric_methods/gini.htm
-def calculateGiniCoefficient(x):
-    x = np.array(x) 
-    x = np.sort(x) 
-    n = len(x) 
-    i = np.arange(1, n+1) 
-    gini = (np.sum(((2*i)-n-1)*x))/(n*(np.sum(x)))
-    return gini
+# Codes of the local_segment of each row (segments in sorted order as in groupby) and the number of rows per segment
+def segmentCodes(data):
+    codes, segments = pd.factorize(data["local_segment"], sort=True)
+    return codes, pd.Index(segments, name="local_segment"), np.bincount(codes, minlength=len(segments))
+
+# Gini coefficient, a measure of normalized variability, of the values of every segment at once. Adapted from:
+# https://www.statsdirect.com/help/default.htm#nonparametric_methods/gini.htm
+# Values are sorted within each segment with a single lexsort and each value is weighted by its rank i within its segment
+def groupedGiniCoefficients(data, column):
+    codes, segments, counts = segmentCodes(data)
+    values = data[column].to_numpy(dtype=np.float64)
+    order = np.lexsort((values, codes))
+    codes, x = codes[order], values[order]
+    starts = np.cumsum(counts) - counts
+    i = np.arange(1, len(x) + 1) - np.repeat(starts, counts)
+    n = np.repeat(counts, counts)
+    gini = np.bincount(codes, weights=((2*i)-n-1)*x, minlength=len(segments)) / (counts * np.bincount(codes, weights=x, minlength=len(segments)))
+    return pd.Series(gini, index=segments)
+
+# peak[n]minutecadence for every n at once: the mean of the n highest step counts of each segment (NaN if the segment has
+# less than n step counts). Step counts are sorted in descending order within each segment with a single lexsort and the
+# sum of the n highest ones is a difference of cumulative sums
+def peakCadences(steps_data, ns):
+    codes, segments, _ = segmentCodes(steps_data)
+    steps = steps_data["steps"].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(steps)
+    codes, steps = codes[valid], steps[valid]
+    counts = np.bincount(codes, minlength=len(segments))
+    starts = np.cumsum(counts) - counts
+
+    cumulative_steps = np.r_[0, np.cumsum(steps[np.lexsort((-steps, codes))])]
+    peak_cadences = {}
+    for n in ns:
+        ends = np.minimum(starts + n, len(steps))
+        peak_cadences[n] = np.where(counts >= n, (cumulative_steps[ends] - cumulative_steps[starts]) / n, np.nan)
+    return pd.DataFrame(peak_cadences, index=segments)
+
+# max[n]minutecadence for every n at once: the highest mean of n consecutive step counts of each segment, as a rolling
+# mean would compute it (windows with missing step counts are skipped, NaN if the segment has less than n step counts).
+# The sums of all the windows of n rows are differences of cumulative sums over the rows sorted by segment
+def maxCadences(steps_data, ns):
+    codes, segments, _ = segmentCodes(steps_data)
+    order = np.argsort(codes, kind="stable")
+    codes, steps = codes[order], steps_data["steps"].to_numpy(dtype=np.float64)[order]
+    missing = np.isnan(steps)
+    valid_counts = np.bincount(codes, weights=~missing, minlength=len(segments))
+    cumulative_steps = np.r_[0, np.cumsum(np.where(missing, 0, steps))]
+    cumulative_missing = np.r_[0, np.cumsum(missing)]
+
+    max_cadences = {}
+    for n in ns:
+        window_starts = np.arange(max(len(steps) - n + 1, 0))
+        window_ends = window_starts + n
+        complete = (codes[window_starts] == codes[window_ends - 1]) & (cumulative_missing[window_ends] == cumulative_missing[window_starts])
+        max_sums = np.full(len(segments), -np.inf)
+        np.maximum.at(max_sums, codes[window_starts[complete]], (cumulative_steps[window_ends] - cumulative_steps[window_starts])[complete])
+        max_cadences[n] = np.where((valid_counts >= n) & np.isfinite(max_sums), max_sums / n, np.nan)
+    return pd.DataFrame(max_cadences, index=segments)
 
 # extract lower and upper bounds of cadence band from feature name
 def getCadenceBandBounds(feature):
@@ -74,27 +124,24 @@ def statsFeatures(steps_data, features_to_compute, features_type, steps_features
 def activityFragmentationFeatures(steps_data, features_to_compute, steps_features, *args, **kwargs):
     if ("activetosedentarytransitionprobability" in features_to_compute):
         if not steps_data.empty:
-            steps_features["activetosedentarytransitionprobability"] = steps_data.groupby(["local_segment"])["duration"].agg(lambda x: 1/x.mean())
+            steps_features["activetosedentarytransitionprobability"] = 1 / steps_data.groupby(["local_segment"])["duration"].mean()
         else:
             steps_features["activetosedentarytransitionprobability"] = np.nan
-    if "sumdurationactivitylessthan5minutes" in features_to_compute:
+    duration_bins = {"sumdurationactivitylessthan5minutes": "lessthan5", "sumdurationactivity5to105minutes": "5to10", "sumdurationactivitygreaterthan10minutes": "greaterthan10"}
+    duration_bin_features = [feature for feature in duration_bins if feature in features_to_compute]
+    if duration_bin_features:
         if not steps_data.empty:
-            steps_features["sumdurationactivitylessthan5minutes"] = steps_data.groupby(["local_segment"]).apply(lambda x: x[x["duration"] < 5]["duration"].sum())
+            # bout durations are whole minutes, so [5, 11) is the same bin as between(5, 10, inclusive = "both")
+            bins = pd.cut(steps_data["duration"], bins=[-np.inf, 5, 11, np.inf], right=False, labels=["lessthan5", "5to10", "greaterthan10"])
+            binned_durations = steps_data["duration"].groupby([steps_data["local_segment"], bins]).sum().unstack()
+            for feature in duration_bin_features:
+                steps_features[feature] = binned_durations[duration_bins[feature]]
         else:
-             steps_features["sumdurationactivitylessthan5minutes"] = np.nan
-    if "sumdurationactivity5to105minutes" in features_to_compute:
-        if not steps_data.empty:
-            steps_features["sumdurationactivity5to105minutes"] = steps_data.groupby(["local_segment"]).apply(lambda x: x[x["duration"].between(5, 10, inclusive = "both")]["duration"].sum())
-        else:
-            steps_features["sumdurationactivity5to105minutes"] = np.nan
-    if "sumdurationactivitygreaterthan10minutes" in features_to_compute:
-        if not steps_data.empty:
-            steps_features["sumdurationactivitygreaterthan10minutes"] = steps_data.groupby(["local_segment"]).apply(lambda x: x[x["duration"] > 10]["duration"].sum())
-        else:
-            steps_features["sumdurationactivitygreaterthan10minutes"] = np.nan
+            for feature in duration_bin_features:
+                steps_features[feature] = np.nan
     if "ginicoefficient" in features_to_compute:
         if not steps_data.empty:
-            steps_features["ginicoefficient"] = steps_data.groupby(["local_segment"])["duration"].agg(lambda x: calculateGiniCoefficient(x))
+            steps_features["ginicoefficient"] = groupedGiniCoefficients(steps_data, "duration")
         else:
             steps_features["ginicoefficient"] = np.nan
             
@@ -111,24 +158,28 @@ def walkingCadenceFeatures(steps_data, features_to_compute, steps_features, *arg
     if "meancadence" in features_to_compute:
         steps_features["meancadence"] = steps_data.groupby(["local_segment"])["steps"].mean()
     if "uncensoredmeancadence" in features_to_compute:
-        weartimes = getDeviceWearTimes(steps_data, threshold_device_nonwear_time)
-        steps_features["uncensoredmeancadence"] = weartimes.groupby(["local_segment"]).apply(lambda x: np.where(x["weartimeduration"].sum() > 0, x["sumsteps"].sum()/x["weartimeduration"].sum(), np.nan))
+        weartimes = getDeviceWearTimes(steps_data, threshold_device_nonwear_time).groupby(["local_segment"])[["sumsteps", "weartimeduration"]].sum()
+        steps_features["uncensoredmeancadence"] = (weartimes["sumsteps"] / weartimes["weartimeduration"]).where(weartimes["weartimeduration"] > 0)
     if peak_cadence_features:
+        peak_cadences = peakCadences(steps_data, [int(feature.split("peak")[1].split("minutecadence")[0]) for feature in peak_cadence_features])
         for feature in peak_cadence_features:
-            n = int(feature.split("peak")[1].split("minutecadence")[0])
-            steps_features[feature] = steps_data.groupby(["local_segment"])["steps"].apply(lambda x: np.where(x.count() >= n, x.sort_values(ascending = False).head(n).mean(), np.nan))
+            steps_features[feature] = peak_cadences[int(feature.split("peak")[1].split("minutecadence")[0])]
     if max_cadence_features:
+        max_cadences = maxCadences(steps_data, [int(feature.split("max")[1].split("minutecadence")[0]) for feature in max_cadence_features])
         for feature in max_cadence_features:
-            n = int(feature.split("max")[1].split("minutecadence")[0])
-            steps_features[feature] = steps_data.groupby(["local_segment"])["steps"].apply(lambda x: np.where(x.count() >= n, x.rolling(window = n, center = False).mean().max(), np.nan))
-    if cadence_band_features:
+            steps_features[feature] = max_cadences[int(feature.split("max")[1].split("minutecadence")[0])]
+    if cadence_band_features or cadence_threshold_features:
+        # minutes in every band and above every threshold are counted with a single groupby
+        cadence_minutes = {}
         for feature in cadence_band_features:
             bounds = getCadenceBandBounds(feature)
-            steps_features[feature] = steps_data.groupby(["local_segment"])["steps"].agg(lambda x: x.between(bounds[0], bounds[1], inclusive = "left").sum())
-    if cadence_threshold_features:
+            cadence_minutes[feature] = steps_data["steps"].between(bounds[0], bounds[1], inclusive = "left")
         for feature in cadence_threshold_features:
             n = int(feature.split("totalminutesabove")[1].split("cadence")[0])
-            steps_features[feature] = steps_data.groupby(["local_segment"])["steps"].agg(lambda x: (x > n).sum())
+            cadence_minutes[feature] = steps_data["steps"] > n
+        cadence_minutes = pd.DataFrame(cadence_minutes).groupby(steps_data["local_segment"]).sum()
+        for feature in cadence_minutes.columns:
+            steps_features[feature] = cadence_minutes[feature]
 
     return steps_features
 
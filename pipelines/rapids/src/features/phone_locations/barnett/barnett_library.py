@@ -2,55 +2,98 @@ import numpy as np
 import math
 import pandas as pd
 from scipy.stats import *
-from tqdm import tqdm
+from scipy import special
 from sklearn.cluster import KMeans
 from scipy.spatial.distance import pdist, squareform
+from scipy.spatial import cKDTree
 import datetime
 import glob
+import warnings
 from dateutil import tz
+from concurrent.futures import ProcessPoolExecutor
+from phone_locations.distances import euclidean, euclidean_to_centroids
+from utils.instrumentation import Instrumentation, progress
 
 
 np.set_printoptions(suppress=True, formatter={'float_kind':'{:f}'.format})
-np.random.seed(22)
+
+NORMAL_PDF_CONSTANT = np.sqrt(2 * np.pi)
+
+# Times of the day (in seconds after midnight) at which the locations of two days are compared by the daily routine index
+ROUTINE_CHECKPOINTS = np.arange(30*60, 60*60*24, 60*60)
+
+FEATURE_NAMES = ["hometime", "disttravelled", "rog", "maxdiam", "maxhomedist", "siglocsvisited", "avgflightlen", "stdflightlen", "avgflightdur", "stdflightdur", "probpause", "siglocentropy", "minsmissing", "circdnrtn", "wkenddayrtn"]
+
+# Columns of a mobility trace: the row code (1 flight, 2 pause, 3 undefined, 4 missing) and where and when the row starts and ends
+TRACE_COLUMNS = ["code", "x0", "y0", "t0", "x1", "y1", "t1"]
+
+# Named fields of a mobility matrix row, see mobmat_records
+MOBMAT_DTYPE = np.dtype([(column, np.float64) for column in TRACE_COLUMNS])
+
+# Mobility matrix (flights, pauses and missing intervals, one row per TRACE_COLUMNS) built row by row. Rows are copied into a
+# preallocated float64 buffer whose capacity doubles when it is full instead of being collected as lists of Python floats.
+# Indexing works on the filled rows like on a (rows, 7) array, matrix returns them without copying
+class MobMat:
+
+    def __init__(self, capacity=64):
+        self.buffer = np.empty((max(int(capacity), 1), len(TRACE_COLUMNS)), dtype=np.float64)
+        self.size = 0
+
+    def reserve(self, size):
+        if size > len(self.buffer):
+            buffer = np.empty((max(size, 2 * len(self.buffer)), len(TRACE_COLUMNS)), dtype=np.float64)
+            buffer[:self.size] = self.buffer[:self.size]
+            self.buffer = buffer
+
+    def append(self, row):
+        self.reserve(self.size + 1)
+        self.buffer[self.size] = row
+        self.size += 1
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=np.float64).reshape(-1, len(TRACE_COLUMNS))
+        self.reserve(self.size + len(rows))
+        self.buffer[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+
+    @property
+    def matrix(self):
+        return self.buffer[:self.size]
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        return self.matrix[key]
+
+    def __setitem__(self, key, value):
+        self.matrix[key] = value
+
+# A (rows, 7) mobility matrix as a 1D structured array with MOBMAT_DTYPE fields (e.g. records["code"]), sharing its memory
+# when the matrix is C contiguous
+def mobmat_records(matrix):
+    matrix = np.ascontiguousarray(matrix, dtype=np.float64).reshape(-1, len(TRACE_COLUMNS))
+    return matrix.view(MOBMAT_DTYPE)[:, 0]
+
+# Inputs shared by all the Monte Carlo repetitions, set once per process by init_simulation_worker
+simulation_inputs = {}
+
+# Stage timings and row counts of the last run_barnett_features_for_rapids or impute_mobility_traces call
+instrumentation = Instrumentation()
 
 def run_test(output_file):
     print("Output DATA: ")
     print(output_file)
 
-def run_barnett_features_for_rapids(input_dataframe, accuracy_limit=51.0, timezone="", wtype="GLR", spread_pars=[10,1], center_rad=200, interval=10, n_reps=1, min_pause_dur=300, min_pause_dist=60, r=None, w=None, tint_m=None, tint_k=None):
-    data_frame = input_dataframe
-    lonlat, r, w = preprocessing(data_frame, interval=interval, acc_threshold=accuracy_limit, r=r, w=w, tint_m=tint_m, tint_k=tint_k)
-    mobmatmiss = convert_to_flights_pauses(lonlat, r, w)
-    mobmat = guess_pause(mobmatmiss, min_pause_dur, min_pause_dist)
-    obj = initialize_params(mobmat)
+# report_file and profile_file (a cProfile dump) are optional, see Instrumentation.write_report
+def run_barnett_features_for_rapids(input_dataframe, accuracy_limit=51.0, timezone="", wtype="GLR", spread_pars=[10,1], center_rad=200, interval=10, n_reps=1, min_pause_dur=300, min_pause_dist=60, r=None, w=None, tint_m=None, tint_k=None, n_jobs=1, seed=22, report_file=None, profile_file=None):
+    instrumentation.reset(profile=profile_file is not None)
+    mobmatmiss, mobmat, obj = extract_mobility_matrices(input_dataframe, interval, accuracy_limit, min_pause_dur, min_pause_dist, r, w, tint_m, tint_k)
     data_for_pandas = []
     if obj:
-        lsmf = []
-        lssigloc = []
-        for i in range(n_reps):
-            print("Sim #: ", i+1)
-            out3 = simulate_mobility_gaps(mobmat, obj, wtype, spread_pars)
-            out3 = np.array(out3)
-            IDundef=np.where(out3[:,0]==3)[0]
-
-            if len(IDundef) > 0:            
-                out3 = np.delete(out3, IDundef,axis=0)
-            obj3 = initialize_params(out3)
-
-            output_features, slout, row_names = get_mobility_features(out3, obj3, mobmatmiss, timezone, center_rad, interval)
-            lsmf.append(output_features)
-            lssigloc.append(slout)
-
-        #get average
-        np_lsmf = np.array((lsmf))
-        avg_output_features = [] #convert to pandas dataframe and then return this
-        for j in range(len(row_names)):
-            temp_avg = []
-            for i in range(n_reps):
-                temp_avg.append(np_lsmf[i][j])
-            avg_output_features.append(np.mean(temp_avg, axis=0))
+        with instrumentation.stage("simulations"):
+            avg_output_features, row_names = run_mobility_simulations(mobmat, obj, mobmatmiss, wtype, spread_pars, timezone, center_rad, interval, n_reps, n_jobs, seed)
 
-        
         for idx, row in enumerate(avg_output_features):
             date = row_names[idx]
             date_str = str(date[0]) + "-" + str(date[1]) + "-" + str(date[2])
@@ -59,41 +102,38 @@ def run_barnett_features_for_rapids(input_dataframe, accuracy_limit=51.0, timezo
                 features.append(feature)
             data_for_pandas.append(features)
 
-    column_names = ["local_date", "hometime", "disttravelled", "rog", "maxdiam", "maxhomedist", "siglocsvisited", "avgflightlen", "stdflightlen", "avgflightdur", "stdflightdur", "probpause", "siglocentropy", "minsmissing", "circdnrtn", "wkenddayrtn"]
+    column_names = ["local_date"] + FEATURE_NAMES
     df = pd.DataFrame(data_for_pandas, columns = column_names)
     df.set_index('local_date', inplace=True)
+    instrumentation.write_report(report_file, profile_file)
     return df
 
-def run_barnett_features(input_dir, output_file, wtype="GLR", spread_pars=[10,1], timezone="", center_rad=200, interval=10, acc_threshold=51.0, n_reps=1, min_pause_dur=300, min_pause_dist=60, r=None, w=None, tint_m=None, tint_k=None):
+# Preprocess the location data and extract its flights, pauses and missing intervals (mobmatmiss) and the flights and
+# pauses with inferred pauses (mobmat), recording the time of each stage and the number of rows of each type
+def extract_mobility_matrices(input_dataframe, interval, accuracy_limit, min_pause_dur, min_pause_dist, r, w, tint_m, tint_k):
+    instrumentation.count("location_rows", len(input_dataframe))
+    with instrumentation.stage("preprocessing"):
+        lonlat, r, w = preprocessing(input_dataframe, interval=interval, acc_threshold=accuracy_limit, r=r, w=w, tint_m=tint_m, tint_k=tint_k)
+    instrumentation.count("intervals", len(lonlat))
+    with instrumentation.stage("flights_pauses"):
+        mobmatmiss = convert_to_flights_pauses(lonlat, r, w)
+    with instrumentation.stage("guess_pause"):
+        mobmat = guess_pause(mobmatmiss, min_pause_dur, min_pause_dist)
+        obj = initialize_params(mobmat)
+
+    codes = mobmat_records(mobmat)["code"]
+    instrumentation.count("flights", np.sum(codes == 1))
+    instrumentation.count("pauses", np.sum(codes == 2))
+    instrumentation.count("gaps", np.sum(codes == 4))
+    return mobmatmiss, mobmat, obj
+
+def run_barnett_features(input_dir, output_file, wtype="GLR", spread_pars=[10,1], timezone="", center_rad=200, interval=10, acc_threshold=51.0, n_reps=1, min_pause_dur=300, min_pause_dist=60, r=None, w=None, tint_m=None, tint_k=None, n_jobs=1, seed=22):
     data_frame = load_beiwe(input_dir)
     lonlat, r, w = preprocessing(data_frame, interval=interval, acc_threshold=acc_threshold, r=r, w=w, tint_m=tint_m, tint_k=tint_k)
     mobmatmiss = convert_to_flights_pauses(lonlat, r, w)
     mobmat = guess_pause(mobmatmiss, min_pause_dur, min_pause_dist)
     obj = initialize_params(mobmat) 
-    lsmf = []
-    lssigloc = []
-    for i in range(n_reps):
-        print("Sim #: ", i+1)
-        out3 = simulate_mobility_gaps(mobmat, obj, wtype, spread_pars)
-        out3 = np.array(out3)
-        IDundef=np.where(out3[:,0]==3)[0]
-
-        if len(IDundef) > 0:            
-            out3 = np.delete(out3, IDundef,axis=0)
-        obj3 = initialize_params(out3)
-
-        output_features, slout, row_names = get_mobility_features(out3, obj3, mobmatmiss, timezone, center_rad, interval)
-        lsmf.append(output_features)
-        lssigloc.append(slout)
-
-    #get average
-    np_lsmf = np.array((lsmf))
-    avg_output_features = []
-    for j in range(len(row_names)):
-        temp_avg = []
-        for i in range(n_reps):
-            temp_avg.append(np_lsmf[i][j])
-        avg_output_features.append(np.mean(temp_avg, axis=0))
+    avg_output_features, row_names = run_mobility_simulations(mobmat, obj, mobmatmiss, wtype, spread_pars, timezone, center_rad, interval, n_reps, n_jobs, seed)
 
     print("Writing features to ", output_file)
     with open(output_file, "w") as writer:
@@ -109,6 +149,71 @@ def run_barnett_features(input_dir, output_file, wtype="GLR", spread_pars=[10,1]
     print("Finish writing to ", output_file)
 
 
+# Impute the missing gaps of the location data once per Monte Carlo repetition and return the imputed traces (repetition 0 to
+# n_reps-1) and the missing intervals of the observed data (repetition -1) as one dataframe with TRACE_COLUMNS.
+# Features of any time segment can then be computed from this dataframe with segment_mobility_features
+def impute_mobility_traces(input_dataframe, accuracy_limit=51.0, wtype="GLR", spread_pars=[10,1], interval=10, n_reps=1, min_pause_dur=300, min_pause_dist=60, r=None, w=None, tint_m=None, tint_k=None, n_jobs=1, seed=22, report_file=None, profile_file=None):
+    instrumentation.reset(profile=profile_file is not None)
+    mobmatmiss, mobmat, obj = extract_mobility_matrices(input_dataframe, interval, accuracy_limit, min_pause_dur, min_pause_dist, r, w, tint_m, tint_k)
+    traces = [trace_to_dataframe(mobmatmiss[mobmatmiss[:,0] == 4], -1)]
+    if obj:
+        inputs = {"mobmat": mobmat, "obj": obj, "wtype": wtype, "spread_pars": spread_pars}
+        with instrumentation.stage("simulations"):
+            for repetition, out3 in enumerate(run_repetitions(simulate_mobility_trace, inputs, n_reps, n_jobs, seed)):
+                traces.append(trace_to_dataframe(out3, repetition))
+    instrumentation.write_report(report_file, profile_file)
+    return pd.concat(traces, ignore_index=True)
+
+def trace_to_dataframe(matrix, repetition):
+    trace = pd.DataFrame(mobmat_records(matrix))
+    trace.insert(0, "repetition", repetition)
+    return trace
+
+def init_simulation_worker(inputs):
+    simulation_inputs.update(inputs)
+
+# One Monte Carlo repetition: impute the missing gaps of mobmat and drop the undefined rows of the imputed trajectory
+def simulate_mobility_trace(seed_sequence):
+    rng = np.random.default_rng(seed_sequence)
+    out3 = simulate_mobility_gaps(simulation_inputs["mobmat"], simulation_inputs["obj"], simulation_inputs["wtype"], simulation_inputs["spread_pars"], rng=rng)
+    IDundef=np.where(out3[:,0]==3)[0]
+
+    if len(IDundef) > 0:            
+        out3 = np.delete(out3, IDundef,axis=0)
+    return out3
+
+# One Monte Carlo repetition: impute the missing gaps of mobmat and compute the daily features of the imputed trajectory
+def simulate_and_get_mobility_features(seed_sequence):
+    out3 = simulate_mobility_trace(seed_sequence)
+    obj3 = initialize_params(out3)
+
+    output_features, slout, row_names = get_mobility_features(out3, obj3, simulation_inputs["mobmatmiss"], simulation_inputs["timezone"], simulation_inputs["center_rad"], simulation_inputs["interval"])
+    return output_features, row_names
+
+# Run n_reps repetitions on n_jobs processes and average their features. Every repetition gets its own random stream
+# spawned from seed, so the result only depends on seed and n_reps, not on n_jobs.
+# The inputs are sent once to each worker instead of once per repetition.
+def run_mobility_simulations(mobmat, obj, mobmatmiss, wtype, spread_pars, timezone, center_rad, interval, n_reps, n_jobs, seed):
+    inputs = {"mobmat": mobmat, "obj": obj, "mobmatmiss": mobmatmiss, "wtype": wtype, "spread_pars": spread_pars, "timezone": timezone, "center_rad": center_rad, "interval": interval}
+    results = run_repetitions(simulate_and_get_mobility_features, inputs, n_reps, n_jobs, seed)
+
+    #get average
+    row_names = results[0][1]
+    avg_output_features = np.mean(np.stack([output_features for output_features, row_names in results]), axis=0)
+    return avg_output_features, row_names
+
+# Call repetition_function (a module level function that reads simulation_inputs) once per repetition and return the results in order
+def run_repetitions(repetition_function, inputs, n_reps, n_jobs, seed):
+    seed_sequences = np.random.SeedSequence(seed).spawn(n_reps)
+    instrumentation.count("repetitions", n_reps)
+
+    if n_jobs > 1 and n_reps > 1:
+        with ProcessPoolExecutor(max_workers=min(n_jobs, n_reps), initializer=init_simulation_worker, initargs=(inputs,)) as executor:
+            return list(executor.map(repetition_function, seed_sequences))
+    else:
+        init_simulation_worker(inputs)
+        return [repetition_function(seed_sequence) for seed_sequence in seed_sequences]
+
 def load_beiwe(input_dir, debug_mode=True):
     # load all files ending with .csv in input_dir    
     print("Reading csv files from {}".format(input_dir))
@@ -154,54 +259,7 @@ def preprocessing(df, interval=10.0, acc_threshold=51.0, r=None,w=None,tint_m=No
     if not w:        
         w = np.mean(df['accuracy'].values) + interval
 
-    start_time = (df['timestamp'].iloc[0]/1000)
-    end_time = (df['timestamp'].iloc[-1]/1000)
-
-    avg_matrix_lst = []
-    
-    IDam = 0
-    count = -1
-    next_line = [1, start_time + interval/2.0, df['latitude'].iloc[0], df['longitude'].iloc[0], 0.0, 0.0]    
-    interval_counter = 1
-    print("Collapse data within", interval, "second intervals...\n")
-
-    counter = 0
-    for idx, row in tqdm(df.iterrows(), total=df.shape[0]):
-        if counter > 0:
-            timestamp = row['timestamp']
-            latitude = row['latitude']
-            longitude = row['longitude']
-
-            if timestamp/1000.00 < start_time + interval:
-                next_line[2] += latitude
-                next_line[3] += longitude
-                interval_counter += 1
-                
-            else:
-                next_line[2] = next_line[2]/interval_counter
-                
-                next_line[3] = next_line[3]/interval_counter
-
-                temp = next_line                
-                avg_matrix_lst.append(temp)
-
-                num_miss = np.floor((timestamp/1000 - (start_time + interval))/interval)
-
-                if num_miss > 0:
-                    has_miss = [4, start_time + interval/2.0, start_time + interval * (num_miss + 1) +interval/2.0, float("NaN"), float("NaN"), float("NaN")]
-                    avg_matrix_lst.append(has_miss)
-
-                                
-                start_time = start_time + interval * (num_miss+1)
-                next_line = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0]
-                next_line[0] = 1
-                next_line[1] = start_time + interval/2.0
-                next_line[2] = latitude
-                next_line[3] = longitude
-                interval_counter = 1
-        counter += 1
-
-    avg_matrix_df = pd.DataFrame(data=avg_matrix_lst)
+    avg_matrix_df = collapse_to_intervals(df['timestamp'].values, df['latitude'].values, df['longitude'].values, interval)
     
     # ================================================================
     # avg_matrix_df is a matrix of average scores per interval
@@ -216,46 +274,63 @@ def preprocessing(df, interval=10.0, acc_threshold=51.0, r=None,w=None,tint_m=No
     # ===============================
     #4. convert from Lat/Lon to X/Y
     # ===============================        
-    print("Convert latitude/longitude to X/Y\n")
     new_dataframe = lat_long_to_xy(avg_matrix_df)
     return new_dataframe, r, w
 
+# Average the points of each interval (intervals start at the first timestamp) and add a missing data row (case 4) between
+# intervals that are not consecutive. Missing data rows store the times of the intervals before and after the gap in columns 1 and 2.
+# The last interval is not included because it might not be complete.
+def collapse_to_intervals(timestamps, latitudes, longitudes, interval):
+    start_time = timestamps[0]/1000
+    interval_ids = np.floor_divide(timestamps - timestamps[0], interval * 1000).astype(np.int64)
+
+    first_rows = np.flatnonzero(np.r_[True, interval_ids[1:] != interval_ids[:-1]])
+    counts = np.diff(np.r_[first_rows, len(interval_ids)])
+    interval_times = start_time + interval * interval_ids[first_rows] + interval/2.0
+    avg_latitudes = np.add.reduceat(latitudes, first_rows)/counts
+    avg_longitudes = np.add.reduceat(longitudes, first_rows)/counts
+
+    num_intervals = len(first_rows) - 1
+    has_miss = np.diff(interval_ids[first_rows]) > 1
+    interval_rows = np.arange(num_intervals) + np.r_[0, np.cumsum(has_miss)[:-1]]
+    miss_rows = interval_rows[has_miss] + 1
+
+    avg_matrix = np.full((num_intervals + len(miss_rows), 6), np.nan)
+    avg_matrix[interval_rows] = np.column_stack([np.ones(num_intervals), interval_times[:-1], avg_latitudes[:-1], avg_longitudes[:-1], np.zeros(num_intervals), np.zeros(num_intervals)])
+    avg_matrix[miss_rows, 0] = 4
+    avg_matrix[miss_rows, 1] = interval_times[:-1][has_miss]
+    avg_matrix[miss_rows, 2] = interval_times[1:][has_miss]
+
+    avg_matrix_df = pd.DataFrame(data=avg_matrix)
+    avg_matrix_df[0] = avg_matrix_df[0].astype(int)
+    return avg_matrix_df
+
 def convert_to_flights_pauses(new_dataframe, r, w, output_file=None):
-    print("\nConvert from X/Y to flights/pauses...\n")
-    
     mobmatmiss = extract_flights_from_dataframe(new_dataframe, r, w)
     
 
     if output_file: #output_file = mobmatmiss
         print("Writing {} rows to mobmatmiss to tsv...".format(mobmatmiss.shape[0]))
-        mobmatmiss.to_csv(output_file, sep="\t")
+        pd.DataFrame(mobmatmiss, columns=["code", "lon1", "lat1", "t1", "lon2", "lat2", "t2"]).to_csv(output_file, sep="\t")
         print("Finish writing mobmatmiss to tsv...")
     return mobmatmiss
 
 def extract_flights_from_dataframe(dataframe, r, w):
     np_arr = dataframe.to_numpy()
     cur_idx = 0
-    result_matrix = []
-    temp_counter = 0
-    prev_rows_counter = 0
-    for i in tqdm(range(len(np_arr)), total=len(np_arr)):
-        if np_arr[i][0] == 4:                        
-            row_with_missing_data = []
-            prev_rows = extract_flights(np_arr[cur_idx:i], r, w)            
-            last_timestamp = np_arr[i][1]
-
-            row_with_missing_data.append([4, float("NaN"), float("NaN"), last_timestamp, float("NaN"), float("NaN"), np_arr[i][2]])    
-            result_matrix += prev_rows            
-            result_matrix += row_with_missing_data
-            prev_rows_counter += len(prev_rows)
-
-            temp_counter += 1
-            cur_idx = i+1
+    result_matrix = MobMat(len(np_arr) // 4)
+    for i in np.flatnonzero(np_arr[:,0] == 4):
+        prev_rows = extract_flights(np_arr[cur_idx:i], r, w)            
+        last_timestamp = np_arr[i][1]
+
+        result_matrix.extend(prev_rows)
+        result_matrix.append([4, float("NaN"), float("NaN"), last_timestamp, float("NaN"), float("NaN"), np_arr[i][2]])
+        cur_idx = i+1
 
     if cur_idx < len(np_arr):
         rows = extract_flights(np_arr[cur_idx:len(np_arr)], r, w)
         last_timestamp = rows[len(rows)-1][6]
-        result_matrix += rows
+        result_matrix.extend(rows)
         
         if last_timestamp < np_arr[len(np_arr)-1][1]:
             if result_matrix[len(result_matrix)-1][0] != 2:
@@ -264,8 +339,7 @@ def extract_flights_from_dataframe(dataframe, r, w):
             else:
                 result_matrix[len(result_matrix)-1][6] = np_arr[len(np_arr)-1][1]
 
-    result_df = pd.DataFrame(data=result_matrix, index=None, columns=["code", "lon1", "lat1", "t1", "lon2", "lat2", "t2"])
-    return result_df
+    return result_matrix.matrix
 
 
 # input1 = x_list --> np array [x0, x1, x2, ...xn]
@@ -300,6 +374,11 @@ def is_flight(x_listt, y_listt, r, w):
     if num_of_rows == 2:
         return True
 
+    return is_flight_within_width(x_list, y_list, w)
+
+# Whether the points between the first and the last one are within w of the line that connects them
+def is_flight_within_width(x_list, y_list, w):
+    num_of_rows = len(x_list)
     if x_list[0] == x_list[num_of_rows-1]:
         if np.max(np.abs(x_list[1: num_of_rows])) > w: 
             return False
@@ -341,100 +420,183 @@ def lat_long_to_xy(df,R=6371000.0): #1000.000
     d2 = 2*pi*(R*np.sin(pi/2-ph1*2*pi/360))*((th1-th0)*2*pi/360)/(2*pi)
     d3 = 2*pi*(R*np.sin(pi/2-ph0*2*pi/360))*((th1-th0)*2*pi/360)/(2*pi)
     
-    for idx, row in df.iterrows():
-        case = row[0]
-        latitude = row[2]
-        longitude = row[3]
-        if case == 1:
-            w1=(latitude-ph0)/(ph1-ph0)
-            w2=(longitude-th0)/(th1-th0)
-            # df[4][idx]= w1 * np.abs(d3-d2)/2+w2*(d3*(1-w1)+d2*w1)
-            df.loc[idx, 4] = w1 * np.abs(d3-d2)/2+w2*(d3*(1-w1)+d2*w1)
-            # df[5][idx]= w1 * d1 * np.sin(np.arccos(np.abs((d3-d2)/(2*d1))))    
-            df.loc[idx, 5] = w1 * d1 * np.sin(np.arccos(np.abs((d3-d2)/(2*d1))))    
+    # only rows with case 1 have coordinates, rows with missing data (case 4) are left untouched
+    case_one = (df[0] == 1).values
+    w1 = (df[2].values[case_one]-ph0)/(ph1-ph0)
+    w2 = (df[3].values[case_one]-th0)/(th1-th0)
+    df.loc[case_one, 4] = w1 * np.abs(d3-d2)/2+w2*(d3*(1-w1)+d2*w1)
+    df.loc[case_one, 5] = w1 * d1 * np.sin(np.arccos(np.abs((d3-d2)/(2*d1))))
     
     return df
 
 
+# Number of rows whose distance to the first row of a flight candidate is computed at once in extract_flights
+DISTANCE_BLOCK_SIZE = 64
+
+# Margin (in meters) around w within which WindowWidth defers to is_flight_within_width, so rounding cannot change a decision
+WIDTH_TOLERANCE = 1e-6
+
+# is_flight_within_width of the windows of extract_flights: an anchor row, the interior rows first_idx to last_idx-1 and a
+# last row that moves forward one row at a time. The distance of an interior point u (relative to the anchor) to the line
+# with unit direction e is |cross(e, u)| <= |cross(e_ref, u)| + |e - e_ref| * |u|. Keeping the largest |cross(e_ref, u)| and
+# |u| of the interior points for a reference direction e_ref bounds the width of the window in O(1) for every new last row.
+# Interior points are only measured again, and e_ref moved to the current direction, when the bound reaches w.
+# A window is identified by its anchor and first interior rows, the bookkeeping starts over when they change.
+class WindowWidth:
+
+    def __init__(self, x_s, y_s, w):
+        self.x_s = x_s
+        self.y_s = y_s
+        self.w = w
+        self.anchor_idx = -1
+        self.first_idx = -1
+
+    def reset(self, anchor_idx, first_idx):
+        self.anchor_idx = anchor_idx
+        self.anchor_x = self.x_s[anchor_idx]
+        self.anchor_y = self.y_s[anchor_idx]
+        self.first_idx = first_idx
+        self.end_idx = first_idx
+        self.ref_x, self.ref_y = 1.0, 0.0
+        self.max_ref_distance = 0.0
+        self.max_norm = 0.0
+
+    def add_interior(self, last_idx):
+        for idx in range(self.end_idx, last_idx):
+            u_x = self.x_s[idx] - self.anchor_x
+            u_y = self.y_s[idx] - self.anchor_y
+            self.max_ref_distance = max(self.max_ref_distance, abs(self.ref_x*u_y - self.ref_y*u_x))
+            self.max_norm = max(self.max_norm, math.hypot(u_x, u_y))
+        self.end_idx = last_idx
+
+    def exact(self, last_idx):
+        window = np.r_[self.anchor_idx, self.first_idx:last_idx+1]
+        return is_flight_within_width(self.x_s[window], self.y_s[window], self.w)
+
+    def within_width(self, anchor_idx, first_idx, last_idx):
+        if anchor_idx != self.anchor_idx or first_idx != self.first_idx:
+            self.reset(anchor_idx, first_idx)
+        self.add_interior(last_idx)
+        d_x = self.x_s[last_idx] - self.anchor_x
+        d_y = self.y_s[last_idx] - self.anchor_y
+        if d_x == 0:
+            # is_flight_within_width compares absolute x coordinates with w when the line is vertical
+            return self.exact(last_idx)
+
+        norm = math.hypot(d_x, d_y)
+        e_x, e_y = d_x/norm, d_y/norm
+        if self.max_ref_distance + math.hypot(e_x - self.ref_x, e_y - self.ref_y)*self.max_norm < self.w - WIDTH_TOLERANCE:
+            return True
+
+        u_x = self.x_s[self.first_idx:last_idx] - self.anchor_x
+        u_y = self.y_s[self.first_idx:last_idx] - self.anchor_y
+        self.ref_x, self.ref_y = e_x, e_y
+        self.max_ref_distance = float(np.max(np.abs(e_x*u_y - e_y*u_x)))
+        if abs(self.max_ref_distance - self.w) <= WIDTH_TOLERANCE:
+            return self.exact(last_idx)
+        return self.max_ref_distance <= self.w
+
 def extract_flights(matrix, r, w):
     np_matrix = np.array(matrix)
     if len(np_matrix) == 1:
-        row = [[3, np_matrix[0][4], np_matrix[0][5], np_matrix[0][1], float("NaN"), float("NaN"), float("NaN")]]
-        return row
+        return np.array([[3, np_matrix[0][4], np_matrix[0][5], np_matrix[0][1], float("NaN"), float("NaN"), float("NaN")]])
     
+    # Same segmentation as growing a window from cur_idx and testing it with is_flight until it stops being a flight, but
+    # each test only checks what the newest row adds to the window:
+    # 1) the distance between the first and the last row of the window
+    # 2) the distance between the last two rows, the distances between the previous rows were >= r or the window would
+    #    have stopped earlier
+    # 3) the width of the window (is_flight_within_width), only windows with more than two rows, bounded incrementally
+    #    by WindowWidth
+    # Rows absorbed by a pause are skipped with next_alive_idx instead of being deleted from the matrix.
+    # Distances from cur_idx are computed in blocks of DISTANCE_BLOCK_SIZE rows and reused until cur_idx changes.
+    num_rows = len(np_matrix)
+    x_s = np_matrix[:,4]
+    y_s = np_matrix[:,5]
+    t_s = np_matrix[:,1]
+    consecutive_dists = np.sqrt(np.power(x_s[1:] - x_s[:-1], 2) + np.power(y_s[1:] - y_s[:-1], 2)).tolist()
+    block_cur_idx, block_start, block_end, block_dists = -1, 0, 0, []
+    window_width = WindowWidth(x_s, y_s, w)
+
     cur_idx = 0
+    next_alive_idx = 1
     output = []
-    timestamp = np_matrix[cur_idx][1] 
-    x = np_matrix[cur_idx][4] 
-    y = np_matrix[cur_idx][5] 
+    timestamp = t_s[cur_idx]
+    x = x_s[cur_idx]
+    y = y_s[cur_idx]
 
     distance_line = [x, y, timestamp, float("NaN"), float("NaN"), float("NaN")]
-    flight_stat = False
     last_pause_time = 0
     last_pause_idx = -1
     while True:
         
-        next_idx = cur_idx + 1
-        if next_idx == len(np_matrix)-1:
-            distance_line[3] = np_matrix[next_idx][4]
-            distance_line[4] = np_matrix[next_idx][5]
-            distance_line[5] = np_matrix[next_idx][1]
+        if next_alive_idx == num_rows-1:
+            distance_line[3] = x_s[next_alive_idx]
+            distance_line[4] = y_s[next_alive_idx]
+            distance_line[5] = t_s[next_alive_idx]
             output.append(distance_line)
             break
         
-        while True:            
-            part_of_matrix = np_matrix[cur_idx:next_idx+1]    
-            x_s = part_of_matrix[:,4]
-            y_s = part_of_matrix[:,5]
-            
-            flight_stat = is_flight(x_s, y_s, r, w)
+        next_idx = next_alive_idx
+        while True:
+            if block_cur_idx != cur_idx or next_idx >= block_end:
+                block_cur_idx, block_start, block_end = cur_idx, next_idx, min(next_idx + DISTANCE_BLOCK_SIZE, num_rows)
+                block_dists = np.sqrt(np.power(x_s[block_start:block_end] - x_s[cur_idx], 2) + np.power(y_s[block_start:block_end] - y_s[cur_idx], 2)).tolist()
+            first_to_last_dist = block_dists[next_idx - block_start]
+
+            if next_idx == next_alive_idx:
+                flight_stat = first_to_last_dist >= r
+            elif first_to_last_dist < r or consecutive_dists[next_idx-1] < r:
+                flight_stat = False
+            else:
+                flight_stat = window_width.within_width(cur_idx, next_alive_idx, next_idx)
 
             if not flight_stat:
-                last_pause_time = part_of_matrix[len(part_of_matrix)-1][1]            
+                last_pause_time = t_s[next_idx]
                 last_pause_idx = next_idx
                 break
             
             next_idx += 1
 
-            if next_idx >= len(np_matrix):
+            if next_idx >= num_rows:
                 break
 
 
-        if next_idx == cur_idx + 1 and next_idx < len(np_matrix):            
-            distance_line[2] = np_matrix[next_idx][1]            
-            np_matrix = np.delete(np_matrix, (next_idx), axis=0)
+        if next_idx == next_alive_idx and next_idx < num_rows:
+            distance_line[2] = t_s[next_idx]
+            next_alive_idx += 1
+            last_pause_idx = next_alive_idx
         else:
-            distance_line[3] = np_matrix[next_idx-1][4]
-            distance_line[4] = np_matrix[next_idx-1][5]
-            distance_line[5] = np_matrix[next_idx-1][1]
+            distance_line[3] = x_s[next_idx-1]
+            distance_line[4] = y_s[next_idx-1]
+            distance_line[5] = t_s[next_idx-1]
             
             output.append(distance_line)            
             cur_idx = next_idx - 1
+            next_alive_idx = next_idx
 
-            distance_line = [np_matrix[cur_idx][4], np_matrix[cur_idx][5], np_matrix[cur_idx][1], float("NaN"), float("NaN"), float("NaN")]
+            distance_line = [x_s[cur_idx], y_s[cur_idx], t_s[cur_idx], float("NaN"), float("NaN"), float("NaN")]
 
-        if next_idx >= len(np_matrix):
+        if next_idx >= num_rows:
             break
 
     if len(output) == 0:
-        last_timestamp_in_matrix = np_matrix[len(np_matrix)-1][1]
-        row = [2, x, y, np_matrix[0][1], float("NaN"), float("NaN"), last_timestamp_in_matrix]
-        return [row]
+        last_timestamp_in_matrix = t_s[num_rows-1]
+        return np.array([[2, x, y, np_matrix[0][1], float("NaN"), float("NaN"), last_timestamp_in_matrix]])
 
-    result = []
+    result = MobMat(2 * len(output) + 2)
     if timestamp < output[0][2]:        
         row = [2, x, y, timestamp, float("NaN"), float("NaN"), output[0][2]]
         result.append(row)
         if len(output) == 1:
             result[0][6] = output[0][5]
-            return result
+            return result.matrix
 
     if len(output) == 1:
-        result = [[1] + output[0]]
-        return result
+        return np.array([[1] + output[0]])
 
     for idx, row in enumerate(output):
-        if result != []:
+        if len(result) > 0:
             cur_time = row[2]            
             prev_row = result[len(result)-1]
             if prev_row[0] == 2: #is a pause
@@ -459,9 +621,8 @@ def extract_flights(matrix, r, w):
         else:            
             result.append([1] + row)
 
-    last_row = result[len(result)-1]
+    last_row = result[len(result)-1].copy()
     last_timestamp = last_row[6]
-    result = np.array(result)
     ID_flight = np.where(result[:,0] == 1)[0]
     ID_pause = np.where(((result[ID_flight,1] - result[ID_flight,4]) ** 2 + (result[ID_flight,2]-result[ID_flight,5])**2) == 0)[0] 
 
@@ -471,8 +632,6 @@ def extract_flights(matrix, r, w):
             result[ID_flight[ID_pause], 4] = float("nan")
             result[ID_flight[ID_pause], 5] = float("nan")
 
-    result = list(result)
-    
     if last_timestamp < last_pause_time:
         status = last_row[0]
         if status == 1:
@@ -481,8 +640,8 @@ def extract_flights(matrix, r, w):
         else:
             x_0 = last_row[1]
             y_0 = last_row[2]
-        x_1 = np_matrix[last_pause_idx][4]
-        y_1 = np_matrix[last_pause_idx][5]
+        x_1 = x_s[last_pause_idx]
+        y_1 = y_s[last_pause_idx]
         flight_stat = is_flight(np.array([x_0, x_1]), np.array([y_0, y_1]), r, w)
         if flight_stat:                
             end_row = [1, x_0, y_0, last_timestamp, x_1, y_1, last_pause_time]        
@@ -519,11 +678,11 @@ def extract_flights(matrix, r, w):
             else:
                 end_row = [2, x_0, y_0, last_timestamp, float("NaN"), float("NaN"), last_timestamp_in_matrix]
                 result.append(end_row)
-    return result
+    return result.matrix
 
 def guess_pause(matrix, min_duration=300, pause_rad=75):
-    print("Inferring pauses...")
-    np_matrix = np.array(matrix)
+    # copy, collapse_to_pause overwrites the zeros of the rows it collapses with NaN
+    np_matrix = np.array(matrix, dtype=np.float64)
     flatmat = get_flatmat(np_matrix, min_duration, pause_rad)
     result = collapse_pause_in_matrix(np_matrix, flatmat)
     return result
@@ -533,9 +692,9 @@ def collapse_pause_in_matrix(matrix, flatmat):
     if len(flatmat) == 0:
         return matrix
     else:
-        output_mat = []
+        output_mat = MobMat(len(matrix))
         if flatmat[0][0] > 1:            
-            output_mat = list(matrix[0:flatmat[0][0]-1,])
+            output_mat.extend(matrix[0:flatmat[0][0]-1,])
 
         for i in range(len(flatmat)):
             start_idx = flatmat[i][0]
@@ -547,18 +706,13 @@ def collapse_pause_in_matrix(matrix, flatmat):
             if i+1 < len(flatmat) and flatmat[i][1] < flatmat[i+1][1] - 1:    
                 another_start = flatmat[i][1]+1
                 another_end = flatmat[i+1][0]
-                rows = matrix[another_start:another_end]
-                
-                for row in rows:
-                    output_mat.append(row.tolist())                    
+                output_mat.extend(matrix[another_start:another_end])
 
         if flatmat[-1][1] < len(matrix)-1:    
 
             the_idx = flatmat[-1][1]+1
-            rows = matrix[the_idx:len(matrix),]
-            
-            for row in rows:                
-                output_mat.append(row.tolist())
+            output_mat.extend(matrix[the_idx:len(matrix),])
+        output_mat = output_mat.matrix
 
 
     if len(output_mat) == 1:
@@ -566,7 +720,6 @@ def collapse_pause_in_matrix(matrix, flatmat):
     else:
         # Group together adjacent pauses, averaging their location
         flatmat2 = []
-        output_mat2 = []
         collapse = False
         cstart = 0
         
@@ -588,10 +741,10 @@ def collapse_pause_in_matrix(matrix, flatmat):
     if flatmat2 == []:
         output_mat2 = output_mat
     else:        
-        output_mat2 = []
+        output_mat2 = MobMat(len(output_mat))
         if flatmat2[0][0] > 1:
             end_idx = flatmat2[0][0]            
-            output_mat2 = output_mat[0: end_idx]
+            output_mat2.extend(output_mat[0: end_idx])
 
         for i in range(len(flatmat2)):
             start_idx = flatmat2[i][0]            
@@ -603,16 +756,12 @@ def collapse_pause_in_matrix(matrix, flatmat):
             if i < len(flatmat2)-1 and flatmat2[i][1] < flatmat2[i+1][0]-1:
                 init_idx = flatmat2[i][1]+1
                 end_idx = flatmat2[i+1][0]
-                result2 = output_mat[init_idx:end_idx]
-                temp_result2 = output_mat[init_idx:end_idx+1]
-                output_mat2 += result2
+                output_mat2.extend(output_mat[init_idx:end_idx])
 
         if flatmat2[-1][1] < len(output_mat):    
             begin = (flatmat2[-1][1]+1)
-            end = len(output_mat)
-            temp = output_mat[begin:len(output_mat)]
-            for t in temp:
-                output_mat2.append(t)
+            output_mat2.extend(output_mat[begin:len(output_mat)])
+        output_mat2 = output_mat2.matrix
 
     # Set flight endpoints equal to pause endpoints
     if output_mat2[0][0]== 1 and output_mat2[1][0] == 2:
@@ -722,21 +871,19 @@ def collapse_to_pause(matrix):
 
 def get_max_radius(matrix):
     center_of_points = np.nanmean(matrix, axis=0)    
-    x_list = matrix[:,0]
-    y_list = matrix[:,1]
-    dists = np.sqrt((x_list - center_of_points[0])**2 + (y_list - center_of_points[1])**2)
+    dists = euclidean(matrix[:,0], matrix[:,1], center_of_points[0], center_of_points[1])
     max_dist = np.nanmax(dists)    
     return max_dist
 
 
 def initialize_params(matrix):
-    np_matrix = np.array(matrix)    
+    np_matrix = np.asarray(matrix, dtype=np.float64)
     one = np.where(np_matrix[:,0] == 1)
     two = np.where(np_matrix[:,0] == 2)
     three = np.where(np_matrix[:,0] == 3)
     four = np.where(np_matrix[:,0] == 4)
     
-    if len(one) > 1:
+    if len(one[0]) > 1:
         ID1p1 = one[0]+1
         condition1 = one[0][len(one[0])-1]
         if len(one[0]) > 0 and condition1 == len(np_matrix)-1:
@@ -758,7 +905,7 @@ def initialize_params(matrix):
             phatall = l2/(l1+l2)
 
         if (l1+l2) == 0:
-            phatall = len(two)/(len(one) + len(two))
+            phatall = len(two[0])/(len(one[0]) + len(two[0]))
 
 
         # ------ flight distances & times & pauses -------
@@ -813,12 +960,14 @@ def initialize_params(matrix):
         the_dict = {'ID1': one, "ID2": two, "ID3": three, "ID4":four, "ID1p1": ID1p1, "allts": all_timestamp, "ind11": ind11, "ind12": ind12, "phatall": phatall, "fd": flight_distances, "ft": flight_times, "fa": fa, "fts": flight_timestamps, "pt": pause_times, "pts": pts, "fxs": fxs, "fys": fys, "pxs": pxs, "pys": pys, "allxs": all_x, "allys": all_y}
         return the_dict
     else:
-        print("No mobility flights were found in this participant's location data")
+        warnings.warn("No mobility flights were found in this participant's location data")
         return None
 
 #simulate_mobility_gaps
 #impute the missing gaps hot-tech computation
-def simulate_mobility_gaps(matrix, obj, wtype, spread_pars):
+def simulate_mobility_gaps(matrix, obj, wtype, spread_pars, rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
     ind11 = obj['ind11']
     ind12 = obj['ind12']
     fd = obj['fd']
@@ -838,9 +987,10 @@ def simulate_mobility_gaps(matrix, obj, wtype, spread_pars):
     if len(matrix) == 0:
         return matrix
 
-    f_outmat = []
+    # imputed gaps add a few rows each
+    f_outmat = MobMat(2 * len(matrix))
 
-    for i in tqdm(range(len(matrix)), total=len(matrix)):
+    for i in progress(range(len(matrix)), total=len(matrix)):
         if matrix[i][0] == 1:
             cur_x = matrix[i][4]
             cur_y = matrix[i][5]
@@ -853,29 +1003,17 @@ def simulate_mobility_gaps(matrix, obj, wtype, spread_pars):
 
         else: #check here
             if i > 0 and i < len(matrix) - 1:
-                varmult = 1
-                while True:
-                    #----- fw ------                    
-                    denominator = varmult*(matrix[i][6]-matrix[i][3])        
-                    the_mean = np.mean([matrix[i][3],matrix[i][6]])
-                    temp_fw = (fts-the_mean)/denominator
-                    temp_pw = (pts-the_mean)/denominator
-                    temp_allw = (allts-the_mean)/denominator
-                    
-                    fw = norm.pdf(list(temp_fw))
-                    pw = norm.pdf(list(temp_pw))
-                    allw = norm.pdf(list(temp_allw))
-
-                    if len(pts)>0 and len(fts)>0 and np.sum(fw)>0 and np.sum(pw)>0:                        
-                        break
-
-                    if len(pts) == 0 and len(fts)>0 and np.sum(fw)>0:
-                        break
-
-                    if len(fts) == 0 and len(pts)>0 and np.sum(pw)>0:
-                        break
-                    
-                    varmult = varmult*2    
+                #----- fw ------                    
+                gap_duration = matrix[i][6]-matrix[i][3]
+                the_mean = np.mean([matrix[i][3],matrix[i][6]])
+                # the weights of flights and pauses must not be all zero
+                varmult = max(gap_weights_varmult(fts, the_mean, gap_duration), gap_weights_varmult(pts, the_mean, gap_duration))
+                denominator = varmult*gap_duration
+
+                fw = normal_pdf((fts-the_mean)/denominator)
+                pw = normal_pdf((pts-the_mean)/denominator)
+                allw = normal_pdf((allts-the_mean)/denominator)
+
                 s11 = np.nansum(allw[ind11])
                 s12 = np.nansum(allw[ind12])
                 if (s11 + s12) == 0:
@@ -887,16 +1025,36 @@ def simulate_mobility_gaps(matrix, obj, wtype, spread_pars):
                     new_row = [1, cur_x, cur_y, matrix[i][3], matrix[i+1][1], matrix[i+1][2], matrix[i][6]]
                     f_outmat.append(new_row)
                 else:
-                    rb_out = random_bridge(x0=cur_x,y0=cur_y,x1=matrix[i+1][1],y1=matrix[i+1][2],t0=matrix[i][3],t1=matrix[i][6],fd=fd,ft=ft,fts=fts,fa=fa,fw=fw,probp=phatcur,pt=pt,pts=pts,pw=pw,allts=allts,allw=allw,ind11=ind11,ind12=ind12,i_ind=i,pxs=pxs,pys=pys,fxs=fxs,fys=fys,allxs=allxs,allys=allys,wtype=wtype,canpause=matrix[i-1][0]==1,spread_pars=spread_pars,niter=100)
-                    old_foutmat = f_outmat
-                    f_outmat  = f_outmat + rb_out
-
-    return f_outmat
-
+                    rb_out = random_bridge(x0=cur_x,y0=cur_y,x1=matrix[i+1][1],y1=matrix[i+1][2],t0=matrix[i][3],t1=matrix[i][6],fd=fd,ft=ft,fts=fts,fa=fa,fw=fw,probp=phatcur,pt=pt,pts=pts,pw=pw,allts=allts,allw=allw,ind11=ind11,ind12=ind12,i_ind=i,pxs=pxs,pys=pys,fxs=fxs,fys=fys,allxs=allxs,allys=allys,wtype=wtype,canpause=matrix[i-1][0]==1,spread_pars=spread_pars,niter=100,rng=rng)
+                    f_outmat.extend(rb_out)
+
+    return f_outmat.matrix
+
+# Standard normal density, same expression as scipy.stats.norm.pdf without its argument checks
+def normal_pdf(z):
+    return np.exp(-z**2/2.0) / NORMAL_PDF_CONSTANT
+
+# Smallest power of two varmult for which normal_pdf((times-the_mean)/(varmult*gap_duration)) is not all zero.
+# The densities of all times are zero when the density of the closest time underflows (|z| > ~38.6), so varmult
+# starts from the largest power of two that leaves the closest time at |z| >= 38 and doubles at most a couple of times.
+def gap_weights_varmult(times, the_mean, gap_duration):
+    if len(times) == 0:
+        return 1
+    closest_time = times[np.argmin(np.abs(times - the_mean))]
+    varmult = 2 ** int(np.floor(np.log2(max(1.0, np.abs(closest_time - the_mean) / (38 * gap_duration)))))
+    while normal_pdf((closest_time - the_mean)/(varmult*gap_duration)) == 0:
+        varmult = varmult*2
+    return varmult
+
+# Student's t density, closed form of scipy.stats.t.pdf
+def student_t_pdf(x, df):
+    return np.exp(special.gammaln((df+1)/2) - special.gammaln(df/2)) / np.sqrt(df*np.pi) * (1 + x**2/df) ** (-(df+1)/2)
+
+# cur_x, cur_y, cur_t and varmult are scalars or (chains, 1) arrays, in which case there is one row of weights per chain
 def get_weights(fxs, cur_x, fys, cur_y, varmult, spread_pars, fts, cur_t, t1, t0, weight_type):
     if weight_type == "TL":
         calc = spread_pars[0]*(fts-cur_t)/(varmult*(t1-t0))
-        t_score = t.pdf(calc, df=spread_pars[1])
+        t_score = student_t_pdf(calc, spread_pars[1])
         return t_score
     elif weight_type == "GL":
         pow_xs = (fxs-cur_x)**2
@@ -905,7 +1063,7 @@ def get_weights(fxs, cur_x, fys, cur_y, varmult, spread_pars, fts, cur_t, t1, t0
         
         distance = np.sqrt(sum_x_y)    
         calc = spread_pars[0]*distance/(50*varmult)
-        t_score = t.pdf(calc,df=spread_pars[1])
+        t_score = student_t_pdf(calc, spread_pars[1])
         return t_score
 
     elif weight_type == "GLR":
@@ -916,87 +1074,93 @@ def get_weights(fxs, cur_x, fys, cur_y, varmult, spread_pars, fts, cur_t, t1, t0
         distance = np.sqrt(sum_x_y)    
         calc = spread_pars[0]*distance/(50*varmult)
 
-        left = t.pdf(calc,df=spread_pars[1])
+        left = student_t_pdf(calc, spread_pars[1])
 
         temp1 = np.abs((fts-cur_t))%(60*60*24)                    
         temp2 = (60*60*24)-np.abs((fts-cur_t))%(60*60*24)
 
         min_num = np.minimum(temp1, temp2)
-        top = np.array(spread_pars[0]* min_num)
+        top = spread_pars[0]* min_num
         
-        bottom = np.array(varmult*(t1-t0))
-        top_div_bottom = list(top/bottom)
+        bottom = varmult*(t1-t0)
         
-        right = t.pdf(top_div_bottom,df=spread_pars[1])
+        right = student_t_pdf(top/bottom, spread_pars[1])
         fw = left * right
         return fw
 
-def random_bridge(x0,y0,x1,y1,t0,t1,fd,ft,fts,fa,fw,probp,pt,pts,pw,allts,allw,ind11,ind12,i_ind,pxs,pys,fxs,fys,allxs,allys,wtype,canpause,spread_pars,niter=100):
-    success = False
-    for i in range(niter):
-        outmat = []
-        cur_x = x0
-        cur_y = y0
-        cur_t = t0
-        t_arrive = t0
+# Sample an index with probabilities proportional to weights. Draws from rng exactly as
+# rng.choice(len(weights), 1, replace=False, p=weights/np.sum(weights)) does, without its argument checks
+def sample_index(weights, rng):
+    cdf = np.cumsum(weights/np.sum(weights))
+    cdf /= cdf[-1]
+    return int(cdf.searchsorted(rng.random(), side="right"))
+
+# Simulate one candidate bridge from (x0, y0, t0). At every step the bridge either pauses or takes a flight sampled from
+# the observed flights (or pauses) weighted by how close they are to its current location and time. It stops when its
+# next flight or pause would end after t1.
+# Returns the rows of the bridge and the time at which it arrived at its last location.
+def sample_bridge(x0,y0,t0,t1,fd,ft,fts,fa,probp,pt,pts,allts,ind11,ind12,pxs,pys,fxs,fys,allxs,allys,wtype,canpause,spread_pars,rng):
+    outmat = []
+    cur_x = x0
+    cur_y = y0
+    cur_t = t0
+    t_arrive = t0
+    while True:
+        varmult = 1
         while True:
-            varmult = 1
-            while True:
-                fw = get_weights(fxs, cur_x, fys, cur_y, varmult, spread_pars, fts, cur_t, t1, t0, weight_type=wtype)
-                pw = get_weights(pxs, cur_x, pys, cur_y, varmult, spread_pars, pts, cur_t, t1, t0, weight_type=wtype)
-                allw = get_weights(allxs, cur_x, allys, cur_y, varmult, spread_pars, allts, cur_t, t1, t0, weight_type=wtype)
-                
-                if len(pts)>0 and len(fts)>0 and np.sum(fw)>0 and np.sum(pw)>0:
+            fw = get_weights(fxs, cur_x, fys, cur_y, varmult, spread_pars, fts, cur_t, t1, t0, weight_type=wtype)
+            pw = get_weights(pxs, cur_x, pys, cur_y, varmult, spread_pars, pts, cur_t, t1, t0, weight_type=wtype)
+            if (len(fts) == 0 or np.sum(fw) > 0) and (len(pts) == 0 or np.sum(pw) > 0):
+                break
+            varmult = varmult*2
+        allw = get_weights(allxs, cur_x, allys, cur_y, varmult, spread_pars, allts, cur_t, t1, t0, weight_type=wtype)
+
+        s11 = np.nansum(allw[ind11])
+        s12 = np.nansum(allw[ind12])
+        if (s11 + s12) != 0:
+            probp = s12/float(s11+s12)
+
+        uniform_sample = rng.uniform(0, 1)
+        if canpause and uniform_sample < probp and len(pt) > 0:
+            canpause = False
+            p_samp = pt[sample_index(pw, rng)]
+            if cur_t + p_samp < t1:
+                outmat.append([2, cur_x, cur_y, cur_t, float("NaN"), float("NaN"), cur_t + p_samp])
+                cur_t = cur_t + p_samp
+            else:
+                break
+        else:
+            canpause = True
+            IDsamp = sample_index(fw, rng)
+            a_samp = fa[IDsamp]
+            d_samp = fd[IDsamp]
+            t_samp = ft[IDsamp]
+            if cur_t + t_samp < t1:
+                next_x = cur_x + np.cos(a_samp)*d_samp
+                next_y = cur_y + np.sin(a_samp)*d_samp
+                if np.isnan(next_x):
                     break
+                outmat.append([1, cur_x, cur_y, cur_t, next_x, next_y, cur_t + t_samp])
+                cur_t = cur_t + t_samp
+                cur_x = next_x
+                cur_y = next_y
+                t_arrive = cur_t
+            else:
+                break
 
-                if len(pts) == 0 and len(fts)>0 and np.sum(fw)>0:
-                    break
+    return outmat, t_arrive
 
-                if len(fts) == 0 and len(pts)>0 and np.sum(pw)>0:
-                    break
+# Impute the gap between (x0, y0, t0) and (x1, y1, t1). The first of up to niter candidate bridges that moves at least once
+# is stretched to end at (x1, y1). If none of them moves, the gap becomes a straight flight. Every attempt starts from
+# the canpause and probp of the gap.
+def random_bridge(x0,y0,x1,y1,t0,t1,fd,ft,fts,fa,fw,probp,pt,pts,pw,allts,allw,ind11,ind12,i_ind,pxs,pys,fxs,fys,allxs,allys,wtype,canpause,spread_pars,niter=100,rng=None):
+    if rng is None:
+        rng = np.random.default_rng()
+    fd, ft, fa, pt = np.asarray(fd), np.asarray(ft), np.asarray(fa), np.asarray(pt)
 
-                varmult = varmult*2 
-            
-            s11 = np.nansum(allw[ind11])
-            s12 = np.nansum(allw[ind12])
-            if (s11 + s12) == 0:
-                phatcur = probp
-            else:
-                phatcur = s12/float(s11+s12)
-            probp = phatcur
-            uniform_sample = np.random.uniform(0, 1, 1)
-            if canpause and uniform_sample < probp:
-                canpause = False
-                normalized_pw = pw/np.sum(pw)
-                p_samp = np.random.choice(pt, 1, replace=False, p=normalized_pw)
-                if (cur_t + p_samp) < 1:
-                    next_line = [2, cur_x, cur_y, cur_t, float("Nan"), float("Nan"), cur_t + p_samp]
-                    cur_t = cur_t + p_samp
-                    outmat.append(next_line)
-                else:
-                    break
-            else:
-                canpause = True
-                the_list = list(range(0,len(fa)))
-                normalized_fw = fw/np.sum(fw)
-                IDsamp = np.random.choice(the_list, 1, replace=False, p=normalized_fw)[0]
-                a_samp = fa[IDsamp]
-                d_samp = fd[IDsamp]
-                t_samp = ft[IDsamp]
-                if cur_t + t_samp < t1:
-                    next_x = cur_x + np.cos(a_samp)*d_samp
-                    next_y = cur_y + np.sin(a_samp) * d_samp
-
-                    if str(next_x) == "nan":
-                        break
-                    next_line = [1, cur_x, cur_y, cur_t, next_x, next_y, cur_t + t_samp]
-                    cur_t = cur_t + t_samp
-                    cur_x = next_x
-                    cur_y = next_y                    
-                    outmat.append(next_line)
-                    t_arrive = cur_t
-                else:
-                    break
+    success = False
+    for i in range(niter):
+        outmat, t_arrive = sample_bridge(x0,y0,t0,t1,fd,ft,fts,fa,probp,pt,pts,allts,ind11,ind12,pxs,pys,fxs,fys,allxs,allys,wtype,canpause,spread_pars,rng)
         if t_arrive > t0:
             success = True
             break
@@ -1027,13 +1191,26 @@ def random_bridge(x0,y0,x1,y1,t0,t1,fd,ft,fts,fa,fw,probp,pt,pts,pw,allts,allw,i
         return outmat
 
 #get significant locations
+# Centers of the significant locations: a k-means fit of the pause locations weighted by pause_weights, with k increased from 2
+# until two centers are closer than 2*center_rad. The last fit before that is kept. Pauses are weighted instead of repeated
+# and every k is a fresh fit with the same seed
+def significant_location_centers(pause_locations, pause_weights, center_rad):
+    kmeans_fit = KMeans(n_clusters=2, random_state=23).fit(pause_locations, sample_weight=pause_weights)
+    if np.min(pdist(kmeans_fit.cluster_centers_, 'euclidean')) >= center_rad*2:
+        for kmeansk in range(3, len(pause_locations)+1):
+            next_fit = KMeans(n_clusters=kmeansk, random_state=23).fit(pause_locations, sample_weight=pause_weights)
+            if np.min(pdist(next_fit.cluster_centers_, 'euclidean')) < center_rad*2:
+                break
+            kmeans_fit = next_fit
+    return kmeans_fit.cluster_centers_
+
 def sig_locs(mobmat, obj, center_rad=125, timezone="", min_pause_time=600):
 
-    np_matrix = np.array(mobmat, dtype=np.float64)
+    np_matrix = np.asarray(mobmat, dtype=np.float64)
     obj = initialize_params(np_matrix)
     ID2_from_matrix = obj['ID2'][0]
     if len(ID2_from_matrix) == 0:
-        print("No pauses in mobmat within function sig locs")
+        warnings.warn("No pauses in mobmat within function sig locs")
         return None
     elif len(ID2_from_matrix) == 1:
         x_for_outmat = [np_matrix[ID2_from_matrix[1]][1]]
@@ -1046,55 +1223,37 @@ def sig_locs(mobmat, obj, center_rad=125, timezone="", min_pause_time=600):
         ptred = np.floor(pt_div_min)        
         pause_ids = np.where(ptred > 0)[0]        
         if len(pause_ids) < 2:
-            print("No pauses long enough in mobmat within function SigLocs!")
+            warnings.warn("No pauses long enough in mobmat within function SigLocs!")
             return None
         
-        pmat = []
-        for i in range(len(ID2_from_matrix)):
-            if ptred[i] > 0:
-                row_i = np_matrix[ID2_from_matrix[i]][1:3]
-                duplicate_row_i = [row_i] * int(ptred[i])                
-                pmat += duplicate_row_i
-
-        kmeansk_v = list(range(2, len(pause_ids)+1))
-        previous_fit = []
-        for i in range(len(kmeansk_v)):
-            kmeansk = kmeansk_v[i]
-            kmeans_fit = KMeans(n_clusters=kmeansk, random_state=23).fit(pmat)
-            the_distances = pdist(kmeans_fit.cluster_centers_, 'euclidean')
-            min_dist = np.min(the_distances)
-            if min_dist < center_rad*2 or i == len(kmeansk_v):        
-                if i > 0:
-                    kmeansk = kmeansk_v[i-1]
-                    kmeans_fit = previous_fit
-                break            
-            previous_fit = kmeans_fit
-
-        cluster_centers = kmeans_fit.cluster_centers_
+        # each pause is weighted by its number of min_pause_time periods
+        pause_locations = np_matrix[np.array(ID2_from_matrix)[pause_ids]][:, 1:3]
+        cluster_centers = significant_location_centers(pause_locations, ptred[pause_ids], center_rad)
         num_row_centers = len(cluster_centers)
 
         outmat = [cluster_centers[:,0], cluster_centers[:,1], np.zeros(num_row_centers), np.zeros(num_row_centers)]
 
     #Determine time spent at these significant locations
-    for i in range(len(ID2_from_matrix)):
-        for j in range(num_row_centers):
-            euc_dist = np.sqrt((np_matrix[ID2_from_matrix[i]][1] - outmat[0][j])**2 + (np_matrix[ID2_from_matrix[i]][2] - outmat[1][j])**2)
-            if euc_dist < center_rad:
-                outmat[2][j] = outmat[2][j] + obj['pt'][i]
+    pauses = np_matrix[ID2_from_matrix]
+    pause_times = np.array(obj['pt'])
+    near_center = np.zeros((len(pauses), len(outmat[0])), dtype=bool)
+    located_ids = np.flatnonzero(np.isfinite(pauses[:, 1:3]).all(axis=1))
+    if len(located_ids) > 0:
+        pause_tree = cKDTree(pauses[located_ids, 1:3])
+        for center_id, pause_ids_near in enumerate(pause_tree.query_ball_point(np.column_stack([outmat[0], outmat[1]]), r=center_rad)):
+            near_center[located_ids[pause_ids_near], center_id] = True
+    outmat[2] = outmat[2] + np.sum(near_center * pause_times[:, np.newaxis], axis=0)
 
     #Determine which is home (where is the night spent)    
+    at_night = np.zeros(len(ID2_from_matrix), dtype=bool)
     for i in range(len(ID2_from_matrix)):
-        avg_time = (np_matrix[ID2_from_matrix[i]][6]+np_matrix[ID2_from_matrix[i]][3])/2
+        avg_time = (pauses[i][6]+pauses[i][3])/2
         if timezone == "":
             hour_of_day = datetime.datetime.fromtimestamp(avg_time).hour
         else:
             hour_of_day = datetime.datetime.fromtimestamp(avg_time, tz=tz.gettz(timezone)).hour
-            
-        if hour_of_day >= 21 or hour_of_day < 6:
-            for j in range(num_row_centers):
-                euc_dist = np.sqrt((np_matrix[ID2_from_matrix[i]][1] - outmat[0][j])**2 + (np_matrix[ID2_from_matrix[i]][2] - outmat[1][j])**2)
-                if euc_dist < center_rad:                    
-                    outmat[3][j] = outmat[3][j] + obj['pt'][i]
+        at_night[i] = hour_of_day >= 21 or hour_of_day < 6
+    outmat[3] = outmat[3] + np.sum(near_center[at_night] * pause_times[at_night, np.newaxis], axis=0)
     IDmax = np.argmax(outmat[3])    
     outmat[3][IDmax] = 1
     transposed_outmat = np.array(outmat).transpose()
@@ -1110,19 +1269,15 @@ def home_time(matrix, slout, center_rad):
     x_center = slout[IDhome, 0]
     y_center = slout[IDhome, 1]    
     
-    tot_time = 0
-    for i in range(len(matrix)):
-        if matrix[i][0]==2 and np.sqrt((matrix[i][1]-x_center)**2+(matrix[i][2]-y_center)**2)<center_rad: 
-            tot_time=tot_time+matrix[i][6]-matrix[i][3]
+    pauses = matrix[matrix[:,0] == 2]
+    at_home = np.any(euclidean_to_centroids(pauses[:,1], pauses[:,2], x_center, y_center) < center_rad, axis=1)
+    tot_time = np.sum(pauses[at_home,6] - pauses[at_home,3])
     result = tot_time/60    
     return result
 
 def distance_traveled(matrix):
-    dt = 0
-    for i in range(len(matrix)):
-        if matrix[i][0]==1:
-          temp = np.sqrt((matrix[i][4]-matrix[i][1])**2+(matrix[i][5]-matrix[i][2])**2)
-          dt += temp    
+    flights = matrix[matrix[:,0] == 1]
+    dt = np.sum(euclidean(flights[:,1], flights[:,2], flights[:,4], flights[:,5]))
     return dt
 
 def radius_of_gyration(matrix, interval): 
@@ -1173,42 +1328,28 @@ def max_home_distance(matrix, homex, homey):
     if len(IDmv) == 0:
         return None
     else:
-        dfhome = np.zeros(len(IDmv))
-        for i in range(len(IDmv)):
-            temp = np.sqrt((matrix[IDmv[i]][1]-homex)**2+(matrix[IDmv[i]][2]-homey)**2)
-            dfhome[i] = temp
+        dfhome = euclidean(matrix[IDmv,1], matrix[IDmv,2], homex, homey)
     return np.max(dfhome)
 
 def sig_locs_visited(matrix, slout, center_rad): 
-    places_visited = np.zeros(len(slout))
-    for i in range(len(matrix)):
-        if matrix[i][0] <=3:
-            for j in range(len(slout)):
-                temp = np.sqrt((slout[j][0]-matrix[i][1])**2 + (slout[j][1]-matrix[i][2])**2)
-                if temp < center_rad:
-                    places_visited[j] = 1
+    locations = matrix[matrix[:,0] <= 3]
+    places_visited = np.any(euclidean_to_centroids(locations[:,1], locations[:,2], slout[:,0], slout[:,1]) < center_rad, axis=0)
 
-    result = np.sum(places_visited)
+    result = float(np.sum(places_visited))
     return result
 
 def avg_flight(matrix, avg_type): 
     #avg_type = "length" or "duration"
-    num = 0.0
-    total = 0.0
-    for i in range(len(matrix)):
-        if matrix[i][0] == 1:
-            added_number = 0
-            if avg_type == "length":
-                added_number = np.sqrt((matrix[i][4]-matrix[i][1])**2 + (matrix[i][5]-matrix[i][2])**2)
-            else:
-                added_number = matrix[i][6] - matrix[i][3]
-            total += added_number
-            num += 1
+    flights = matrix[matrix[:,0] == 1]
+    num = len(flights)
 
     if num == 0:
         return 0
+    elif avg_type == "length":
+        total = np.sum(euclidean(flights[:,1], flights[:,2], flights[:,4], flights[:,5]))
     else:
-        return total/num
+        total = np.sum(flights[:,6] - flights[:,3])
+    return total/num
 
 def std_flight(matrix, std_type): 
     #std_type = "length" or "duration" 
@@ -1217,8 +1358,7 @@ def std_flight(matrix, std_type):
         return 0
     else:
         if std_type == "length":
-            temp = ((matrix[ID1,5]-matrix[ID1,2])**2 + (matrix[ID1, 4] - matrix[ID1, 1])**2)
-            dist = np.sqrt(list((matrix[ID1,5]-matrix[ID1,2])**2 + (matrix[ID1, 4] - matrix[ID1, 1])**2))
+            dist = euclidean(matrix[ID1,1], matrix[ID1,2], matrix[ID1,4], matrix[ID1,5])
             std_result = np.std(dist)
         else:
             std_result = np.std(matrix[ID1, 6] - matrix[ID1,3])
@@ -1239,13 +1379,9 @@ def prob_pause(matrix):
     return result
 
 def sig_loc_entropy(matrix, slout, center_rad): 
-    tp = np.zeros(len(slout))
-    for i in range(len(matrix)):
-        if matrix[i][0] ==2:
-            for j in range(len(slout)):
-                temp = np.sqrt((slout[j][0]-matrix[i][1])**2 + (slout[j][1]-matrix[i][2])**2)
-                if temp < center_rad:
-                    tp[j] += matrix[i][6]-matrix[i][3]
+    pauses = matrix[matrix[:,0] == 2]
+    near_location = euclidean_to_centroids(pauses[:,1], pauses[:,2], slout[:,0], slout[:,1]) < center_rad
+    tp = np.sum(near_location * (pauses[:,6] - pauses[:,3])[:, np.newaxis], axis=0)
 
     total = 0
     sum_tp = np.sum(tp)
@@ -1266,72 +1402,61 @@ def mins_missing(matrix):
 
     return total/60.0
 
-def location_at(matrix, the_time):
-    for i in range(len(matrix)):
-        if matrix[i][0] <= 2:
-            if matrix[i][3] <= the_time and matrix[i][6] >= the_time:
-                return matrix[i][1], matrix[i][2]
-        elif matrix[i][2] == 3:
-            if matrix[i][3] == the_time:
-                return matrix[i][1], matrix[i][2]
-    return None
-
-def day_dist(i1, i2, mobmat, subset_inds_v,subset_start_time_v,center_rad):
-    
-    multiplier = np.arange(30*60, 60*60*24, 60*60)
-    
-    checkpoints = subset_start_time_v[i1] + multiplier    
-    checkpoints2 = subset_start_time_v[i2] + multiplier
-    matrix1 = mobmat[subset_inds_v[i1]]
-    matrix2 = mobmat[subset_inds_v[i2]]
-    same_place = np.empty(24)
-    same_place[:] = np.nan
-    for i in range(24):
-        loc1 = location_at(matrix1, checkpoints[i])
-        if loc1 == None:
-            continue
-        abs_diff = np.abs(matrix2[:,3]-checkpoints[i])%(60*60*24)        
-        smaller = list(np.where(abs_diff < 30*60)[0])
-        greater = list(np.where(abs_diff > (60*60*24)-30*60)[0])
-        IDs = smaller + greater
-        
-        if len(IDs) > 0:
-            can_be_zero = False    
-            for j in range(len(IDs)):                
-                if matrix2[IDs[j]][0] <= 3:                
-                    can_be_zero = True
-                    temp =  np.sqrt((matrix2[IDs[j]][1]-loc1[0])**2 + (matrix2[IDs[j]][2]-loc1[1])**2)
-                    if temp < center_rad:
-                        same_place[i] = 1
-                
-                if can_be_zero and np.isnan(same_place[i]):
-                    same_place[i] = 0
-        else:
-            for j in range(len(matrix2)):                
-                if not np.isnan(matrix2[j][3]) and not np.isnan(matrix2[j][6]) and matrix2[j][3] < checkpoints2[i] and matrix2[j][6] > checkpoints2[i]:
-                    if matrix2[j][0] !=4 and np.sqrt((matrix2[j][1]-loc1[0])**2 + (matrix2[j][2]-loc1[1])**2) < center_rad:
-                        same_place[i] = 1
-                    else:
-                        same_place[i] = 0
-                    break
-            
-        
-    if np.isnan(same_place).all():
-        return None
-    else:
-        return np.nanmean(same_place)
-
-
-def daily_routine_index(idx, mobmat, subset_inds_v, subset_day_of_week_v, subset_start_time_v, center_rad):    
-    submat = mobmat[subset_inds_v[idx]]
-    daydist_v = np.ones(len(subset_inds_v))
-    daydist_v[:] = np.nan
-
-    for i in range(len(subset_inds_v)):
-        if i == idx:
-            continue
-        
-        daydist_v[i] = day_dist(idx, i, mobmat, subset_inds_v, subset_start_time_v, center_rad)
+# For each checkpoint, whether a flight or pause of matrix covers it and the (x, y) where that row starts
+def locations_at(matrix, checkpoints):
+    covers = (matrix[:, 0, np.newaxis] <= 2) & (matrix[:, 3, np.newaxis] <= checkpoints) & (matrix[:, 6, np.newaxis] >= checkpoints)
+    first_row = np.argmax(covers, axis=0)
+    return covers.any(axis=0), matrix[first_row, 1], matrix[first_row, 2]
+
+# Matrix of the fraction of checkpoints at which day i1 and day i2 are at the same place (within center_rad), NaN when
+# they can not be compared. A checkpoint of i1 is compared with the rows of i2 that start within 30 minutes of the same
+# time of day or, when there are none, with the row of i2 that covers the checkpoint of i2.
+def day_dist_matrix(mobmat, subset_inds_v, subset_start_time_v, center_rad):
+    n_days = len(subset_inds_v)
+    day_matrices = [mobmat[subset_inds_v[day]] for day in range(n_days)]
+    checkpoints = np.array([subset_start_time_v[day] for day in range(n_days)], dtype=np.float64)[:, np.newaxis] + ROUTINE_CHECKPOINTS
+
+    located = np.zeros(checkpoints.shape, dtype=bool)
+    location_x, location_y = np.full(checkpoints.shape, np.nan), np.full(checkpoints.shape, np.nan)
+    covered = np.zeros(checkpoints.shape, dtype=bool)
+    covering_code, covering_x, covering_y = np.zeros(checkpoints.shape), np.full(checkpoints.shape, np.nan), np.full(checkpoints.shape, np.nan)
+    for day, matrix in enumerate(day_matrices):
+        located[day], location_x[day], location_y[day] = locations_at(matrix, checkpoints[day])
+        covers = (matrix[:, 3, np.newaxis] < checkpoints[day]) & (matrix[:, 6, np.newaxis] > checkpoints[day])
+        first_row = np.argmax(covers, axis=0)
+        covered[day] = covers.any(axis=0)
+        covering_code[day], covering_x[day], covering_y[day] = matrix[first_row, 0], matrix[first_row, 1], matrix[first_row, 2]
+
+    # rows of all days stacked, each day is a segment that starts at day_starts
+    rows = np.concatenate(day_matrices)
+    day_starts = np.cumsum([0] + [len(matrix) for matrix in day_matrices[:-1]])
+    can_be_zero_rows = rows[:, 0, np.newaxis] <= 3
+
+    same_place = np.full((n_days, n_days, len(ROUTINE_CHECKPOINTS)), np.nan)
+    for day1 in range(n_days):
+        time_diff = np.abs(rows[:, 3, np.newaxis] - checkpoints[day1]) % (60*60*24)
+        starts_near = (time_diff < 30*60) | (time_diff > (60*60*24)-30*60)
+        close_rows = euclidean(rows[:, 1, np.newaxis], rows[:, 2, np.newaxis], location_x[day1], location_y[day1]) < center_rad
+        any_near = np.logical_or.reduceat(starts_near, day_starts, axis=0)
+        any_can_be_zero = np.logical_or.reduceat(starts_near & can_be_zero_rows, day_starts, axis=0)
+        any_close = np.logical_or.reduceat(starts_near & can_be_zero_rows & close_rows, day_starts, axis=0)
+        covering_close = (covering_code != 4) & (euclidean(covering_x, covering_y, location_x[day1], location_y[day1]) < center_rad)
+
+        near_place = np.where(any_close, 1.0, np.where(any_can_be_zero, 0.0, np.nan))
+        covering_place = np.where(covered, covering_close.astype(np.float64), np.nan)
+        same_place[day1] = np.where(any_near, near_place, covering_place)
+        same_place[day1][:, ~located[day1]] = np.nan
+
+    # mean over the checkpoints that could be compared
+    compared = ~np.isnan(same_place)
+    with np.errstate(invalid="ignore"):
+        day_dists = np.nansum(same_place, axis=2) / np.sum(compared, axis=2)
+    np.fill_diagonal(day_dists, np.nan)
+    return day_dists
+
+
+def daily_routine_index(idx, day_dists, subset_day_of_week_v):    
+    daydist_v = day_dists[idx]
 
     if len(np.where(daydist_v != -1)[0]) == 0:
         circ_score = None
@@ -1355,9 +1480,8 @@ def daily_routine_index(idx, mobmat, subset_inds_v, subset_day_of_week_v, subset
 
 
 def get_mobility_features(mobmat, obj, mobmatmiss, timezone, center_rad, interval):
-    print("Get mobility features...")    
-    mobmat = np.array(mobmat)
-    mobmatmiss = np.array(mobmatmiss)
+    mobmat = np.asarray(mobmat, dtype=np.float64)
+    mobmatmiss = np.asarray(mobmatmiss, dtype=np.float64)
     slout = sig_locs(mobmat, obj, center_rad, timezone=timezone) #x, y, timepresent, home
     IDhome = np.where(slout[:,3] ==1)[0]
     if len(IDhome) == 0:
@@ -1365,135 +1489,38 @@ def get_mobility_features(mobmat, obj, mobmatmiss, timezone, center_rad, interva
     homex = slout[IDhome,0]
     homey = slout[IDhome,1]
 
-    if timezone != "":
-        date = datetime.datetime.fromtimestamp(mobmat[0][3], tz=tz.gettz(timezone))
-    else:
-        date = datetime.datetime.fromtimestamp(mobmat[0][3])
-    current_year = date.year
-    current_month = date.month
-    current_day = date.day
-    current_hour = date.hour
-    current_minute = date.minute
-    current_second = date.second
-
     weekday_mapping = {0: "Monday", 1: "Tuesday", 2: "Wednesday", 3: "Thursday", 4: "Friday", 5: "Saturday", 6: "Sunday"}
 
-    subset_inds_v = {}
-    subset_day_of_week_v = []
-    subset_start_time_v = []
-    cur_date = (current_year, current_month, current_day)
-    daystr_v = [cur_date]
-    day_ind=0
-    subset_inds = [0]
     if(len(mobmat)<2):
         outmat = None
         return outmat, slout
-    else:
-        for i in range(1, len(mobmat)):
-            next_date_raw = datetime.datetime.fromtimestamp(mobmat[i][3])
-            next_date = (next_date_raw.year, next_date_raw.month, next_date_raw.day)
-
-            if next_date == cur_date and i < len(mobmat)-1:
-                if str(mobmat[i][6]) != "nan":
-                    end_date_raw = datetime.datetime.fromtimestamp(mobmat[i][6])
-                    end_date = (end_date_raw.year, end_date_raw.month, end_date_raw.day)
 
-                subset_inds.append(i)
-            else:
-                subset_inds_v[day_ind] = subset_inds
-                cur_weekday = weekday_mapping[date.weekday()]
-                subset_day_of_week_v.append(cur_weekday)
-                to_timestamp = datetime.datetime.strptime("{}-{}-{}".format(cur_date[0], cur_date[1], cur_date[2]), "%Y-%m-%d").timestamp()
-                subset_start_time_v.append(to_timestamp) 
-                
-                day_ind += 1
-                if mobmat[i-1][0] == 2 and (mobmat[i-1][6]-mobmat[i-1][3])/(60*60*24)>1:
-                    ii = 1
-                    temp_mid = mobmat[i-1][3]+(60*60*24)*ii
-                    mid_date_raw = datetime.datetime.fromtimestamp(temp_mid)
-                    mid_date = (mid_date_raw.year, mid_date_raw.month, mid_date_raw.day)
-                    while mid_date != next_date:
-                        subset_day_of_week_v.append(weekday_mapping[mid_date_raw.weekday()])
-                        middate_numeric = datetime.datetime.strptime("{}-{}-{}".format(mid_date[0], mid_date[1], mid_date[2]), "%Y-%m-%d").timestamp()
-                        subset_start_time_v.append(middate_numeric)
-                        subset_inds_v[day_ind] = [i-1]
-                        day_ind += 1
-                        if mid_date != daystr_v[-1]:
-                            daystr_v.append(mid_date)
-                        ii += 1
-                        temp_mid = mobmat[i-1][3]+(60*60*24)*ii
-                        mid_date_raw = datetime.datetime.fromtimestamp(temp_mid)
-                        mid_date = (mid_date_raw.year, mid_date_raw.month, mid_date_raw.day)
-
-                cur_date = next_date
-                date = next_date_raw
-                subset_inds = [i-1, i] 
-                if cur_date != daystr_v[-1] and not (len(daystr_v) == len(subset_inds_v) and len(mobmat) == i+1):
-                    daystr_v.append(cur_date)
-    
-    #### Partition mobmatmiss data into daily subsets: create subsetinds_v and daystr_v.
-    cur_date_raw = datetime.datetime.fromtimestamp(mobmatmiss[0][3])
-    cur_date_miss = (cur_date_raw.year, cur_date_raw.month, cur_date_raw.day)
-    cur_time_miss = (cur_date_raw.hour, cur_date_raw.month, cur_date_raw.second)
-
-    miss_subset_inds_v = {}
-    miss_daystr_v = [cur_date_miss]
-    miss_dayind = 0
-    subset_inds = [0]
-    for i in range(1, len(mobmatmiss)):
-        next_date_raw = datetime.datetime.fromtimestamp(mobmatmiss[i][3])
-        next_date_miss = (next_date_raw.year, next_date_raw.month, next_date_raw.day)
-
-        if next_date_miss == cur_date_miss and i < len(mobmatmiss)-1:
-            subset_inds.append(i)
-        else:
-            cur_date_miss = next_date_miss
-            miss_subset_inds_v[miss_dayind] = subset_inds
-            if cur_date_miss !=    miss_daystr_v[-1] and not (len(miss_daystr_v) == len(miss_subset_inds_v) and i == len(mobmatmiss)-1):
-                miss_daystr_v.append(cur_date_miss)
-            subset_inds = [i]
-            miss_dayind += 1
-            if mobmatmiss[i-1][0] == 2 and (mobmatmiss[i-1][6]-mobmatmiss[i-1][3])/(60*60*24)>1:
-                ii = 1
-                temp_mid = mobmatmiss[i-1][3]+(60*60*24)*ii
-                mid_date_raw = datetime.datetime.fromtimestamp(temp_mid)
-                mid_date = (mid_date_raw.year, mid_date_raw.month, mid_date_raw.day)
-                while mid_date != next_date_miss:
-                    miss_subset_inds_v[miss_dayind] = i-1
-                    miss_dayind += 1
-                    if mid_date != miss_daystr_v[-1]:
-                        miss_daystr_v.append(mid_date)
-                    ii += 1
-                    temp_mid = mobmatmiss[i-1][3]+(60*60*24)*ii
-                    mid_date_raw = datetime.datetime.fromtimestamp(temp_mid)
-                    mid_date = (mid_date_raw.year, mid_date_raw.month, mid_date_raw.day)
+    #### Partition mobmat and mobmatmiss into local days on the same midnights
+    day_starts, days = local_day_starts(min(np.nanmin(mobmat[:,3]), np.nanmin(mobmatmiss[:,3])), max(np.nanmax(mobmat[:,3]), np.nanmax(mobmatmiss[:,3])), timezone)
+    subset_inds_v, subset_days = daily_row_slices(mobmat, day_starts, overlap=True)
+    miss_subset_inds_v, miss_days = daily_row_slices(mobmatmiss, day_starts, overlap=False)
 
     ##### intersect mobmat and mobmatmiss to ignore missing data
-    IDkeep = []
-    IDkeepmiss = []
-    for i in range(len(daystr_v)):
-        for j in range(len(miss_daystr_v)):
-            if daystr_v[i] == miss_daystr_v[j]:
-                IDkeep.append(i)
-                IDkeepmiss.append(j)
-                break
-
+    IDkeep = np.flatnonzero(np.isin(subset_days, miss_days))
     if len(IDkeep) == 0:
         outmat = None
         return outmat, slout
 
-    daystr_v = np.array(daystr_v)[IDkeep]
-    subset_day_of_week_v = np.array(subset_day_of_week_v)[IDkeep]
-    subset_start_time_v = np.array(subset_start_time_v)[IDkeep]
-    miss_daystr_v = np.array(miss_daystr_v)[IDkeep]
+    # the first day of mobmatmiss with the same date as each kept day of mobmat
+    unique_miss_days, first_miss_days = np.unique(miss_days, return_index=True)
+    IDkeepmiss = first_miss_days[np.searchsorted(unique_miss_days, subset_days[IDkeep])]
+    subset_inds_v = [subset_inds_v[i] for i in IDkeep]
+    miss_subset_inds_v = [miss_subset_inds_v[j] for j in IDkeepmiss]
+    daystr_v = np.array([(days[day].year, days[day].month, days[day].day) for day in subset_days[IDkeep]])
+    subset_day_of_week_v = np.array([weekday_mapping[days[day].weekday()] for day in subset_days[IDkeep]])
+    subset_start_time_v = day_starts[subset_days[IDkeep]]
 
     num_of_features = 15
     outmat = np.zeros((len(daystr_v), num_of_features))
-    submat = [] 
-    temp_last = mobmat[subset_inds_v[IDkeep[len(daystr_v)-1]]]
+    day_dists = None
 
     for i in range(len(daystr_v)):
-        submat = mobmat[subset_inds_v[IDkeep[i]]]
+        submat = mobmat[subset_inds_v[i]].copy()
 
         if submat[0][0] == 2 and submat[0][3] < subset_start_time_v[i]:
             submat[0][3] = subset_start_time_v[i]
@@ -1501,7 +1528,7 @@ def get_mobility_features(mobmat, obj, mobmatmiss, timezone, center_rad, interva
         if submat[-1][0] == 2 and submat[-1][6] > subset_start_time_v[i]+60*60*24:
             submat[-1][6] = subset_start_time_v[i]+60*60*24
 
-        submat_miss = mobmatmiss[miss_subset_inds_v[IDkeep[i]]]
+        submat_miss = mobmatmiss[miss_subset_inds_v[i]].copy()
         if submat_miss[0][0] == 4 and submat_miss[0][3] < subset_start_time_v[i]:
             submat_miss[0][3] = subset_start_time_v[i]
 
@@ -1525,9 +1552,141 @@ def get_mobility_features(mobmat, obj, mobmatmiss, timezone, center_rad, interva
             outmat[i][10] = prob_pause(submat)
             outmat[i][11] = sig_loc_entropy(submat, slout, center_rad)
             outmat[i][12] = mins_missing(submat_miss)
-            dri_output = daily_routine_index(i, mobmat, subset_inds_v, subset_day_of_week_v, subset_start_time_v, center_rad)
+            if day_dists is None:
+                day_dists = day_dist_matrix(mobmat, subset_inds_v, subset_start_time_v, center_rad)
+            dri_output = daily_routine_index(i, day_dists, subset_day_of_week_v)
             outmat[i][13] = dri_output[0] #seven days equally circadian routine
             outmat[i][14] = dri_output[1] #separately
 
 
     return outmat, slout, daystr_v #daystr_v = row names
+
+
+# Rows of a time ordered trace (its rows do not overlap) that overlap [start, end). row_ends are the end times of the rows
+# (the start time for undefined rows). Rows with clip_code are clipped to [start, end) like get_mobility_features does
+# with the pauses and missing intervals at the edges of a day
+def slice_trace(matrix, row_ends, start, end, clip_code):
+    first = np.searchsorted(row_ends, start, side="right")
+    last = max(first, np.searchsorted(matrix[:, 3], end, side="left"))
+    submat = matrix[first:last].copy()
+    clipped = submat[:, 0] == clip_code
+    submat[clipped, 3] = np.maximum(submat[clipped, 3], start)
+    submat[clipped, 6] = np.minimum(submat[clipped, 6], end)
+    return submat
+
+# Start timestamps of the local days from the day of first_timestamp to the day of last_timestamp plus the start of the
+# following day, and the dates of those days
+def local_day_starts(first_timestamp, last_timestamp, timezone):
+    tzinfo = tz.gettz(timezone) if timezone != "" else None
+    first_day = datetime.datetime.fromtimestamp(first_timestamp, tz=tzinfo).date()
+    last_day = datetime.datetime.fromtimestamp(last_timestamp, tz=tzinfo).date()
+    days = [first_day + datetime.timedelta(days=i) for i in range((last_day - first_day).days + 2)]
+    day_starts = np.array([datetime.datetime.combine(day, datetime.time(), tzinfo=tzinfo).timestamp() for day in days])
+    return day_starts, days[:-1]
+
+# Rows of each local day of a time ordered trace for get_mobility_features, as slices, and the index in day_starts of each
+# day. A day starts at the first row that starts on it (overlap also includes the previous row, that crosses midnight)
+# and the last row of the trace belongs to no day. A pause longer than a day that ends a day is also, on its own, each of
+# the days it covers until the day of the next row
+def daily_row_slices(matrix, day_starts, overlap):
+    n_rows = len(matrix)
+    if n_rows < 2:
+        return [], np.zeros(0, dtype=np.int64)
+    day_of_row = np.searchsorted(day_starts, matrix[:,3], side="right") - 1
+    starts = np.concatenate(([0], np.flatnonzero(day_of_row[1:n_rows-1] != day_of_row[:n_rows-2]) + 1))
+    stops = np.append(starts[1:], n_rows-1)
+
+    last_rows = stops - 1
+    long_pause = (matrix[last_rows,0] == 2) & ((matrix[last_rows,6]-matrix[last_rows,3])/(60*60*24) > 1)
+    days_per_start = 1 + np.where(long_pause, np.maximum(day_of_row[stops] - day_of_row[last_rows] - 1, 0), 0)
+
+    # offset 0 is the day that starts at starts[k], offsets 1 and up the days covered by its last row
+    start_ids = np.repeat(np.arange(len(starts)), days_per_start)
+    offsets = np.arange(len(start_ids)) - np.repeat(np.cumsum(days_per_start) - days_per_start, days_per_start)
+    firsts = np.where(offsets == 0, np.maximum(starts[start_ids] - int(overlap), 0), last_rows[start_ids])
+    slices = [slice(first, stop) for first, stop in zip(firsts, stops[start_ids])]
+    return slices, day_of_row[starts[start_ids]] + offsets
+
+# Circadian and weekday/weekend routine index (see daily_routine_index) of each local day, NaN for the days without rows
+def daily_routine_scores(out3, row_ends, day_starts, day_names, center_rad):
+    subset_inds_v, subset_start_time_v, subset_day_of_week_v, days_with_rows = {}, [], [], []
+    for day in range(len(day_names)):
+        first = np.searchsorted(row_ends, day_starts[day], side="right")
+        last = np.searchsorted(out3[:, 3], day_starts[day + 1], side="left")
+        if last > first:
+            subset_inds_v[len(days_with_rows)] = slice(first, last)
+            subset_start_time_v.append(day_starts[day])
+            subset_day_of_week_v.append(day_names[day])
+            days_with_rows.append(day)
+
+    routine_scores = np.full((len(day_names), 2), np.nan)
+    if len(days_with_rows) > 0:
+        day_dists = day_dist_matrix(out3, subset_inds_v, subset_start_time_v, center_rad)
+        for idx, day in enumerate(days_with_rows):
+            routine_scores[day] = daily_routine_index(idx, day_dists, np.array(subset_day_of_week_v))
+    return routine_scores
+
+# Barnett features of time segment instances computed from the traces returned by impute_mobility_traces.
+# segments has one row per instance with its local_segment label and its start_timestamp and end_timestamp in seconds.
+# The significant locations and the daily routine of each repetition are computed from its whole trace, the other
+# features from the rows that overlap each instance. Features are averaged over repetitions like run_mobility_simulations does.
+def segment_mobility_features(trace, segments, timezone, center_rad=200, interval=10):
+    repetitions = np.sort(trace.loc[trace["repetition"] >= 0, "repetition"].unique())
+    if len(repetitions) == 0 or len(segments) == 0:
+        return pd.DataFrame(columns=["local_segment"] + FEATURE_NAMES)
+
+    missing = trace.loc[trace["repetition"] == -1, TRACE_COLUMNS].to_numpy(dtype=np.float64)
+    segment_starts = segments["start_timestamp"].to_numpy(dtype=np.float64)
+    segment_ends = segments["end_timestamp"].to_numpy(dtype=np.float64)
+    features = np.full((len(repetitions), len(segments), len(FEATURE_NAMES)), np.nan)
+    features[:, :, FEATURE_NAMES.index("minsmissing")] = (segment_ends - segment_starts)/60
+    # segments each repetition has trace rows (and a home) for, the other repetitions are left out of their mean
+    covered = np.zeros((len(repetitions), len(segments)), dtype=bool)
+
+    for rep_idx, repetition in enumerate(repetitions):
+        out3 = trace.loc[trace["repetition"] == repetition, TRACE_COLUMNS].to_numpy(dtype=np.float64)
+        row_ends = np.fmax(out3[:, 6], out3[:, 3])
+        slout = sig_locs(out3, initialize_params(out3), center_rad, timezone=timezone) #x, y, timepresent, home
+        if slout is None or len(np.where(slout[:,3] == 1)[0]) == 0:
+            continue
+        IDhome = np.where(slout[:,3] == 1)[0]
+        homex = slout[IDhome,0]
+        homey = slout[IDhome,1]
+        day_starts, days = local_day_starts(out3[0][3], np.max(row_ends), timezone)
+        day_names = [day.strftime("%A") for day in days]
+        routine_scores = daily_routine_scores(out3, row_ends, day_starts, day_names, center_rad)
+
+        for i in range(len(segments)):
+            submat = slice_trace(out3, row_ends, segment_starts[i], segment_ends[i], clip_code=2)
+            if len(submat) == 0:
+                continue
+            submat_miss = slice_trace(missing, missing[:, 6], segment_starts[i], segment_ends[i], clip_code=4)
+            segment_days = (day_starts[:-1] < segment_ends[i]) & (day_starts[1:] > segment_starts[i])
+            with warnings.catch_warnings():
+                # segments whose days have no routine score
+                warnings.simplefilter("ignore", category=RuntimeWarning)
+                circadian_routine, week_routine = np.nanmean(routine_scores[segment_days], axis=0)
+
+            covered[rep_idx, i] = True
+            features[rep_idx, i] = [home_time(submat, slout, center_rad),
+                                    distance_traveled(submat),
+                                    radius_of_gyration(submat, interval),
+                                    max_diameter(submat),
+                                    max_home_distance(submat, homex, homey),
+                                    sig_locs_visited(submat, slout, center_rad),
+                                    avg_flight(submat, "length"),
+                                    std_flight(submat, "length"),
+                                    avg_flight(submat, "duration"),
+                                    std_flight(submat, "duration"),
+                                    prob_pause(submat),
+                                    sig_loc_entropy(submat, slout, center_rad),
+                                    mins_missing(submat_miss),
+                                    circadian_routine,
+                                    week_routine]
+
+    mean_features = features[0].copy()
+    covered_segments = covered.any(axis=0)
+    mean_features[covered_segments] = (np.sum(features, axis=0, where=covered[:, :, np.newaxis]) / np.maximum(covered.sum(axis=0), 1)[:, np.newaxis])[covered_segments]
+    segment_features = pd.DataFrame(mean_features, columns=FEATURE_NAMES)
+    segment_features.insert(0, "local_segment", segments["local_segment"].to_numpy())
+    return segment_features
@@ -1,4 +1,5 @@
 from barnett_library import *
+import os
 from statistics import mode
 import warnings
 
@@ -23,7 +24,9 @@ def barnett_daily_features(snakemake):
             timezone = mode(location_data["local_timezone"].values)
             location_df = location_data[["timestamp", "double_latitude", "double_longitude", "double_altitude", "accuracy"]]
             location_df.rename(columns={"double_latitude": "latitude", "double_longitude": "longitude", "double_altitude": "altitude"})
-            output_mobility = run_barnett_features_for_rapids(location_df, accuracy_limit=accuracy_limit, timezone=timezone) #make local_date as the index for the output_mobility dataframe
+            # stage timings and row counts are written next to the features
+            report_file = os.path.splitext(snakemake.output[0])[0] + ".json"
+            output_mobility = run_barnett_features_for_rapids(location_df, accuracy_limit=accuracy_limit, timezone=timezone, report_file=report_file) #make local_date as the index for the output_mobility dataframe
             location_features = output_mobility.merge(location_minutes_used, on="local_date", how="left")
 
     location_features.reset_index(inplace=True)
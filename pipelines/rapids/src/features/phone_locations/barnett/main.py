@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from statistics import mode
+from phone_locations.barnett.barnett_library import FEATURE_NAMES, segment_mobility_features
+
+
+# Barnett's features of any time segment, computed from the mobility trace imputed once per participant by mobility_trace.py
+def barnett_features(sensor_data_files, time_segment, provider, filter_data_by_segment, *args, **kwargs):
+
+    location_data = pd.read_csv(sensor_data_files["sensor_data"])
+    requested_features = provider["FEATURES"]
+    minutes_data_used = provider["MINUTES_DATA_USED"]
+
+    # the subset of requested features this function can compute
+    features_to_compute = [feature for feature in FEATURE_NAMES if feature in requested_features]
+    if minutes_data_used:
+        features_to_compute.append("minutes_data_used")
+
+    location_data = filter_data_by_segment(location_data, time_segment)
+    if location_data.empty:
+        return pd.DataFrame(columns=["local_segment"] + features_to_compute)
+
+    # segment instances with location data and their start and end timestamps in seconds
+    segments = location_data.drop_duplicates(subset=["local_segment"])[["local_segment", "timestamps_segment"]].reset_index(drop=True)
+    segments[["start_timestamp", "end_timestamp"]] = segments["timestamps_segment"].str.split(",", expand=True).astype(np.int64) / 1000
+
+    # Barnett's algorithm can only handle one time zone (IF_MULTIPLE_TIMEZONES: USE_MOST_COMMON)
+    timezone = mode(location_data["local_timezone"].values)
+    trace = pd.read_parquet(sensor_data_files["barnett_trace"])
+    location_features = segment_mobility_features(trace, segments, timezone)
+
+    if minutes_data_used:
+        minutes = location_data.groupby(["local_segment", "local_date", "local_hour"])["local_minute"].nunique().groupby("local_segment").sum().rename("minutes_data_used")
+        location_features = location_features.merge(minutes, left_on="local_segment", right_index=True, how="left")
+
+    return location_features[["local_segment"] + features_to_compute]
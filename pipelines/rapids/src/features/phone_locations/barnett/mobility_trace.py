@@ -0,0 +1,22 @@
+from barnett_library import *
+import os
+import warnings
+
+# Impute the mobility trace of a participant once, main.py computes Barnett's features of every time segment from it
+def barnett_mobility_trace(snakemake):
+    accuracy_limit = 999999999 # We filter rows based on accuracy in src/data/process_location_types.R script
+    location_data = pd.read_csv(snakemake.input["sensor_data"], usecols=["timestamp", "double_latitude", "double_longitude", "double_altitude", "accuracy"])
+
+    if len(location_data) == 0:
+        warnings.warn("Barnett's mobility trace cannot be imputed because the input data is empty.")
+        trace = trace_to_dataframe(np.empty((0, len(TRACE_COLUMNS))), -1)
+    else:
+        location_df = location_data[["timestamp", "double_latitude", "double_longitude", "double_altitude", "accuracy"]]
+        # stage timings and row counts (and a cProfile dump when PROFILE is True) are written next to the trace
+        output_prefix = os.path.splitext(snakemake.output[0])[0]
+        profile_file = output_prefix + ".prof" if snakemake.params["provider"].get("PROFILE", False) else None
+        trace = impute_mobility_traces(location_df, accuracy_limit=accuracy_limit, report_file=output_prefix + ".json", profile_file=profile_file)
+
+    trace.to_parquet(snakemake.output[0], index=False)
+
+barnett_mobility_trace(snakemake)
@@ -0,0 +1,95 @@
+import numpy as np
+
+# numba is optional, when it is installed the haversine kernel of 1-D inputs is compiled to a parallel loop
+try:
+    import numba
+except ImportError:
+    numba = None
+
+USE_NUMBA = numba is not None
+
+# Radius of earth in kilometers. Use 3956 for miles
+EARTH_RADIUS = 6371
+
+# Distance kernels shared by the location providers. All of them work on float64 NumPy arrays and follow NumPy
+# broadcasting rules, so a fixed point (e.g. a home location) is passed as a scalar and never repeated per row.
+# haversine() and equirectangular() take decimal degrees and return meters; euclidean() takes projected
+# coordinates (e.g. Barnett's x/y in meters) and returns distances in the same unit.
+
+def _as_float64(*coordinates):
+    return [np.asarray(coordinate, dtype=np.float64) for coordinate in coordinates]
+
+def _haversine_numpy(lon1, lat1, lon2, lat2):
+    # Convert decimal degrees to radians
+    lon1, lat1, lon2, lat2 = np.radians(lon1), np.radians(lat1), np.radians(lon2), np.radians(lat2)
+    # Haversine formula, intermediate results are written in place into the output buffer
+    distance = np.empty(np.broadcast(lon1, lat1, lon2, lat2).shape)
+    delta_lon = np.empty_like(distance)
+    np.subtract(lat2, lat1, out=distance)
+    np.divide(distance, 2.0, out=distance)
+    np.sin(distance, out=distance)
+    np.square(distance, out=distance)
+    np.subtract(lon2, lon1, out=delta_lon)
+    np.divide(delta_lon, 2.0, out=delta_lon)
+    np.sin(delta_lon, out=delta_lon)
+    np.square(delta_lon, out=delta_lon)
+    np.multiply(delta_lon, np.cos(lat1) * np.cos(lat2), out=delta_lon)
+    np.add(distance, delta_lon, out=distance)
+    np.sqrt(distance, out=distance)
+    np.arcsin(distance, out=distance)
+    np.multiply(distance, EARTH_RADIUS * 2, out=distance)
+    np.multiply(distance, 1000, out=distance)
+    return distance
+
+if USE_NUMBA:
+    @numba.njit(parallel=True, cache=True)
+    def _haversine_numba(lon1, lat1, lon2, lat2, distance):
+        to_radians = np.pi / 180
+        for i in numba.prange(distance.shape[0]):
+            phi1 = lat1[i] * to_radians
+            phi2 = lat2[i] * to_radians
+            a = np.sin((phi2 - phi1) / 2.0) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin((lon2[i] * to_radians - lon1[i] * to_radians) / 2.0) ** 2
+            distance[i] = EARTH_RADIUS * 2 * np.arcsin(np.sqrt(a)) * 1000
+        return distance
+
+# Calculate the great-circle distance (in meters) between two points on the earth (specified in decimal degrees)
+def haversine(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = _as_float64(lon1, lat1, lon2, lat2)
+    shape = np.broadcast(lon1, lat1, lon2, lat2).shape
+    if USE_NUMBA and len(shape) == 1:
+        # broadcast_to returns read-only strided views, scalars are not materialized into arrays
+        lon1, lat1, lon2, lat2 = [np.broadcast_to(coordinate, shape) for coordinate in (lon1, lat1, lon2, lat2)]
+        return _haversine_numba(lon1, lat1, lon2, lat2, np.empty(shape))
+    return _haversine_numpy(lon1, lat1, lon2, lat2)
+
+# Equirectangular approximation of the distance (in meters) between two points (specified in decimal degrees)
+# Faster than haversine and accurate for the short distances between consecutive location samples
+def equirectangular(lon1, lat1, lon2, lat2):
+    lon1, lat1, lon2, lat2 = _as_float64(lon1, lat1, lon2, lat2)
+    x = np.radians(lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2.0))
+    y = np.radians(lat2 - lat1)
+    return np.hypot(x, y) * (EARTH_RADIUS * 1000)
+
+# Distance (in meters) between each point and the next one. The last point has no next point, so its distance is NaN.
+# Equivalent to haversine(lon, lat, lon.shift(-1), lat.shift(-1)) without building the shifted copies
+def consecutive_distances(lon, lat, method=haversine):
+    lon, lat = _as_float64(lon, lat)
+    distance = np.full(lon.shape[0], np.nan)
+    if lon.shape[0] > 1:
+        distance[:-1] = method(lon[:-1], lat[:-1], lon[1:], lat[1:])
+    return distance
+
+# Distances (in meters) between every point and every centroid (specified in decimal degrees) as a points x centroids matrix
+def haversine_to_centroids(lon, lat, centroids_lon, centroids_lat):
+    lon, lat, centroids_lon, centroids_lat = _as_float64(lon, lat, centroids_lon, centroids_lat)
+    return _haversine_numpy(lon[:, np.newaxis], lat[:, np.newaxis], centroids_lon[np.newaxis, :], centroids_lat[np.newaxis, :])
+
+# Euclidean distance between points in a projected (x, y) plane
+def euclidean(x1, y1, x2, y2):
+    x1, y1, x2, y2 = _as_float64(x1, y1, x2, y2)
+    return np.sqrt(np.square(x1 - x2) + np.square(y1 - y2))
+
+# Euclidean distances between every point and every centroid in a projected (x, y) plane as a points x centroids matrix
+def euclidean_to_centroids(x, y, centroids_x, centroids_y):
+    x, y, centroids_x, centroids_y = _as_float64(x, y, centroids_x, centroids_y)
+    return euclidean(x[:, np.newaxis], y[:, np.newaxis], centroids_x[np.newaxis, :], centroids_y[np.newaxis, :])
@@ -1,16 +1,25 @@
 import warnings
 import numpy as np
 import pandas as pd
-from doryab_clustering import haversine, create_clustering_hyperparameters, cluster
+from doryab_clustering import create_clustering_hyperparameters, cluster
+from phone_locations.distances import haversine, consecutive_distances
 
+# Number of rows read from the location file at a time
+CHUNK_SIZE = 100000
+# Columns read in the first pass, enough to mark stationary records and summarize them
+SUMMARY_INPUT_COLUMNS = ["timestamp", "local_date", "local_time", "local_hour", "double_latitude", "double_longitude"]
+COORDINATE_COLUMNS = ["double_latitude", "double_longitude"]
 
+# Raised by read_location_days when a file it streams turns out not to be sorted by timestamp
+class UnsortedLocationData(Exception):
+    pass
 
 # Add "is_stationary" column to denote whether it is stationary or not
 # "distance" and "speed" columns are also added
 def mark_as_stationary(location_data, threshold_static):
 
     # Distance in meters
-    location_data = location_data.assign(distance=haversine(location_data["double_longitude"], location_data["double_latitude"], location_data["double_longitude"].shift(-1), location_data["double_latitude"].shift(-1)))
+    location_data = location_data.assign(distance=consecutive_distances(location_data["double_longitude"], location_data["double_latitude"]))
     # Speed in km/h
     location_data.loc[:, "speed"] = (location_data["distance"] / location_data["duration_in_seconds"]).replace(np.inf, np.nan) * 3.6
 
@@ -19,91 +28,171 @@ def mark_as_stationary(location_data, threshold_static):
     location_data.dropna(subset=["duration_in_seconds"], inplace=True)
     return location_data
 
-def infer_home_location(location_data, clustering_algorithm, hyperparameters, strategy, days_threshold):
+# Add "duration_in_seconds", "distance", "speed" and "is_stationary" columns to each block of local dates
+# Durations and distances depend on the next row, so the last row of each block is carried over to the next block.
+# That row has no next row yet, its duration is NaN and mark_as_stationary drops it.
+def preprocess_days(location_days, maximum_row_gap, threshold_static):
+    carried_row = None
+    for location_data in location_days:
+        if carried_row is not None:
+            location_data = pd.concat([carried_row, location_data])
+        carried_row = location_data.iloc[[-1]]
+
+        location_data = location_data.assign(duration_in_seconds=-1 * location_data.timestamp.diff(-1) / 1000)
+        location_data.loc[location_data["duration_in_seconds"] >= maximum_row_gap, "duration_in_seconds"] = np.nan
+
+        yield mark_as_stationary(location_data, threshold_static)
+
+# Yield the location data in blocks of whole local dates, so memory usage is bounded by CHUNK_SIZE rows (or a single
+# day if it has more rows than that) instead of growing with the length of the study.
+# Files sorted by timestamp are streamed and UnsortedLocationData is raised as soon as a timestamp goes back in time,
+# any other file is loaded and sorted first.
+def read_location_days(sensor_input, is_sorted, usecols=None):
+    if is_sorted:
+        chunks = pd.read_csv(sensor_input, chunksize=CHUNK_SIZE, usecols=usecols)
+    else:
+        location_data = pd.read_csv(sensor_input, usecols=usecols)
+        location_data.sort_values(by=["timestamp"], inplace=True)
+        chunks = [location_data]
+
+    pending_rows = None
+    last_timestamp = -np.inf
+    for chunk in chunks:
+        if is_sorted and not chunk.empty:
+            if chunk["timestamp"].iloc[0] < last_timestamp or not chunk["timestamp"].is_monotonic_increasing:
+                raise UnsortedLocationData()
+            last_timestamp = chunk["timestamp"].iloc[-1]
+        if pending_rows is not None:
+            chunk = pd.concat([pending_rows, chunk])
+        if chunk.empty:
+            continue
+        # The last local date of a chunk might continue in the next chunk
+        last_day_start = np.flatnonzero((chunk["local_date"] != chunk["local_date"].shift()).values)[-1]
+        if last_day_start > 0:
+            yield chunk.iloc[:last_day_start]
+        pending_rows = chunk.iloc[last_day_start:]
+
+    if pending_rows is not None and not pending_rows.empty:
+        yield pending_rows
+
+# Summarize the records of a block of days by coordinates, the only state kept in memory between blocks:
+# - coordinates: the duration (in minutes) of the records of each coordinate and is_stationary value, what cluster()
+#   needs to cluster them. Only kept for CLUSTER_ON: PARTICIPANT_DATASET
+# - nights: the records logged during midnight to 6am of each local date, SUN_LI_VEGA_STRATEGY group and coordinates,
+#   with their number, duration and the positions of their first and last record in the location data
+# first_position is the position of the first record of the block
+def summarize_location_days(location_data, first_position, keep_coordinates):
+    location_data = location_data.assign(duration=location_data["duration_in_seconds"] / 60, position=np.arange(first_position, first_position + len(location_data)))
+    night_data = location_data[location_data["local_hour"] < 6]
+
+    # Split location data into 3 groups: [midnight, 03:30:00), [03:30:00, 04:30:00], (04:30:00, 06:00:00]
+    seconds_since_midnight = pd.to_timedelta(night_data["local_time"]).dt.total_seconds().values
+    night_data = night_data.assign(group=np.select([(seconds_since_midnight >= 12600) & (seconds_since_midnight <= 16200), seconds_since_midnight < 12600], [1, 2], 3))
+    nights = night_data.groupby(["local_date", "group"] + COORDINATE_COLUMNS + ["is_stationary"], sort=False).agg(
+        records=("position", "size"), first_position=("position", "min"), last_position=("position", "max"), duration=("duration", "sum")).reset_index()
+
+    coordinates = location_data.groupby(COORDINATE_COLUMNS + ["is_stationary"], sort=False)[["duration"]].sum().reset_index() if keep_coordinates else None
+    return coordinates, nights
+
+# Cluster label of each coordinate of a summary with the duration of each coordinate and is_stationary value.
+# cluster() deduplicates stationary records by coordinates and weighs them by their duration, and label() ranks clusters
+# by the duration of all their records, so clustering the summary is the same as clustering the records it summarizes
+def cluster_coordinates(coordinates, clustering_algorithm, hyperparameters):
+    coordinates = coordinates.groupby(COORDINATE_COLUMNS + ["is_stationary"], sort=False)[["duration"]].sum().reset_index()
+    coordinates = cluster(coordinates, clustering_algorithm, **hyperparameters)
+    return coordinates.drop_duplicates(COORDINATE_COLUMNS)[COORDINATE_COLUMNS + ["cluster_label"]]
+
+# Mean coordinates of the records summarized by rows with a "records" count, per value of the by column
+def mean_coordinates(summary, by):
+    weighted = summary[COORDINATE_COLUMNS].multiply(summary["records"], axis=0).assign(records=summary["records"], **{by: summary[by]})
+    totals = weighted.groupby(by).sum()
+    return totals[COORDINATE_COLUMNS].divide(totals["records"], axis=0)
+
+# Return one row per local date with the coordinates (home_latitude, home_longitude) and the home_label of its home location
+# nights is the concatenation of the night summaries of summarize_location_days and local_dates are all the dates of the
+# participant in the order they appear in the location data
+def infer_home_location(nights, local_dates, clustering_algorithm, hyperparameters, strategy, days_threshold):
     
     # Home locations are inferred based on records logged during midnight to 6am.
     # The home location is the mean coordinate of the home cluster. 
-    if (strategy == "DORYAB_STRATEGY") or (strategy == "SUN_LI_VEGA_STRATEGY"):
-        
-        location_data_filtered = location_data[location_data["local_hour"] < 6]
+    if nights.empty:
+        warnings.warn("We could not infer a home location because there are no location records logged during midnight to 6am.")
+        return None
     
-        if location_data_filtered.empty:
-            warnings.warn("We could not infer a home location because there are no location records logged during midnight to 6am.")
-            return pd.DataFrame(columns=location_data_filtered.columns.tolist() + ["distance_from_home", "home_label"])
-        
-        location_data_filtered = cluster(location_data_filtered, clustering_algorithm, **hyperparameters)
-
-        if strategy == "DORYAB_STRATEGY":
-
-            # We assume the participant does not change the home location during the whole study.
-            # The most common cluster of all nights are regarded as the home cluster.
-            home_location = location_data_filtered[location_data_filtered["cluster_label"] == 1][["double_latitude", "double_longitude"]].mean()
-            location_data["distance_from_home"] = haversine(location_data["double_longitude"], location_data["double_latitude"], [home_location["double_longitude"]] * location_data.shape[0], [home_location["double_latitude"]] * location_data.shape[0])
-            location_data["home_label"] = 1
-
-        else: # SUN_LI_VEGA_STRATEGY
-            
-            """
-            We assume the participant might change the home location during the whole study.
-
-            Each night will be assigned a candidate home location based on the following rules:
-            if there are records within [03:30:00, 04:30:00]: (group 1)
-                we choose the most common cluster during that period as the candidate of home cluster.
-            elif there are records within [midnight, 03:30:00): (group 2)
-                we choose the last valid cluster during that period as the candidate of home cluster.
-            elif there are records within (04:30:00, 06:00:00]: (group 3)
-                we choose the first valid cluster during that period as the candidate of home cluster.
-            else:
-                the home location is NA (missing) for that night.
-
-            If the count of consecutive days with the same candidate home location cluster label is larger or equal to MINIMUM_DAYS_TO_DETECT_HOME_CHANGES,
-            the candidate will be regarded as the home cluster; 
-            otherwise, the home cluster will be the last valid day's cluster.
-            (If there are no valid clusters before that day, it will be assigned the next valid day's cluster.)
-
-            """
-
-            # Split location data into 3 groups: [midnight, 03:30:00), [03:30:00, 04:30:00], (04:30:00, 06:00:00]
-            location_data_filtered = location_data_filtered[~location_data_filtered["cluster_label"].isin([-1, np.nan])]
-            location_data_filtered["group"] = location_data_filtered["local_time"].apply(lambda x: 1 if x >= "03:30:00" and x <= "04:30:00" else (2 if x < "03:30:00" else 3))
-            
-            # Select the smallest group number per day
-            selected_groups = location_data_filtered[location_data_filtered["group"] == location_data_filtered.groupby("local_date")["group"].transform("min")][["group", "local_date", "cluster_label"]]
-            
-            # For group 1: [03:30:00, 04:30:00]
-            group_1 = selected_groups[selected_groups["group"] == 1]
-            home_clusters_group_1 = group_1.groupby(["local_date"]).agg(lambda x: pd.Series.mode(x)[0])
-            # For group 2: [midnight, 03:30:00)
-            group_2 = selected_groups[selected_groups["group"] == 2]
-            home_clusters_group_2 = group_2.groupby(["local_date"]).last()
-            # For group 3: (04:30:00, 06:00:00]
-            group_3 = selected_groups[selected_groups["group"] == 3]
-            home_clusters_group_3 = group_3.groupby(["local_date"]).first()
-        
-            home_clusters = pd.concat([home_clusters_group_1, home_clusters_group_2, home_clusters_group_3]).sort_index()
-            
-            # Count the consecutive days with the same candidate home location cluster label
-            home_clusters["number_of_days"] = home_clusters.groupby((home_clusters["cluster_label"] != home_clusters["cluster_label"].shift(1)).cumsum())["cluster_label"].transform("count")
-            # Assign the missing days with (1) the last valid day's cluster first and (2) the next valid day's cluster then
-            home_clusters.loc[home_clusters["number_of_days"] < days_threshold, "cluster_label"] = np.nan
-            location_data = location_data.merge(home_clusters[["cluster_label"]], left_on="local_date", right_index=True, how="left")
-            location_data["cluster_label"] = location_data["cluster_label"].fillna(method="ffill").fillna(method="bfill")
-
-            center_per_cluster = location_data_filtered.groupby(["cluster_label"])[["double_latitude", "double_longitude"]].mean().rename(columns={"double_latitude": "home_latitude", "double_longitude": "home_longitude"})
-            location_data = location_data.merge(center_per_cluster, left_on="cluster_label", right_index=True, how="left")
-            location_data["distance_from_home"] = haversine(location_data["double_longitude"], location_data["double_latitude"], location_data["home_longitude"], location_data["home_latitude"])    
-
-            # reorder cluster labels
-            reorder_mapping = {old_label: idx + 1 for idx, old_label in enumerate(location_data["cluster_label"].unique())}
-            location_data["home_label"] = location_data["cluster_label"].map(reorder_mapping)
-
-            location_data.drop(["cluster_label", "home_longitude", "home_latitude"], axis=1, inplace=True)
+    nights = nights.merge(cluster_coordinates(nights, clustering_algorithm, hyperparameters), how="left", on=COORDINATE_COLUMNS)
 
+    if strategy == "DORYAB_STRATEGY":
+
+        # We assume the participant does not change the home location during the whole study.
+        # The most common cluster of all nights are regarded as the home cluster.
+        home_location = mean_coordinates(nights[nights["cluster_label"] == 1].assign(cluster_label=1), "cluster_label").reindex([1]).iloc[0]
+        return pd.DataFrame({"home_latitude": home_location["double_latitude"], "home_longitude": home_location["double_longitude"], "home_label": 1}, index=local_dates)
+
+    # SUN_LI_VEGA_STRATEGY
+    """
+    We assume the participant might change the home location during the whole study.
+
+    Each night will be assigned a candidate home location based on the following rules:
+    if there are records within [03:30:00, 04:30:00]: (group 1)
+        we choose the most common cluster during that period as the candidate of home cluster.
+    elif there are records within [midnight, 03:30:00): (group 2)
+        we choose the last valid cluster during that period as the candidate of home cluster.
+    elif there are records within (04:30:00, 06:00:00]: (group 3)
+        we choose the first valid cluster during that period as the candidate of home cluster.
+    else:
+        the home location is NA (missing) for that night.
+
+    If the count of consecutive days with the same candidate home location cluster label is larger or equal to MINIMUM_DAYS_TO_DETECT_HOME_CHANGES,
+    the candidate will be regarded as the home cluster; 
+    otherwise, the home cluster will be the last valid day's cluster.
+    (If there are no valid clusters before that day, it will be assigned the next valid day's cluster.)
+
+    """
+
+    nights = nights[~nights["cluster_label"].isin([-1, np.nan])]
+    
+    # Select the smallest group number per day
+    selected_groups = nights[nights["group"] == nights.groupby("local_date")["group"].transform("min")]
+    
+    # Candidate per day. Group 1: the most common cluster (ties go to the smallest label), group 2: the cluster of the last
+    # record, group 3: the cluster of the first record
+    group_per_day = selected_groups.groupby("local_date")["group"].first()
+    records_per_cluster = selected_groups.groupby(["local_date", "cluster_label"])["records"].sum().reset_index()
+    candidates = {1: records_per_cluster.sort_values(["local_date", "records", "cluster_label"], ascending=[True, False, True]).drop_duplicates("local_date").set_index("local_date")["cluster_label"],
+                  2: selected_groups.sort_values("last_position").drop_duplicates("local_date", keep="last").set_index("local_date")["cluster_label"],
+                  3: selected_groups.sort_values("first_position").drop_duplicates("local_date", keep="first").set_index("local_date")["cluster_label"]}
+    home_clusters = pd.DataFrame({"cluster_label": np.select([group_per_day == group for group in candidates], [candidate.reindex(group_per_day.index).values for candidate in candidates.values()])}, index=group_per_day.index)
+    
+    # Count the consecutive days with the same candidate home location cluster label
+    home_clusters["number_of_days"] = home_clusters.groupby((home_clusters["cluster_label"] != home_clusters["cluster_label"].shift(1)).cumsum())["cluster_label"].transform("count")
+    # Assign the missing days with (1) the last valid day's cluster first and (2) the next valid day's cluster then
+    home_clusters.loc[home_clusters["number_of_days"] < days_threshold, "cluster_label"] = np.nan
+    cluster_per_day = home_clusters["cluster_label"].reindex(local_dates).fillna(method="ffill").fillna(method="bfill")
+
+    center_per_cluster = mean_coordinates(nights, "cluster_label")
+    home_locations = center_per_cluster.reindex(cluster_per_day.values).set_axis(local_dates).rename(columns={"double_latitude": "home_latitude", "double_longitude": "home_longitude"})
+
+    # reorder cluster labels
+    reorder_mapping = {old_label: idx + 1 for idx, old_label in enumerate(cluster_per_day.unique())}
+    home_locations["home_label"] = cluster_per_day.map(reorder_mapping)
+
+    return home_locations
+
+# Add "distance_from_home" and "home_label" columns based on the home location of each local date
+def add_home_columns(location_data, home_locations):
+    home_per_row = home_locations.reindex(location_data["local_date"])
+    return location_data.assign(distance_from_home=haversine(location_data["double_longitude"], location_data["double_latitude"], home_per_row["home_longitude"].values, home_per_row["home_latitude"].values),
+                                home_label=home_per_row["home_label"].values)
+
+# Prepare for episodes
+def add_episode_columns(location_data):
+    location_data = location_data.rename(columns={"timestamp": "start_timestamp"})
+    location_data["end_timestamp"] = (location_data["start_timestamp"] + location_data["duration_in_seconds"] * 1000 - 1).astype(int)
     return location_data
 
 
 
-location_data = pd.read_csv(snakemake.input["sensor_input"])
+sensor_input = snakemake.input["sensor_input"]
 provider = snakemake.params["provider"]
 
 maximum_row_gap = provider["MAXIMUM_ROW_GAP"]
@@ -115,23 +204,47 @@ cluster_on = provider["CLUSTER_ON"]
 strategy = provider["INFER_HOME_LOCATION_STRATEGY"]
 days_threshold = provider["MINIMUM_DAYS_TO_DETECT_HOME_CHANGES"]
 
-if not location_data.timestamp.is_monotonic:
-    location_data.sort_values(by=["timestamp"], inplace=True)
-
-location_data["duration_in_seconds"] = -1 * location_data.timestamp.diff(-1) / 1000
-location_data.loc[location_data["duration_in_seconds"] >= maximum_row_gap, "duration_in_seconds"] = np.nan
-
-location_data = mark_as_stationary(location_data, threshold_static)
-
 hyperparameters = create_clustering_hyperparameters(clustering_algorithm, dbscan_eps, dbscan_minsamples)
-location_data_with_doryab_columns = infer_home_location(location_data, clustering_algorithm, hyperparameters, strategy, days_threshold)
+
+# First pass: the records are summarized by coordinates to cluster them and infer the home locations. The file is
+# streamed if it is sorted by timestamp, otherwise the pass starts over on the sorted data
+def summarize_location_data(is_sorted):
+    coordinates, nights, local_dates, position = [], [], [], 0
+    for location_data in preprocess_days(read_location_days(sensor_input, is_sorted, SUMMARY_INPUT_COLUMNS), maximum_row_gap, threshold_static):
+        block_coordinates, block_nights = summarize_location_days(location_data, position, cluster_on == "PARTICIPANT_DATASET")
+        coordinates.append(block_coordinates)
+        nights.append(block_nights)
+        local_dates.extend(location_data["local_date"].unique())
+        position += len(location_data)
+    return coordinates, nights, local_dates
+
+try:
+    is_sorted = True
+    coordinates, nights, local_dates = summarize_location_data(is_sorted)
+except UnsortedLocationData:
+    is_sorted = False
+    coordinates, nights, local_dates = summarize_location_data(is_sorted)
+
+nights = pd.concat(nights) if nights else pd.DataFrame()
+home_locations = infer_home_location(nights, pd.Index(pd.unique(local_dates), name="local_date"), clustering_algorithm, hyperparameters, strategy, days_threshold)
+del nights
 
 selected_columns = ["local_timezone", "device_id", "start_timestamp", "end_timestamp", "provider", "double_latitude", "double_longitude", "distance", "speed", "is_stationary", "distance_from_home", "home_label"]
 if cluster_on == "PARTICIPANT_DATASET":
-    location_data_with_doryab_columns = cluster(location_data_with_doryab_columns, clustering_algorithm, **hyperparameters)
     selected_columns.append("cluster_label")
-
-# Prepare for episodes
-location_data_with_doryab_columns = location_data_with_doryab_columns.rename(columns={"timestamp": "start_timestamp"})
-location_data_with_doryab_columns["end_timestamp"] = (location_data_with_doryab_columns["start_timestamp"] + location_data_with_doryab_columns["duration_in_seconds"] * 1000 - 1).astype(int)
-location_data_with_doryab_columns[selected_columns].to_csv(snakemake.output[0], index=False)
+pd.DataFrame(columns=selected_columns).to_csv(snakemake.output[0], index=False)
+
+# Second pass: attach the home location (and the cluster of PARTICIPANT_DATASET) to every record and append each block of
+# days to the output file
+if home_locations is not None:
+    if cluster_on == "PARTICIPANT_DATASET":
+        # Clusters are computed over the coordinates of the whole dataset
+        cluster_labels = cluster_coordinates(pd.concat(coordinates), clustering_algorithm, hyperparameters)
+    del coordinates
+
+    for location_data in preprocess_days(read_location_days(sensor_input, is_sorted), maximum_row_gap, threshold_static):
+        location_data = add_home_columns(location_data, home_locations)
+        if cluster_on == "PARTICIPANT_DATASET":
+            location_data = location_data.merge(cluster_labels, how="left", on=COORDINATE_COLUMNS)
+            location_data["cluster_label"] = location_data["cluster_label"].astype(cluster_labels["cluster_label"].dtype)
+        add_episode_columns(location_data)[selected_columns].to_csv(snakemake.output[0], mode="a", header=False, index=False)
@@ -4,16 +4,6 @@ from sklearn.cluster import DBSCAN, OPTICS
 
 
 
-# Calculate the great-circle distance (in meters) between two points on the earth (specified in decimal degrees)
-def haversine(lon1, lat1, lon2, lat2):
-    # Radius of earth in kilometers. Use 3956 for miles
-    r = 6371
-    # Convert decimal degrees to radians 
-    lon1, lat1, lon2, lat2 = np.radians([lon1, lat1, lon2, lat2])
-    # Haversine formula
-    distance = r * 2 * np.arcsin(np.sqrt(np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2)) * 1000
-    return distance
-
 # Just an approximation, but speeds up clustering by a huge amount and doesn't introduce much error over small distances
 # Reference: https://jonisalonen.com/2014/computing-distance-between-coordinates-can-be-simple-and-fast/
 def meters_to_degrees(distance):
@@ -1,11 +1,32 @@
 from datetime import time
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-from phone_locations.doryab.doryab_clustering import haversine, create_clustering_hyperparameters, cluster
+from phone_locations.distances import haversine
+from phone_locations.doryab.doryab_clustering import create_clustering_hyperparameters, cluster
+from utils.grouped_statistics import grouped_mode
 
 
 
-def apply_cluster_strategy(location_data, time_segment, clustering_algorithm, dbscan_eps, dbscan_minsamples, cluster_on, filter_data_by_segment):
+# Time segment instances are clustered independently, so they are dispatched to a process pool when clustering_workers > 1
+# Results are concatenated once in instance order; cluster() returns a new index per instance, so the index is reset
+def cluster_per_segment_instance(location_data, clustering_algorithm, hyperparameters, clustering_workers):
+
+    instances_data = [instance_data for _, instance_data in location_data.groupby("local_segment", sort=True)]
+    if len(instances_data) == 0:
+        return pd.DataFrame()
+
+    cluster_instance = partial(cluster, clustering_algorithm=clustering_algorithm, **hyperparameters)
+    if clustering_workers > 1 and len(instances_data) > 1:
+        with ProcessPoolExecutor(max_workers=min(clustering_workers, len(instances_data))) as executor:
+            location_data_clusters = list(executor.map(cluster_instance, instances_data))
+    else:
+        location_data_clusters = [cluster_instance(instance_data) for instance_data in instances_data]
+
+    return pd.concat(location_data_clusters, ignore_index=True)
+
+def apply_cluster_strategy(location_data, time_segment, clustering_algorithm, dbscan_eps, dbscan_minsamples, cluster_on, filter_data_by_segment, clustering_workers=1):
 
     hyperparameters = create_clustering_hyperparameters(clustering_algorithm, dbscan_eps, dbscan_minsamples)
 
@@ -17,11 +38,7 @@ def apply_cluster_strategy(location_data, time_segment, clustering_algorithm, db
         location_data = cluster(location_data, clustering_algorithm, **hyperparameters)
     else: # TIME_SEGMENT_INSTANCE
         location_data = filter_data_by_segment(location_data, time_segment)
-        location_data_clusters = pd.DataFrame()
-        for segment_instance, instance_data in location_data.groupby(["local_segment"]):
-            location_data_per_group = cluster(instance_data, clustering_algorithm, **hyperparameters)
-            location_data_clusters = pd.concat([location_data_per_group, location_data_clusters])
-        location_data = location_data_clusters
+        location_data = cluster_per_segment_instance(location_data, clustering_algorithm, hyperparameters, clustering_workers)
 
     return location_data
 
@@ -61,20 +78,21 @@ def radius_of_gyration(location_data):
     if location_data.empty:
         return np.nan
 
-    # define a lambda function to compute the weighted mean for each cluster
-    weighted_mean = lambda x: np.average(x, weights=location_data.loc[x.index, "duration"])
+    # weighted means are computed as grouped sums of value * weight divided by grouped sums of weights
+    location_data = location_data.assign(latitude_X_duration=location_data["double_latitude"] * location_data["duration"],
+                                         longitude_X_duration=location_data["double_longitude"] * location_data["duration"])
  
     # center is the centroid of the places visited during a segment instance, not the home location
-    clusters = location_data.groupby(["local_segment", "cluster_label"]).agg(
-        double_latitude=("double_latitude", weighted_mean),
-        double_longitude=("double_longitude", weighted_mean),
-        time_in_a_cluster=("duration", "sum")
-    ).reset_index()
-
-    # redefine the lambda function to compute the weighted mean across clusters
-    weighted_mean = lambda x: np.average(x, weights=clusters.loc[x.index, "time_in_a_cluster"])
-
-    clusters[["centroid_double_latitude", "centroid_double_longitude"]] = clusters.groupby(["local_segment"], sort=False)[["double_latitude", "double_longitude"]].transform(weighted_mean)
+    clusters = location_data.groupby(["local_segment", "cluster_label"])[["latitude_X_duration", "longitude_X_duration", "duration"]].sum().rename(columns={"duration": "time_in_a_cluster"}).reset_index()
+    clusters["double_latitude"] = clusters["latitude_X_duration"] / clusters["time_in_a_cluster"]
+    clusters["double_longitude"] = clusters["longitude_X_duration"] / clusters["time_in_a_cluster"]
+
+    # weighted mean across clusters
+    clusters["latitude_X_time_in_a_cluster"] = clusters["double_latitude"] * clusters["time_in_a_cluster"]
+    clusters["longitude_X_time_in_a_cluster"] = clusters["double_longitude"] * clusters["time_in_a_cluster"]
+    clusters_grouped = clusters.groupby(["local_segment"], sort=False)
+    clusters["centroid_double_latitude"] = clusters_grouped["latitude_X_time_in_a_cluster"].transform("sum") / clusters_grouped["time_in_a_cluster"].transform("sum")
+    clusters["centroid_double_longitude"] = clusters_grouped["longitude_X_time_in_a_cluster"].transform("sum") / clusters_grouped["time_in_a_cluster"].transform("sum")
     clusters["distance_squared"] = haversine(clusters["double_longitude"], clusters["double_latitude"], clusters["centroid_double_longitude"], clusters["centroid_double_latitude"]) ** 2
     
     clusters["distance_squared_X_time_in_a_cluster"] = clusters["distance_squared"] * clusters["time_in_a_cluster"]
@@ -82,24 +100,21 @@ def radius_of_gyration(location_data):
    
     return rog
 
-def cluster_stay(x, stay_at_clusters, cluster_n):
-    topn_cluster_label = x[stay_at_clusters.loc[x.index]["cluster_label"] == cluster_n]
-    time_at_topn = topn_cluster_label.iloc[0] if len(topn_cluster_label) == 1 else None
-    return time_at_topn
-
 def stay_at_topn_clusters(location_data):
 
     stay_at_clusters = location_data[["local_segment", "cluster_label", "duration"]].groupby(["local_segment", "cluster_label"], sort=True).sum().reset_index()
 
-    stay_at_clusters_features = stay_at_clusters.groupby(["local_segment"]).agg(        
-        timeattop1location=("duration", lambda x: cluster_stay(x, stay_at_clusters, 1)),
-        timeattop2location=("duration", lambda x: cluster_stay(x, stay_at_clusters, 2)),
-        timeattop3location=("duration", lambda x: cluster_stay(x, stay_at_clusters, 3)),
-        maxlengthstayatclusters=("duration", "max"),
-        minlengthstayatclusters=("duration", "min"),
-        avglengthstayatclusters=("duration", "mean"),
-        stdlengthstayatclusters=("duration", "std")
-    ).fillna(0)
+    # time at the top 1, 2, and 3 clusters: one column per cluster label, 0 if a segment instance did not visit that cluster
+    topn_clusters = stay_at_clusters[stay_at_clusters["cluster_label"].isin([1, 2, 3])].pivot(index="local_segment", columns="cluster_label", values="duration").reindex(columns=[1, 2, 3])
+    topn_clusters.columns = ["timeattop1location", "timeattop2location", "timeattop3location"]
+
+    stay_at_clusters_features = stay_at_clusters.groupby(["local_segment"])["duration"].agg(
+        maxlengthstayatclusters="max",
+        minlengthstayatclusters="min",
+        avglengthstayatclusters="mean",
+        stdlengthstayatclusters="std"
+    )
+    stay_at_clusters_features = topn_clusters.merge(stay_at_clusters_features, how="right", left_index=True, right_index=True).fillna(0)
 
     return stay_at_clusters_features
 
@@ -107,7 +122,8 @@ def location_entropy(location_data):
 
     location_data = location_data.groupby(["local_segment", "cluster_label"])[["duration"]].sum().reset_index().rename(columns={"duration": "cluster_duration"})
     location_data["all_clusters_duration"] = location_data.groupby(["local_segment"])["cluster_duration"].transform("sum")
-    location_data["plogp"] = (location_data["cluster_duration"] / location_data["all_clusters_duration"]).apply(lambda x: x * np.log(x))
+    cluster_proportion = location_data["cluster_duration"] / location_data["all_clusters_duration"]
+    location_data["plogp"] = cluster_proportion * np.log(cluster_proportion)
     
     entropy = -1 * location_data.groupby(["local_segment"])[["plogp"]].sum().rename(columns={"plogp": "locationentropy"})
 
@@ -125,6 +141,7 @@ def doryab_features(sensor_data_files, time_segment, provider, filter_data_by_se
     dbscan_eps = provider["DBSCAN_EPS"]
     dbscan_minsamples = provider["DBSCAN_MINSAMPLES"]
     cluster_on = provider["CLUSTER_ON"]
+    clustering_workers = provider.get("CLUSTERING_WORKERS", 1)
     clustering_algorithm = provider["CLUSTERING_ALGORITHM"]
     radius_from_home = provider["RADIUS_FOR_HOME"]
     threshold_max_speed = provider["THRESHOLD_MAX_SPEED"]
@@ -141,7 +158,7 @@ def doryab_features(sensor_data_files, time_segment, provider, filter_data_by_se
     if threshold_max_speed > 0:
         location_data = location_data.drop(location_data[location_data.speed > threshold_max_speed].index)
 
-    location_data = apply_cluster_strategy(location_data, time_segment, clustering_algorithm, dbscan_eps, dbscan_minsamples, cluster_on, filter_data_by_segment)
+    location_data = apply_cluster_strategy(location_data, time_segment, clustering_algorithm, dbscan_eps, dbscan_minsamples, cluster_on, filter_data_by_segment, clustering_workers)
 
     if location_data.empty:
         return pd.DataFrame(columns=["local_segment"] + features_to_compute)
@@ -189,11 +206,11 @@ def doryab_features(sensor_data_files, time_segment, provider, filter_data_by_se
     if stationary_data.empty:
         location_features["timeathome"] = 0
     else:
-        stationary_data["time_at_home"] = stationary_data.apply(lambda row: row["duration"] if row["distance_from_home"] <= radius_from_home else 0, axis=1)
+        stationary_data["time_at_home"] = np.where(stationary_data["distance_from_home"] <= radius_from_home, stationary_data["duration"], 0)
         location_features["timeathome"] = stationary_data[["local_segment", "time_at_home"]].groupby(["local_segment"])["time_at_home"].sum()
 
     # home label
-    location_features["homelabel"] = stationary_data[["local_segment", "home_label"]].groupby(["local_segment"]).agg(lambda x: pd.Series.mode(x)[0])
+    location_features["homelabel"] = grouped_mode(stationary_data, "local_segment", "home_label")
 
     location_features = location_features[features_to_compute].reset_index()
 
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+from scipy.special import entr
+
+
+# Vectorized replacement for data.groupby(group_column)[value_column].agg(lambda x: pd.Series.mode(x)[0])
+# Values are factorized in sorted order and every (group, value) pair is counted with np.bincount. The mode of
+# each group is its most frequent value; ties are broken by the smallest value as pd.Series.mode(x)[0] does.
+# NaN values are ignored and groups without valid values get NaN.
+def grouped_mode(data, group_column, value_column):
+    group_codes, groups = pd.factorize(data[group_column], sort=True)
+    value_codes, values = pd.factorize(data[value_column], sort=True)
+    groups = pd.Index(groups, name=group_column)
+
+    valid = (group_codes >= 0) & (value_codes >= 0)
+    if not valid.any():
+        return pd.Series(np.nan, index=groups, name=value_column)
+
+    pair_codes, pairs = pd.factorize(group_codes[valid].astype(np.int64) * len(values) + value_codes[valid])
+    pair_counts = np.bincount(pair_codes)
+    pair_groups, pair_values = np.divmod(pairs, len(values))
+
+    # sort pairs by group, then by descending count, then by ascending value and keep the first pair of each group
+    order = np.lexsort((pair_values, -pair_counts, pair_groups))
+    first_of_group = order[np.r_[True, pair_groups[order][1:] != pair_groups[order][:-1]]]
+
+    mode = pd.Series(values[pair_values[first_of_group]], index=groups[pair_groups[first_of_group]], name=value_column)
+    return mode.reindex(groups)
+
+# Compute many grouped features with one groupby per distinct filter instead of one groupby per feature.
+# plan is a list of (feature, column, reducer, filter_key) tuples where reducer is any name accepted by GroupBy.agg, and
+# filters maps each filter_key to a function that returns the rows of data its features are computed on.
+# Features are returned as columns in plan order, indexed by the sorted groups of data[group_column]. Groups without
+# rows in a filter get NaN, while all the features of a filter that selects no rows at all are 0
+def planned_aggregation(data, group_column, plan, filters):
+    groups = pd.Index(np.sort(data[group_column].unique()), name=group_column)
+
+    aggregations = {}
+    for feature, column, reducer, filter_key in plan:
+        aggregations.setdefault(filter_key, {})[feature] = (column, reducer)
+
+    features = []
+    for filter_key, filter_aggregations in aggregations.items():
+        filtered_data = filters[filter_key](data)
+        if filtered_data.empty:
+            features.append(pd.DataFrame(0, index=groups, columns=list(filter_aggregations)))
+        else:
+            features.append(filtered_data.groupby(group_column).agg(**filter_aggregations).reindex(groups))
+
+    if len(features) == 0:
+        return pd.DataFrame(index=groups)
+    return pd.concat(features, axis=1)[[feature for feature, _, _, _ in plan]]
+
+# Vectorized replacement for data.groupby(group_column)[value_column].agg(scipy.stats.entropy)
+# scipy.stats.entropy normalizes the values of a group by their sum, so the sums and the entr terms of each group are
+# accumulated with two weighted np.bincount calls. Groups with NaN values or whose values add up to 0 get NaN
+def grouped_entropy(data, group_column, value_column):
+    group_codes, groups = pd.factorize(data[group_column], sort=True)
+    groups = pd.Index(groups, name=group_column)
+    valid = group_codes >= 0
+    group_codes = group_codes[valid]
+    values = data[value_column].to_numpy(dtype=np.float64)[valid]
+
+    totals = np.bincount(group_codes, weights=values, minlength=len(groups))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        terms = entr(values / totals[group_codes])
+    return pd.Series(np.bincount(group_codes, weights=terms, minlength=len(groups)), index=groups, name=value_column)
+
+# Statistics supported by grouped_statistics, in the order their feature columns are returned
+STATISTICS = ["sum", "max", "min", "avg", "median", "mode", "std", "diffmaxmode", "diffminmode", "entropy"]
+STATISTICS_REDUCERS = {"sum": "sum", "max": "max", "min": "min", "avg": "mean", "median": "median", "std": "std"}
+
+# Compute the requested STATISTICS of data[value_column] per group of data[group_column] with one grouping of data
+# instead of one groupby per statistic. Reducers in STATISTICS_REDUCERS run in a single GroupBy.agg, mode and entropy
+# use grouped_mode and grouped_entropy, and diffmaxmode (max - mode) and diffminmode (mode - min) reuse those results.
+# Returns a DataFrame with a column per requested statistic (in STATISTICS order) indexed by the sorted groups
+def grouped_statistics(data, group_column, value_column, statistics):
+    statistics = [statistic for statistic in STATISTICS if statistic in statistics]
+    required = set(statistics)
+    if "diffmaxmode" in required:
+        required |= {"max", "mode"}
+    if "diffminmode" in required:
+        required |= {"min", "mode"}
+
+    reducers = {statistic: (value_column, reducer) for statistic, reducer in STATISTICS_REDUCERS.items() if statistic in required}
+    if reducers:
+        results = data.groupby(group_column).agg(**reducers)
+    else:
+        results = pd.DataFrame(index=pd.Index(np.sort(data[group_column].dropna().unique()), name=group_column))
+
+    if "mode" in required:
+        results["mode"] = grouped_mode(data, group_column, value_column)
+    if "diffmaxmode" in required:
+        results["diffmaxmode"] = results["max"] - results["mode"]
+    if "diffminmode" in required:
+        results["diffminmode"] = results["mode"] - results["min"]
+    if "entropy" in required:
+        results["entropy"] = grouped_entropy(data, group_column, value_column)
+
+    return results[statistics]
@@ -0,0 +1,55 @@
+import cProfile
+import json
+import sys
+import time
+from contextlib import contextmanager
+
+
+# Stage timers, counters and an optional cProfile profiler for long running feature scripts.
+# Stages and counters accumulate in the order they are first recorded; write_report saves them as a JSON sidecar
+# next to the script output instead of printing progress messages to the Snakemake log.
+class Instrumentation:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, profile=False):
+        self.stages = {}
+        self.counters = {}
+        self.start_time = time.perf_counter()
+        self.profiler = cProfile.Profile() if profile else None
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def report(self):
+        return {"total_seconds": round(time.perf_counter() - self.start_time, 6),
+                "stage_seconds": {name: round(seconds, 6) for name, seconds in self.stages.items()},
+                "counters": dict(self.counters)}
+
+    # Either file can be None. profile_file is only written when the profiler was enabled by reset(profile=True)
+    def write_report(self, report_file, profile_file=None):
+        if self.profiler is not None:
+            self.profiler.disable()
+            if profile_file is not None:
+                self.profiler.dump_stats(profile_file)
+        if report_file is not None:
+            with open(report_file, "w") as report:
+                json.dump(self.report(), report, indent=2)
+
+# tqdm progress bar when stderr is attached to a terminal, the plain iterable otherwise (e.g. in Snakemake logs)
+def progress(iterable, **kwargs):
+    if not sys.stderr.isatty():
+        return iterable
+    from tqdm import tqdm
+    return tqdm(iterable, **kwargs)
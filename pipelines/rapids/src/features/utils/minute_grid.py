@@ -0,0 +1,64 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+MINUTE = np.timedelta64(1, "m")
+
+
+# A dense per-minute store of intraday signals of a participant: one fixed-stride float64 .npy array per signal with a
+# value for every local minute between the first and the last sample (NaN for minutes without samples), plus an
+# index.json with the first minute. Arrays are opened memory-mapped, so a segment is read by slicing the minutes
+# between its start and end instead of parsing and filtering local_date_time strings.
+class MinuteGrid:
+
+    def __init__(self, folder, mmap_mode="r"):
+        with open(os.path.join(folder, "index.json")) as index_file:
+            index = json.load(index_file)
+        self.start = np.datetime64(index["start"], "m")
+        self.minutes = index["minutes"]
+        self.signals = {signal: np.load(os.path.join(folder, signal + ".npy"), mmap_mode=mmap_mode) for signal in index["signals"]}
+
+    # The local date time of every minute of the grid
+    @property
+    def dates(self):
+        return self.start + np.arange(self.minutes) * MINUTE
+
+    # Position in the grid of the minute of each local date time (it can fall outside [0, minutes))
+    def minute_index(self, local_date_times):
+        return ((pd.to_datetime(local_date_times).values.astype("datetime64[m]") - self.start) // MINUTE).astype(np.int64)
+
+    # The minutes that start within a RAPIDS local_segment ("label#start_date_time,end_date_time"), clipped to the grid
+    def segment_slice(self, local_segment):
+        start_date_time, end_date_time = local_segment.split("#")[1].split(",")
+        first = -((self.start - np.datetime64(start_date_time)) // MINUTE)
+        last = (np.datetime64(end_date_time) - self.start) // MINUTE
+        return slice(int(np.clip(first, 0, self.minutes)), int(np.clip(last + 1, 0, self.minutes)))
+
+    # Whether a RAPIDS local_segment starts on the first second of a minute and ends on the last second of a minute, so
+    # the minutes of its segment_slice hold exactly the samples assigned to it
+    @staticmethod
+    def whole_minutes(local_segment):
+        start_date_time, end_date_time = local_segment.split("#")[1].split(",")
+        return start_date_time.endswith(":00") and end_date_time.endswith(":59")
+
+    def segment(self, signal, local_segment):
+        return self.signals[signal][self.segment_slice(local_segment)]
+
+# Aggregate samples into the minutes of their local_date_time and save them as a MinuteGrid in folder.
+# signals maps the name of each signal to its sample values and a GroupBy.agg reducer (e.g. "mean" or "sum")
+def write_minute_grid(folder, local_date_times, signals):
+    os.makedirs(folder, exist_ok=True)
+    minutes = pd.to_datetime(local_date_times).values.astype("datetime64[m]")
+    start = minutes.min() if len(minutes) else np.datetime64("1970-01-01T00:00", "m")
+    minute_index = ((minutes - start) // MINUTE).astype(np.int64)
+    n_minutes = int(minute_index.max()) + 1 if len(minutes) else 0
+
+    for signal, (values, reducer) in signals.items():
+        aggregated = pd.Series(np.asarray(values, dtype=np.float64)).groupby(minute_index).agg(reducer)
+        grid = np.full(n_minutes, np.nan)
+        grid[aggregated.index.to_numpy()] = aggregated.to_numpy()
+        np.save(os.path.join(folder, signal + ".npy"), grid)
+
+    with open(os.path.join(folder, "index.json"), "w") as index_file:
+        json.dump({"start": str(start), "minutes": n_minutes, "signals": list(signals)}, index_file, indent=2)
@@ -0,0 +1,112 @@
+import unittest
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "features"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "features", "phone_locations", "barnett"))
+from sklearn.cluster import KMeans
+from scipy.spatial.distance import pdist
+from barnett_library import FEATURE_NAMES, TRACE_COLUMNS, impute_mobility_traces, initialize_params, segment_mobility_features, significant_location_centers
+
+TIMEZONE = "America/Los_Angeles"
+# 2020-06-01 00:00:00 in Los Angeles
+START_TIME = 1590994800
+
+# Locations sampled every 10 seconds for n_days: the nights are spent at home, the days at work, and the commutes are
+# straight legs of 30 minutes with a few meters of GPS noise
+def generate_commutes(n_days, seed):
+    rng = np.random.default_rng(seed)
+    home, work = np.array([34.0224, -118.2851]), np.array([34.0522, -118.2437])
+    stops = [(0, home), (8 * 3600, home), (8.5 * 3600, work), (17 * 3600, work), (17.5 * 3600, home), (24 * 3600, home)]
+    seconds = np.arange(0, n_days * 86400, 10)
+    second_of_day = seconds % 86400
+    stop_seconds = np.array([second for second, _ in stops])
+    latitude = np.interp(second_of_day, stop_seconds, [place[0] for _, place in stops])
+    longitude = np.interp(second_of_day, stop_seconds, [place[1] for _, place in stops])
+    return pd.DataFrame({"timestamp": (START_TIME + seconds) * 1000,
+                         "double_latitude": latitude + rng.normal(0, 0.00001, len(seconds)),
+                         "double_longitude": longitude + rng.normal(0, 0.00001, len(seconds)),
+                         "double_altitude": 0.0, "accuracy": rng.uniform(5, 30, len(seconds))})
+
+# Locations sampled every 10 seconds for n_days: each morning a few of eight places around home are visited for 30 minutes to
+# 4 hours, then the participant goes back home. Two pairs of places are about 330 and 460 meters apart
+def generate_errands(n_days, seed):
+    rng = np.random.default_rng(seed)
+    places = np.vstack([[34.0224, -118.2851], [34.0224, -118.2851] + rng.normal(0, 0.01, (8, 2))])
+    places[2] = places[1] + [0.003, 0]
+    places[4] = places[3] + [0, 0.005]
+    stop_seconds, stop_places = [0], [places[0]]
+    for day in range(n_days):
+        second = day * 86400 + 7 * 3600 + rng.integers(0, 3600)
+        for place in rng.choice(np.arange(1, 9), size=rng.integers(2, 5), replace=False):
+            stay = 1200 + rng.integers(1800, 4 * 3600)
+            stop_seconds += [second, second + 1200, second + stay]
+            stop_places += [stop_places[-1], places[place], places[place]]
+            second += stay
+        stop_seconds.append(second + 1200)
+        stop_places.append(places[0])
+    stop_seconds.append(n_days * 86400)
+    stop_places = np.array(stop_places + [places[0]])
+    seconds = np.arange(0, n_days * 86400, 10)
+    return pd.DataFrame({"timestamp": (START_TIME + seconds) * 1000,
+                         "double_latitude": np.interp(seconds, stop_seconds, stop_places[:, 0]) + rng.normal(0, 0.00001, len(seconds)),
+                         "double_longitude": np.interp(seconds, stop_seconds, stop_places[:, 1]) + rng.normal(0, 0.00001, len(seconds)),
+                         "double_altitude": 0.0, "accuracy": rng.uniform(5, 30, len(seconds))})
+
+# The k search that significant_location_centers replaced in sig_locs: fresh fits on the pause locations repeated by their weight
+def significant_location_centers_repeated(pause_locations, pause_weights, center_rad):
+    pmat = np.repeat(pause_locations, pause_weights.astype(int), axis=0)
+    previous_fit = None
+    for kmeansk in range(2, len(pause_locations)+1):
+        kmeans_fit = KMeans(n_clusters=kmeansk, random_state=23).fit(pmat)
+        if np.min(pdist(kmeans_fit.cluster_centers_, 'euclidean')) < center_rad*2:
+            if previous_fit is not None:
+                kmeans_fit = previous_fit
+            break
+        previous_fit = kmeans_fit
+    return kmeans_fit.cluster_centers_
+
+class SignificantLocationsTests(unittest.TestCase):
+
+    def test_centers_match_repeated_pauses(self):
+        selected_k = set()
+        for seed in range(7):
+            trace = impute_mobility_traces(generate_errands(4, seed), accuracy_limit=999999999, seed=seed)
+            out3 = trace.loc[trace["repetition"] == 0, TRACE_COLUMNS].to_numpy(dtype=np.float64)
+            # pauses weighted by their number of 10 minute periods, as sig_locs does
+            obj = initialize_params(out3)
+            pause_periods = np.floor(np.array(obj["pt"]) / 600)
+            pause_ids = np.flatnonzero(pause_periods > 0)
+            pause_locations = out3[np.array(obj["ID2"][0])[pause_ids]][:, 1:3]
+
+            centers = significant_location_centers(pause_locations, pause_periods[pause_ids], 200)
+            expected_centers = significant_location_centers_repeated(pause_locations, pause_periods[pause_ids], 200)
+            self.assertEqual(len(centers), len(expected_centers))
+            np.testing.assert_allclose(centers[np.lexsort(centers.T[::-1])], expected_centers[np.lexsort(expected_centers.T[::-1])], rtol=0, atol=1e-6)
+            selected_k.add(len(centers))
+        # the traces select different numbers of significant locations
+        self.assertGreater(len(selected_k), 2)
+
+class SegmentMobilityFeaturesTests(unittest.TestCase):
+
+    def test_repetition_without_rows_in_a_segment(self):
+        trace = impute_mobility_traces(generate_commutes(3, seed=0), accuracy_limit=999999999, n_reps=2)
+        # the second repetition ends before the last day
+        last_day = START_TIME + 2 * 86400
+        trace = trace[(trace["repetition"] != 1) | (np.fmax(trace["t0"], trace["t1"]) < last_day)].reset_index(drop=True)
+        segments = pd.DataFrame({"local_segment": ["first_day", "last_day"],
+                                 "start_timestamp": [START_TIME, last_day], "end_timestamp": [START_TIME + 86399, last_day + 86399]})
+
+        features = segment_mobility_features(trace, segments, TIMEZONE).set_index("local_segment")
+        first_repetition = segment_mobility_features(trace[trace["repetition"] != 1], segments, TIMEZONE).set_index("local_segment")
+
+        # only the first repetition covers the last day, so the features of that day are the features of the first repetition
+        self.assertFalse(features.loc["last_day", ["hometime", "disttravelled", "maxhomedist"]].isna().any())
+        pd.testing.assert_series_equal(features.loc["last_day"], first_repetition.loc["last_day"])
+        self.assertEqual(features.columns.tolist(), FEATURE_NAMES)
+
+
+if __name__ == '__main__':
+    unittest.main()
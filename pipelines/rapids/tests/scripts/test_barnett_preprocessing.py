@@ -0,0 +1,100 @@
+import unittest
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "features"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "features", "phone_locations", "barnett"))
+from barnett_library import collapse_to_intervals, is_flight_within_width, WindowWidth
+
+# Row by row implementation that collapse_to_intervals replaced in barnett_library.preprocessing
+def collapse_to_intervals_loop(df, interval):
+    start_time = (df['timestamp'].iloc[0]/1000)
+    avg_matrix_lst = []
+    next_line = [1, start_time + interval/2.0, df['latitude'].iloc[0], df['longitude'].iloc[0], 0.0, 0.0]
+    interval_counter = 1
+
+    counter = 0
+    for idx, row in df.iterrows():
+        if counter > 0:
+            timestamp = row['timestamp']
+            latitude = row['latitude']
+            longitude = row['longitude']
+
+            if timestamp/1000.00 < start_time + interval:
+                next_line[2] += latitude
+                next_line[3] += longitude
+                interval_counter += 1
+            else:
+                next_line[2] = next_line[2]/interval_counter
+                next_line[3] = next_line[3]/interval_counter
+                avg_matrix_lst.append(next_line)
+
+                num_miss = np.floor((timestamp/1000 - (start_time + interval))/interval)
+                if num_miss > 0:
+                    has_miss = [4, start_time + interval/2.0, start_time + interval * (num_miss + 1) +interval/2.0, float("NaN"), float("NaN"), float("NaN")]
+                    avg_matrix_lst.append(has_miss)
+
+                start_time = start_time + interval * (num_miss+1)
+                next_line = [1, start_time + interval/2.0, latitude, longitude, 0.0, 0.0]
+                interval_counter = 1
+        counter += 1
+
+    return pd.DataFrame(data=avg_matrix_lst)
+
+def generate_locations(seconds_between_rows, seed):
+    rng = np.random.default_rng(seed)
+    seconds = np.cumsum(rng.choice(seconds_between_rows, size=20000))
+    # remove a few hours of data to create missing intervals
+    seconds = seconds[(seconds % 50000) > 4000]
+    timestamps = (1590984000 + seconds) * 1000 + rng.integers(0, 1000, len(seconds))
+    return pd.DataFrame({"timestamp": timestamps,
+                         "latitude": 40.44 + np.cumsum(rng.normal(0, 0.0001, len(timestamps))),
+                         "longitude": -79.94 + np.cumsum(rng.normal(0, 0.0001, len(timestamps)))})
+
+class BarnettPreprocessingTests(unittest.TestCase):
+
+    def assert_same_intervals(self, df, interval):
+        expected = collapse_to_intervals_loop(df, interval)
+        actual = collapse_to_intervals(df["timestamp"].values, df["latitude"].values, df["longitude"].values, interval)
+        pd.testing.assert_frame_equal(expected, actual, check_exact=False, rtol=1e-12)
+
+    def test_dense_data(self):
+        self.assert_same_intervals(generate_locations([1, 2], seed=0), 10)
+
+    def test_sparse_data(self):
+        self.assert_same_intervals(generate_locations([5, 30, 60, 600], seed=1), 10.0)
+
+    def test_larger_interval(self):
+        self.assert_same_intervals(generate_locations([1, 5, 30], seed=2), 60)
+
+# Points along a line from the origin with a lateral noise of about w, so windows cross the width limit back and forth
+def generate_flight(angle, lateral_noise, seed):
+    rng = np.random.default_rng(seed)
+    along = np.r_[0, np.cumsum(rng.uniform(5, 15, 300))]
+    across = np.r_[0, rng.normal(0, lateral_noise, 300)]
+    return along*np.cos(angle) - across*np.sin(angle), along*np.sin(angle) + across*np.cos(angle)
+
+class WindowWidthTests(unittest.TestCase):
+
+    def assert_same_width_test(self, x_s, y_s, w, first_idx=1):
+        window_width = WindowWidth(x_s, y_s, w)
+        for last_idx in range(first_idx + 1, len(x_s)):
+            window = np.r_[0, first_idx:last_idx+1]
+            self.assertEqual(window_width.within_width(0, first_idx, last_idx), is_flight_within_width(x_s[window], y_s[window], w))
+
+    def test_random_flights(self):
+        for seed, (angle, lateral_noise) in enumerate([(0.3, 3), (2.0, 5), (-1.2, 6), (3.5, 8)]):
+            x_s, y_s = generate_flight(angle, lateral_noise, seed)
+            self.assert_same_width_test(x_s, y_s, 20)
+            self.assert_same_width_test(x_s, y_s, 20, first_idx=5)
+
+    def test_vertical_line(self):
+        x_s, y_s = generate_flight(np.pi/2, 1, seed=4)
+        x_s[::7] = x_s[0]
+        self.assert_same_width_test(x_s, y_s, 20)
+
+
+if __name__ == '__main__':
+    unittest.main()
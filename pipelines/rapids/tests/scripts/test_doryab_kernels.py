@@ -0,0 +1,97 @@
+import unittest
+import sys
+import os
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "features"))
+from phone_locations.distances import haversine
+from phone_locations.doryab.main import radius_of_gyration, stay_at_topn_clusters, location_entropy
+
+# Lambda based implementations that radius_of_gyration, stay_at_topn_clusters and location_entropy replaced in doryab/main.py
+def radius_of_gyration_lambdas(location_data):
+    if location_data.empty:
+        return np.nan
+
+    weighted_mean = lambda x: np.average(x, weights=location_data.loc[x.index, "duration"])
+    clusters = location_data.groupby(["local_segment", "cluster_label"]).agg(
+        double_latitude=("double_latitude", weighted_mean),
+        double_longitude=("double_longitude", weighted_mean),
+        time_in_a_cluster=("duration", "sum")
+    ).reset_index()
+
+    weighted_mean = lambda x: np.average(x, weights=clusters.loc[x.index, "time_in_a_cluster"])
+    clusters[["centroid_double_latitude", "centroid_double_longitude"]] = clusters.groupby(["local_segment"], sort=False)[["double_latitude", "double_longitude"]].transform(weighted_mean)
+    clusters["distance_squared"] = haversine(clusters["double_longitude"], clusters["double_latitude"], clusters["centroid_double_longitude"], clusters["centroid_double_latitude"]) ** 2
+
+    clusters["distance_squared_X_time_in_a_cluster"] = clusters["distance_squared"] * clusters["time_in_a_cluster"]
+    return np.sqrt(clusters.groupby(["local_segment"])["distance_squared_X_time_in_a_cluster"].sum() / clusters.groupby(["local_segment"])["time_in_a_cluster"].sum().replace(0, np.inf))
+
+def cluster_stay(x, stay_at_clusters, cluster_n):
+    topn_cluster_label = x[stay_at_clusters.loc[x.index]["cluster_label"] == cluster_n]
+    return topn_cluster_label.iloc[0] if len(topn_cluster_label) == 1 else None
+
+def stay_at_topn_clusters_lambdas(location_data):
+    stay_at_clusters = location_data[["local_segment", "cluster_label", "duration"]].groupby(["local_segment", "cluster_label"], sort=True).sum().reset_index()
+    return stay_at_clusters.groupby(["local_segment"]).agg(
+        timeattop1location=("duration", lambda x: cluster_stay(x, stay_at_clusters, 1)),
+        timeattop2location=("duration", lambda x: cluster_stay(x, stay_at_clusters, 2)),
+        timeattop3location=("duration", lambda x: cluster_stay(x, stay_at_clusters, 3)),
+        maxlengthstayatclusters=("duration", "max"),
+        minlengthstayatclusters=("duration", "min"),
+        avglengthstayatclusters=("duration", "mean"),
+        stdlengthstayatclusters=("duration", "std")
+    ).fillna(0)
+
+def location_entropy_lambdas(location_data):
+    location_data = location_data.groupby(["local_segment", "cluster_label"])[["duration"]].sum().reset_index().rename(columns={"duration": "cluster_duration"})
+    location_data["all_clusters_duration"] = location_data.groupby(["local_segment"])["cluster_duration"].transform("sum")
+    location_data["plogp"] = (location_data["cluster_duration"] / location_data["all_clusters_duration"]).apply(lambda x: x * np.log(x))
+
+    entropy = -1 * location_data.groupby(["local_segment"])[["plogp"]].sum().rename(columns={"plogp": "locationentropy"})
+    entropy["num_clusters"] = location_data.groupby(["local_segment"])["cluster_label"].nunique()
+    entropy["normalizedlocationentropy"] = entropy["locationentropy"] / entropy["num_clusters"]
+    return entropy
+
+# Stationary rows of a few segment instances around Los Angeles. Cluster labels 1 to 5 are visited at random, and the
+# segments "a", "b" and "c" never visit cluster 1, 2 or 3 (they only have labels 2 and 4, 1 and 5, or 4 and 5)
+def generate_stationary_data(seed):
+    rng = np.random.default_rng(seed)
+    rows = 400
+    local_segments = rng.choice(["daily#2021-03-0{},2021-03-0{}".format(day, day) for day in range(1, 8)], size=rows)
+    cluster_labels = rng.integers(1, 6, size=rows)
+    data = pd.DataFrame({"local_segment": local_segments, "cluster_label": cluster_labels,
+                         "double_latitude": 34.02 + cluster_labels * 0.01 + rng.normal(0, 0.001, rows),
+                         "double_longitude": -118.28 - cluster_labels * 0.01 + rng.normal(0, 0.001, rows),
+                         "duration": rng.choice([0.5, 1.0, 1.5, 5.0], size=rows)})
+    missing_topn = pd.DataFrame({"local_segment": ["a", "a", "a", "b", "b", "c", "c", "c"],
+                                 "cluster_label": [2, 4, 4, 1, 5, 4, 5, 5],
+                                 "double_latitude": [34.03, 34.05, 34.051, 34.02, 34.06, 34.05, 34.06, 34.061],
+                                 "double_longitude": [-118.29, -118.31, -118.311, -118.28, -118.32, -118.31, -118.32, -118.321],
+                                 "duration": [1.0, 2.0, 0.5, 3.0, 1.0, 1.0, 1.0, 4.0]})
+    return pd.concat([data, missing_topn], ignore_index=True)
+
+class DoryabKernelsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.data = [generate_stationary_data(seed) for seed in range(3)]
+
+    def test_radius_of_gyration(self):
+        for data in self.data:
+            pd.testing.assert_series_equal(radius_of_gyration(data), radius_of_gyration_lambdas(data), rtol=1e-9)
+        self.assertTrue(np.isnan(radius_of_gyration(self.data[0].iloc[:0])))
+
+    def test_stay_at_topn_clusters(self):
+        for data in self.data:
+            features = stay_at_topn_clusters(data)
+            pd.testing.assert_frame_equal(features, stay_at_topn_clusters_lambdas(data), check_dtype=False)
+        self.assertEqual(features.loc["c", ["timeattop1location", "timeattop2location", "timeattop3location"]].tolist(), [0, 0, 0])
+        self.assertEqual(features.loc["b", ["timeattop1location", "timeattop2location", "timeattop3location"]].tolist(), [3, 0, 0])
+
+    def test_location_entropy(self):
+        for data in self.data:
+            pd.testing.assert_frame_equal(location_entropy(data), location_entropy_lambdas(data), rtol=1e-9)
+
+
+if __name__ == '__main__':
+    unittest.main()
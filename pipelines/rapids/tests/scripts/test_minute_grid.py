@@ -0,0 +1,88 @@
+import unittest
+import sys
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "src", "features"))
+from utils.minute_grid import MinuteGrid, write_minute_grid
+from utils.utils import filter_data_by_segment
+from fitbit_heartrate_intraday.rapids.main import extractHRFeaturesFromIntradayData
+
+ZONE_FEATURES = ["minutesonoutofrangezone", "minutesonfatburnzone", "minutesoncardiozone", "minutesonpeakzone"]
+
+def generate_heartrate(seed):
+    rng = np.random.default_rng(seed)
+    # samples every few seconds with a gap of a few hours
+    seconds = np.cumsum(rng.choice([1, 5, 15], size=30000))
+    seconds = seconds[(seconds < 20000) | (seconds > 30000)]
+    local_date_times = (pd.Timestamp("2021-03-01 22:13:41") + pd.to_timedelta(seconds, unit="s")).strftime("%Y-%m-%d %H:%M:%S")
+    return pd.DataFrame({"local_date_time": local_date_times, "heartrate": rng.integers(50, 180, len(seconds))})
+
+# Heartrate intraday rows with their zones and the assigned_segments of a daily segment and of a morning segment whose
+# start and end are not on whole minutes
+def generate_heartrate_intraday(seed):
+    data = generate_heartrate(seed)
+    data["device_id"] = "fitbit1"
+    data["heartrate_zone"] = pd.cut(data["heartrate"], [0, 94, 131, 159, 250], labels=["outofrange", "fatburn", "cardio", "peak"]).astype(str)
+    daily = "[daily#" + data["local_date_time"].str[:10] + " 00:00:00," + data["local_date_time"].str[:10] + " 23:59:59;0000000000000,0000000000000]"
+    in_morning = (data["local_date_time"] >= "2021-03-02 06:30:30") & (data["local_date_time"] <= "2021-03-02 09:00:10")
+    morning = np.where(in_morning, "|[morning#2021-03-02 06:30:30,2021-03-02 09:00:10;0000000000000,0000000000000]", "")
+    data["assigned_segments"] = daily + morning
+    return data
+
+# Minutes on each heart rate zone counted from the rows of every segment, as fitbit_heartrate_intraday did before it read
+# the minute grid
+def zone_minutes_from_rows(data, time_segment):
+    num_rows_per_minute = data.groupby(data["local_date_time"].str[:16])["device_id"].count().mean()
+    data = filter_data_by_segment(data.copy(), time_segment)
+    return pd.DataFrame({feature: data[data["heartrate_zone"] == feature[9:-4]].groupby("local_segment")["device_id"].count() / num_rows_per_minute for feature in ZONE_FEATURES}).fillna(0)
+
+class MinuteGridTests(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.data = generate_heartrate(seed=0)
+        write_minute_grid(self.folder.name, self.data["local_date_time"], {"heartrate": (self.data["heartrate"], "mean"), "heartrate_samples": (self.data["heartrate"], "count")})
+        self.grid = MinuteGrid(self.folder.name)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_minutes_match_groupby(self):
+        minutes = self.data.groupby(self.data["local_date_time"].str[:16] + ":00")["heartrate"].agg(["mean", "count"])
+        index = self.grid.minute_index(minutes.index)
+        np.testing.assert_allclose(self.grid.signals["heartrate"][index], minutes["mean"].values)
+        np.testing.assert_array_equal(self.grid.signals["heartrate_samples"][index], minutes["count"].values)
+        # every other minute of the grid has no samples
+        self.assertEqual(np.isnan(self.grid.signals["heartrate"]).sum(), self.grid.minutes - len(minutes))
+        self.assertEqual(str(self.grid.dates[0]), "2021-03-01T22:13")
+
+    def test_segment_matches_string_filter(self):
+        for start, end in [("2021-03-01 00:00:00", "2021-03-01 23:59:59"), ("2021-03-02 00:00:00", "2021-03-02 23:59:59"),
+                           ("2021-03-01 22:30:30", "2021-03-01 23:10:00"), ("2021-03-05 00:00:00", "2021-03-05 23:59:59")]:
+            local_segment = "daily#{},{}".format(start, end)
+            minutes = self.data["local_date_time"].str[:16] + ":00"
+            in_segment = self.data[(minutes >= start) & (minutes <= end)]
+            self.assertEqual(np.nansum(self.grid.segment("heartrate_samples", local_segment)), len(in_segment))
+
+    def test_heartrate_zone_minutes_match_rows(self):
+        data = generate_heartrate_intraday(seed=1)
+        with tempfile.TemporaryDirectory() as folder:
+            write_minute_grid(folder, data["local_date_time"], dict({"heartrate_samples": (data["heartrate"], "size")},
+                                                                  **{zone + "_samples": (data["heartrate_zone"] == zone, "sum") for zone in ["outofrange", "fatburn", "cardio", "peak"]}))
+            grid = MinuteGrid(folder)
+            for time_segment in ["daily", "morning"]:
+                for features in [["maxhr"] + ZONE_FEATURES, ZONE_FEATURES]:
+                    zone_minutes = extractHRFeaturesFromIntradayData(data.copy(), grid, features, time_segment, filter_data_by_segment).set_index("local_segment")
+                    pd.testing.assert_frame_equal(zone_minutes[ZONE_FEATURES].sort_index(), zone_minutes_from_rows(data, time_segment).sort_index(), check_names=False, check_exact=True)
+        self.assertTrue(MinuteGrid.whole_minutes("daily#2021-03-01 00:00:00,2021-03-01 23:59:59"))
+        self.assertFalse(MinuteGrid.whole_minutes("morning#2021-03-02 06:30:30,2021-03-02 09:00:10"))
+
+    def test_memory_mapped(self):
+        self.assertIsInstance(self.grid.signals["heartrate"], np.memmap)
+
+
+if __name__ == '__main__':
+    unittest.main()
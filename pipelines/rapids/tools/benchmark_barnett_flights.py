@@ -0,0 +1,88 @@
+"""
+This script times the flight/pause extraction of Barnett's location features (src/features/phone_locations/barnett/barnett_library.py)
+on a synthetic trajectory.
+
+Input: none, a trajectory of 1Hz GPS samples that stays at a few places and travels between them in straight legs is generated
+---
+Expected output: the number of rows and the wall time of each step, then the time of convert_to_flights_pauses on trajectories
+whose flights get longer (a single straight leg of 1 to 16 hours at 2 m/s) to show how it scales with the length of a flight
+
+How to run it?
+1. Run python tools/benchmark_barnett_flights.py [number of days] from the rapids folder (default 30 days)
+
+"""
+
+import os
+import sys
+import time
+import contextlib
+import io
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "features"))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "features", "phone_locations", "barnett"))
+from barnett_library import preprocessing, convert_to_flights_pauses
+
+def synthetic_trajectory(n_days, seed=0):
+    rng = np.random.default_rng(seed)
+    places = np.array([[34.0224, -118.2851], [34.0522, -118.2437], [34.0736, -118.4004], [33.9850, -118.4695]])
+    start_time = 1590969600
+    end_time = start_time + n_days * 86400
+    current_time, current_place, legs = start_time, 0, []
+    while current_time < end_time:
+        # stay at the current place with a few meters of GPS noise
+        seconds = np.arange(current_time, current_time + rng.integers(30 * 60, 5 * 3600))
+        legs.append(np.column_stack([seconds, places[current_place] + rng.normal(0, 0.00001, (len(seconds), 2))]))
+        current_time = seconds[-1] + 1
+        # travel to the next place through a random waypoint
+        next_place = (current_place + rng.integers(1, len(places))) % len(places)
+        waypoint = (places[current_place] + places[next_place]) / 2 + rng.normal(0, 0.01, 2)
+        for leg_start, leg_end in [(places[current_place], waypoint), (waypoint, places[next_place])]:
+            seconds = np.arange(current_time, current_time + rng.integers(5 * 60, 20 * 60))
+            progress = ((seconds - current_time) / len(seconds))[:, np.newaxis]
+            legs.append(np.column_stack([seconds, leg_start * (1 - progress) + leg_end * progress + rng.normal(0, 0.00001, (len(seconds), 2))]))
+            current_time = seconds[-1] + 1
+        current_place = next_place
+        # the phone does not log locations for a while
+        if rng.random() < 0.3:
+            current_time += rng.integers(10 * 60, 3 * 3600)
+    trajectory = np.vstack(legs)
+    trajectory = trajectory[trajectory[:, 0] < end_time]
+    return pd.DataFrame({"timestamp": (trajectory[:, 0] * 1000).astype(np.int64), "latitude": trajectory[:, 1], "longitude": trajectory[:, 2], "altitude": 0.0, "accuracy": rng.uniform(5, 30, len(trajectory))})
+
+# A pause of 10 minutes followed by one straight leg of leg_minutes at 2 m/s with a few meters of GPS noise
+def long_flight(leg_minutes, seed=0):
+    rng = np.random.default_rng(seed)
+    start_time = 1590969600
+    seconds = np.arange(start_time, start_time + (10 + leg_minutes) * 60)
+    # 2 m/s is about 0.000018 degrees of latitude per second
+    progress = np.maximum(seconds - start_time - 10 * 60, 0)[:, np.newaxis] * np.array([0.000018, 0.000012])
+    trajectory = np.column_stack([seconds, np.array([34.0224, -118.2851]) + progress + rng.normal(0, 0.00001, (len(seconds), 2))])
+    return pd.DataFrame({"timestamp": (trajectory[:, 0] * 1000).astype(np.int64), "latitude": trajectory[:, 1], "longitude": trajectory[:, 2], "altitude": 0.0, "accuracy": rng.uniform(5, 30, len(trajectory))})
+
+if __name__ == "__main__":
+    n_days = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    location_data = synthetic_trajectory(n_days)
+    print("{} days, {} GPS rows".format(n_days, len(location_data)))
+
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        start = time.perf_counter()
+        lonlat, r, w = preprocessing(location_data)
+        preprocessing_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        mobmatmiss = convert_to_flights_pauses(lonlat, r, w)
+        flights_time = time.perf_counter() - start
+
+    print("{:<40}{:>10} rows{:>10.2f} s".format("preprocessing", len(lonlat), preprocessing_time))
+    print("{:<40}{:>10} rows{:>10.2f} s".format("convert_to_flights_pauses", len(mobmatmiss), flights_time))
+
+    print("{:<40}{:>15}{:>15}".format("flight length", "intervals", "seconds"))
+    for leg_minutes in [60, 240, 960]:
+        with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+            lonlat, r, w = preprocessing(long_flight(leg_minutes))
+            start = time.perf_counter()
+            convert_to_flights_pauses(lonlat, r, w)
+            flights_time = time.perf_counter() - start
+        print("{:<40}{:>15}{:>15.3f}".format("{} minutes".format(leg_minutes), len(lonlat), flights_time))
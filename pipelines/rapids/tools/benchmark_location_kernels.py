@@ -0,0 +1,64 @@
+"""
+This script times the distance kernels shared by the location providers (src/features/phone_locations/distances.py)
+against the per-row implementations they replaced.
+
+Input: none, random coordinates around a fixed point are generated
+---
+Expected output: one line per benchmark with the best wall time of a few repetitions
+
+How to run it?
+1. Run python tools/benchmark_location_kernels.py [number of points] from the rapids folder (default 2,000,000 points)
+
+"""
+
+import os
+import sys
+import timeit
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "features"))
+from phone_locations import distances
+
+def old_haversine(lon1, lat1, lon2, lat2):
+    # haversine as it was implemented in doryab_clustering.py and add_doryab_extra_columns.py
+    lon1, lat1, lon2, lat2 = np.radians([lon1, lat1, lon2, lat2])
+    a = np.sin((lat2-lat1)/2.0)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2-lon1)/2.0)**2
+    return 6371 * 2 * np.arcsin(np.sqrt(a)) * 1000
+
+def old_euclidean_to_centroids(x, y, centroids_x, centroids_y, radius):
+    # per element loop as it was implemented in barnett_library.py
+    visited = np.zeros(len(centroids_x))
+    for i in range(len(x)):
+        for j in range(len(centroids_x)):
+            if np.sqrt((centroids_x[j]-x[i])**2 + (centroids_y[j]-y[i])**2) < radius:
+                visited[j] = 1
+    return visited
+
+def best_of(statement, repeat=3):
+    return min(timeit.repeat(statement, number=1, repeat=repeat))
+
+def report(name, seconds):
+    print("{:<60}{:>10.4f} s".format(name, seconds))
+
+if __name__ == "__main__":
+    n_points = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+    rng = np.random.default_rng(0)
+    lon = -118.28 + rng.normal(scale=0.05, size=n_points)
+    lat = 34.02 + rng.normal(scale=0.05, size=n_points)
+    home_lon, home_lat = -118.28, 34.02
+
+    print("{} points, numba {}".format(n_points, "enabled" if distances.USE_NUMBA else "not installed"))
+    distances.haversine(lon[:10], lat[:10], home_lon, home_lat) # warm up (numba compilation)
+
+    report("haversine to a fixed point (old, repeated lists)", best_of(lambda: old_haversine(lon, lat, [home_lon] * n_points, [home_lat] * n_points)))
+    report("haversine to a fixed point (new, scalar broadcast)", best_of(lambda: distances.haversine(lon, lat, home_lon, home_lat)))
+    report("consecutive haversine (old, shifted copies)", best_of(lambda: old_haversine(lon[:-1], lat[:-1], lon[1:], lat[1:])))
+    report("consecutive haversine (new)", best_of(lambda: distances.consecutive_distances(lon, lat)))
+    report("consecutive equirectangular (new)", best_of(lambda: distances.consecutive_distances(lon, lat, method=distances.equirectangular)))
+
+    # Barnett works on projected coordinates, its loops are much slower so they are timed on a smaller sample
+    n_small = min(n_points, 20000)
+    x, y = lon[:n_small] * 1e5, lat[:n_small] * 1e5
+    centroids_x, centroids_y = x[:10], y[:10]
+    report("{} points to 10 centroids (old, per element loop)".format(n_small), best_of(lambda: old_euclidean_to_centroids(x, y, centroids_x, centroids_y, 200), repeat=1))
+    report("{} points to 10 centroids (new)".format(n_small), best_of(lambda: np.any(distances.euclidean_to_centroids(x, y, centroids_x, centroids_y) < 200, axis=0)))
@@ -0,0 +1,56 @@
+"""
+This script parses a raw Fitbit JSON CSV file (the container of the fitbitjson_csv data stream) into a parsed CSV file
+(the container of the fitbitparsed_csv data stream) with bounded memory. The input is read in chunks of rows and the
+parsed samples of each chunk are appended to the output, so a year of intraday data never has to fit in memory at once.
+
+Input: a CSV file with a device_id column and a fitbit_data column with one JSON object (a Fitbit API response) per row
+---
+Expected output: a CSV file with the columns returned by the mutation script (e.g. device_id, heartrate, heartrate_zone,
+local_date_time, timestamp for parse_heartrate_intraday_json.py). Use it as the container of the same sensor in fitbitparsed_csv
+
+How to run it?
+1. Run python tools/parse_fitbit_json_csv.py [input CSV] [output CSV] [mutation script] [workers] [chunk rows] from the rapids folder
+   The mutation script is one of the parse_*_json.py files in src/data/streams/mutations/fitbit (default 1 worker and 10000 rows).
+   parse_sleep_intraday_json.py is not supported because it numbers sleep episodes across all the records of a participant
+
+"""
+
+import os
+import sys
+import importlib
+import pandas as pd
+
+MUTATIONS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src", "data", "streams", "mutations", "fitbit")
+sys.path.append(MUTATIONS_FOLDER)
+
+def parse_fitbit_json_csv(input_file, output_file, mutation_script, workers=1, chunk_rows=10000):
+    mutation_name = os.path.splitext(os.path.basename(mutation_script))[0]
+    if mutation_name == "parse_sleep_intraday_json":
+        raise ValueError("parse_sleep_intraday_json.py numbers sleep episodes across all records, it cannot be parsed in chunks")
+    mutation = importlib.import_module(mutation_name)
+
+    write_header = True
+    parsed_rows = 0
+    for raw_chunk in pd.read_csv(input_file, chunksize=chunk_rows, escapechar="\\", dtype={"device_id": str}):
+        raw_chunk = raw_chunk.rename(columns={"fitbit_data": "json_fitbit_column"})
+        # parsers assume the records of a single device
+        for _, device_chunk in raw_chunk.groupby("device_id", sort=False):
+            parsed_chunk = mutation.main(device_chunk, {"PARSER_WORKERS": workers})
+            if parsed_chunk.empty:
+                continue
+            parsed_chunk.to_csv(output_file, mode="w" if write_header else "a", header=write_header, index=False)
+            write_header = False
+            parsed_rows += len(parsed_chunk)
+
+    if write_header:
+        # nothing was parsed, the output only has the header
+        mutation.main(pd.DataFrame(columns=["device_id", "json_fitbit_column"]), {}).to_csv(output_file, index=False)
+    return parsed_rows
+
+if __name__ == "__main__":
+    if len(sys.argv) < 4:
+        sys.exit("Usage: python tools/parse_fitbit_json_csv.py [input CSV] [output CSV] [mutation script] [workers] [chunk rows]")
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    chunk_rows = int(sys.argv[5]) if len(sys.argv) > 5 else 10000
+    parsed_rows = parse_fitbit_json_csv(sys.argv[1], sys.argv[2], sys.argv[3], workers, chunk_rows)
+    print("Parsed {} rows into {}".format(parsed_rows, sys.argv[2]))